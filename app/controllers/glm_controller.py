@@ -1,6 +1,8 @@
 from fastapi import Query
 from services.glm_service import GLMService, GLMAnalysis
 from controllers.base.base_controller import BaseController
+from utils.executors import endpoint_slot
+from modules.single_flight import request_flights, request_key
 from schemas.glm_schema import ImportDataAfterMapping, ImportValidateRequest, GLMRequest
 
 class GLMController(BaseController):
@@ -16,27 +18,70 @@ class GLMController(BaseController):
         self.router.add_api_route("/glm-2wa/", self.glm_2wa, methods=["POST"])
         self.router.add_api_route("/glm-3wa/", self.glm_3wa, methods=["POST"])
         self.router.add_api_route("/glm-4wa/", self.glm_4wa, methods=["POST"])
+        self.router.add_api_route("/glm-result-cache/invalidate/", self.invalidate_result_cache, methods=["POST"])
+        # Chạy phân tích dưới dạng job: trả về job_id ngay, theo dõi / lấy kết quả qua /jobs/{job_id}
+        self.router.add_api_route("/glm-1wa/jobs/", self.glm_1wa_job, methods=["POST"], status_code=202)
+        self.router.add_api_route("/glm-2wa/jobs/", self.glm_2wa_job, methods=["POST"], status_code=202)
+        self.router.add_api_route("/glm-3wa/jobs/", self.glm_3wa_job, methods=["POST"], status_code=202)
+        self.router.add_api_route("/glm-4wa/jobs/", self.glm_4wa_job, methods=["POST"], status_code=202)
 
     async def mapping_columns(self, url_file: str = Query(..., description="URL của file cần xử lý")):
-        return await self.service.extract_mapping_columns(url_file)
+        async with endpoint_slot("glm_mapping_columns"):
+            return await self.service.extract_mapping_columns(url_file)
 
     async def glm_valid_data(self, request: ImportValidateRequest):
-        return await self.service.glm_valid_data(request)
+        async with endpoint_slot("glm_valid_data"):
+            return await self.service.glm_valid_data(request)
 
     async def glm_import_data_after_mapping(self, request: ImportDataAfterMapping):
-        return await self.service.glm_import_data_after_mapping(request)
+        async with endpoint_slot("glm_import_data_after_mapping"):
+            result = await self.service.glm_import_data_after_mapping(request)
+        # File import có thể ghi đè file cũ cùng key: bỏ các kết quả phân tích vừa giữ lại
+        request_flights.invalidate()
+        return result
+
+    async def invalidate_result_cache(self, table_name: str = Query(..., description="URL (signed / s3://) hoặc S3 key của file dữ liệu đã import")):
+        return await self.analysis.invalidate_result_cache(table_name)
+
+    async def _run_analysis(self, name: str, func, request_body: GLMRequest):
+        async with endpoint_slot(name):
+            return await func(request_body)
 
     async def glm_1wa(self, request_body: GLMRequest):
-        return await self.analysis.glm_1wa(request_body)
+        # Request giống hệt đang chạy / vừa xong (UI retry, nhiều người mở cùng báo cáo) dùng chung kết quả
+        return await request_flights.run(
+            request_key("glm_1wa", request_body), self._run_analysis, "glm_1wa", self.analysis.glm_1wa, request_body
+        )
 
     async def glm_2wa(self, request_body: GLMRequest):
-        return await self.analysis.glm_2wa(request_body)
+        # Request giống hệt đang chạy / vừa xong (UI retry, nhiều người mở cùng báo cáo) dùng chung kết quả
+        return await request_flights.run(
+            request_key("glm_2wa", request_body), self._run_analysis, "glm_2wa", self.analysis.glm_2wa, request_body
+        )
 
     async def glm_3wa(self, request_body: GLMRequest):
-        return await self.analysis.glm_3wa(request_body)
+        # Request giống hệt đang chạy / vừa xong (UI retry, nhiều người mở cùng báo cáo) dùng chung kết quả
+        return await request_flights.run(
+            request_key("glm_3wa", request_body), self._run_analysis, "glm_3wa", self.analysis.glm_3wa, request_body
+        )
 
     async def glm_4wa(self, request_body: GLMRequest):
-        return await self.analysis.glm_4wa(request_body)
+        # Request giống hệt đang chạy / vừa xong (UI retry, nhiều người mở cùng báo cáo) dùng chung kết quả
+        return await request_flights.run(
+            request_key("glm_4wa", request_body), self._run_analysis, "glm_4wa", self.analysis.glm_4wa, request_body
+        )
+
+    async def glm_1wa_job(self, request_body: GLMRequest):
+        return await self.analysis.submit_job("1WA", request_body)
+
+    async def glm_2wa_job(self, request_body: GLMRequest):
+        return await self.analysis.submit_job("2WA", request_body)
+
+    async def glm_3wa_job(self, request_body: GLMRequest):
+        return await self.analysis.submit_job("3WA", request_body)
+
+    async def glm_4wa_job(self, request_body: GLMRequest):
+        return await self.analysis.submit_job("4WA", request_body)
 
 glm_controller = GLMController()
 router = glm_controller.router
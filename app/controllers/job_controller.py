@@ -0,0 +1,25 @@
+from controllers.base.base_controller import BaseController
+from modules.jobs import job_manager
+from utils.executors import run_io, STORAGE_HEAD_TIMEOUT, STORAGE_READ_TIMEOUT
+
+class JobController(BaseController):
+    def __init__(self):
+        super().__init__(prefix="/jobs", tags=["Job Controller"])
+        self.router.add_api_route("/{job_id}", self.job_status, methods=["GET"])
+        self.router.add_api_route("/{job_id}/result", self.job_result, methods=["GET"])
+        self.router.add_api_route("/{job_id}/cancel", self.job_cancel, methods=["POST"])
+
+    async def job_status(self, job_id: str):
+        # Trạng thái / tiến độ, không kèm kết quả (có thể lớn)
+        record = await run_io(job_manager.get, job_id, timeout=STORAGE_HEAD_TIMEOUT, operation="get job")
+        return {key: value for key, value in record.items() if key != "result"}
+
+    async def job_result(self, job_id: str):
+        return await run_io(job_manager.result, job_id, timeout=STORAGE_READ_TIMEOUT, operation="get job result")
+
+    async def job_cancel(self, job_id: str):
+        record = await run_io(job_manager.cancel, job_id, timeout=STORAGE_HEAD_TIMEOUT, operation="cancel job")
+        return {key: value for key, value in record.items() if key != "result"}
+
+job_controller = JobController()
+router = job_controller.router
@@ -0,0 +1,14 @@
+from controllers.base.base_controller import BaseController
+from utils.executors import endpoint_stats
+
+class MetricsController(BaseController):
+    def __init__(self):
+        super().__init__(prefix="/metrics", tags=["Metrics Controller"])
+        self.router.add_api_route("/executors", self.executors, methods=["GET"])
+
+    async def executors(self) -> dict:
+        # Số request đang chạy / đang chờ, thời gian chờ (queue wait) và thời gian chạy của từng endpoint nặng
+        return endpoint_stats()
+
+metrics_controller = MetricsController()
+router = metrics_controller.router
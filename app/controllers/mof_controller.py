@@ -13,6 +13,9 @@ from exceptions import ConflictException
 from controllers.base.base_controller import BaseController
 from utils.database import get_db
 from utils.json_encoder import NpEncoder
+from modules.jobs import job_manager, job_progress
+from utils.executors import run_cpu, run_io, endpoint_slot, STORAGE_WRITE_TIMEOUT
+from modules.single_flight import request_flights, request_key
 from modules.MOF.mof_valid_data import analyze_dataframe
 from modules.MOF.mof_pnt_11 import (
     apply_mapping,
@@ -25,7 +28,16 @@ from modules.MOF.mof_pnt_11 import (
 from modules.MOF.mof_fin_report import (
     create_financial_report
 )
-from modules.db_parquet import read_parquet_from_s3, upload_to_s3, cfg, extract_parquet_key
+from modules.db_parquet import (
+    read_parquet_from_s3_async,
+    read_parquet_dataset_async,
+    write_parquet_to_s3_async,
+    wait_for_uploads_async,
+    cfg,
+    extract_parquet_key,
+    ParquetArtifactWriter,
+    source_lineage,
+)
 from schemas.mof_report import (
     MOF_PNT_11_Request,
     ImportDataAfterMapping,
@@ -48,8 +60,15 @@ class MOFReportController(BaseController):
         )
         self.router.add_api_route("/mof-pnt-11/", self.mof_pnt_11, methods=["POST"])
         self.router.add_api_route("/mof-pnt-bctcq/", self.mof_pnt_bctcq, methods=["POST"])
+        # Chạy báo cáo dưới dạng job: trả về job_id ngay, theo dõi / lấy kết quả qua /jobs/{job_id}
+        self.router.add_api_route("/mof-pnt-11/jobs/", self.mof_pnt_11_job, methods=["POST"], status_code=202)
+        self.router.add_api_route("/mof-pnt-bctcq/jobs/", self.mof_pnt_bctcq_job, methods=["POST"], status_code=202)
 
     async def mof_valid_data(self, request_body: ImportValidateRequest):
+        async with endpoint_slot("mof_valid_data"):
+            return await self._mof_valid_data(request_body)
+
+    async def _mof_valid_data(self, request_body: ImportValidateRequest):
         start_time = datetime.now()
 
         # Extract and validate request data
@@ -69,9 +88,9 @@ class MOFReportController(BaseController):
         # Parse file
         try:
             if file_extension == ".csv":
-                df_import = pd.read_csv(io.BytesIO(contents), skiprows=1)
+                df_import = await run_cpu(pd.read_csv, io.BytesIO(contents), skiprows=1)
             elif file_extension in [".xlsx", ".xls", ".xlsm"]:
-                df_import = pd.read_excel(io.BytesIO(contents), skiprows=1)
+                df_import = await run_cpu(pd.read_excel, io.BytesIO(contents), skiprows=1)
             else:
                 raise HTTPException(status_code=400, detail="Unsupported file format")
         except ValueError as e:
@@ -100,7 +119,7 @@ class MOFReportController(BaseController):
                 rq2json = json.dumps(request_body.model_dump(), ensure_ascii=False, indent=4)
 
                 validation_results = None
-                validation_results = analyze_dataframe(df, json.loads(rq2json))
+                validation_results = await run_cpu(analyze_dataframe, df, json.loads(rq2json))
 
                 if not validation_results:
                     raise HTTPException(
@@ -114,7 +133,7 @@ class MOFReportController(BaseController):
                 ]
 
                 # Serialize validation results
-                updated_json_data = json.dumps(validation_results[0], cls=NpEncoder, indent=4)
+                updated_json_data = await run_cpu(json.dumps, validation_results[0], cls=NpEncoder, indent=4)
 
                 # Check validation results
                 has_type_errors = len(validation_results[0]["error_details"]["type_check"]) > 0
@@ -164,6 +183,13 @@ class MOFReportController(BaseController):
     async def mof_import_data_after_maping(
         self, request_body: ImportDataAfterMapping, db: Session = Depends(get_db)
     ):
+        async with endpoint_slot("mof_import_data_after_mapping"):
+            result = await self._mof_import_data_after_maping(request_body)
+        # File import có thể ghi đè file cũ cùng key: bỏ các báo cáo vừa giữ lại
+        request_flights.invalidate()
+        return result
+
+    async def _mof_import_data_after_maping(self, request_body: ImportDataAfterMapping):
         start_time = datetime.now()
 
         # Extract and validate request data
@@ -189,9 +215,9 @@ class MOFReportController(BaseController):
         # Parse file
         try:
             if file_extension == ".csv":
-                df_import = pd.read_csv(io.BytesIO(contents), skiprows=1)
+                df_import = await run_cpu(pd.read_csv, io.BytesIO(contents), skiprows=1)
             elif file_extension in [".xlsx", ".xls", ".xlsm"]:
-                df_import = pd.read_excel(io.BytesIO(contents), skiprows=1)
+                df_import = await run_cpu(pd.read_excel, io.BytesIO(contents), skiprows=1)
             else:
                 raise HTTPException(status_code=400, detail="Unsupported file format")
         except ValueError as e:
@@ -232,43 +258,7 @@ class MOFReportController(BaseController):
 
         # Convert columns based on settings
         try:
-            date_formats = [
-                "%d/%m/%Y %H:%M",  # 01/01/2019 01:15
-                "%d/%m/%Y",  # 01/01/2019
-                "%Y-%m-%d %H:%M:%S",  # 2019-01-01 01:15:00
-                "%Y-%m-%d",  # 2019-01-01
-            ]
-
-            for col, dtype in system_name_type.items():
-                if dtype.lower() == "date":
-                    for date_format in date_formats:
-                        try:
-                            df[col] = pd.to_datetime(
-                                df[col].astype(str).str.strip(),
-                                format=date_format,
-                                errors="raise",
-                            )
-                            break
-                        except ValueError:
-                            continue
-
-                    if not pd.api.types.is_datetime64_any_dtype(df[col]):
-                        df[col] = pd.to_datetime(df[col], errors="coerce")
-
-                    if hasattr(df[col], "dt") and df[col].dt.tz:
-                        df[col] = df[col].dt.tz_localize(None)
-
-                    df[col] = pd.to_datetime(df[col].dt.strftime("%Y-%m-%d"))
-                elif dtype.lower() == "double" or dtype.lower() == "integer":
-                    df[col] = pd.to_numeric(df[col], errors="coerce")
-                elif dtype.lower() == "text":
-                    # df[col] = df[col].apply(lambda x: str(x) if not pd.isnull(x) else "Unknown")
-                    df[col] = df[col].astype(str).fillna("Unknown")
-
-            # Change format of COVERAGE_ID column to "0xxxxx"
-            if "COVERAGE_ID" in df.columns:
-                pattern = re.compile(r"^0.")
-                df["COVERAGE_ID"] = df["COVERAGE_ID"].astype(str).agg(lambda x: f"0{x}" if not pattern.match(x) else x)
+            df = await run_cpu(self._convert_import_columns, df, system_name_type)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Error converting columns: {str(e)}")
 
@@ -295,15 +285,17 @@ class MOFReportController(BaseController):
 
         # Lưu file parquet lên S3
         try:
-            buffer = io.BytesIO()
-            df.to_parquet(buffer, index=False)
-            buffer.seek(0)
-            upload_to_s3(
-                bucket=cfg["BUCKET"],
-                key=s3_key,
-                data_bytes=buffer.getvalue(),
-                mimetype="application/octet-stream"
-            )
+            try:
+                await write_parquet_to_s3_async(df, s3_key, profile="bulk_import", lineage=[source_lineage(rq_url)])
+            except HTTPException:
+                # Timeout (504) của IO executor: không thử lại với writer mặc định
+                raise
+            except Exception as arrow_error:
+                # Ví dụ coerce_timestamps='ms' của bulk_import làm mất độ chính xác timestamp (ArrowInvalid)
+                print(f"⚠️ Arrow failed, using default parquet settings: {arrow_error}")
+                await write_parquet_to_s3_async(df, s3_key, lineage=[source_lineage(rq_url)])
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error uploading parquet to S3: {str(e)}")
 
@@ -320,6 +312,16 @@ class MOFReportController(BaseController):
         }
 
     async def mof_pnt_11(self, request_body: MOF_PNT_11_Request):
+        # Request giống hệt đang chạy / vừa xong dùng chung kết quả
+        return await request_flights.run(
+            request_key("mof_pnt_11", request_body), self._run_report, "mof_pnt_11", self._mof_pnt_11, request_body
+        )
+
+    async def _run_report(self, name: str, func, request_body):
+        async with endpoint_slot(name):
+            return await func(request_body)
+
+    async def _mof_pnt_11(self, request_body: MOF_PNT_11_Request):
         start_time = datetime.now()
         
         user_name = request_body.userName
@@ -336,16 +338,19 @@ class MOFReportController(BaseController):
         ]
 
         dfs = {} # dict with key as 'gwp', 'clm', 'res' and value as DataFrame
-        for key, setting in settings_list:
+        source_keys = [] # các file input, lưu vào lineage của báo cáo
+        for step, (key, setting) in enumerate(settings_list):
             try:
                 if key == "beg_report" and setting is None:
                     continue # Skip if no begining report settings
+                job_progress(step, len(settings_list) + 2, f"Loading {key.upper()} data")
                 table_name = setting.tableName
                 valid_status = setting.validStatus
                 # Lấy key file parquet từ URL
                 parquet_key = extract_parquet_key(table_name)
-                # Đọc file parquet từ S3
-                df = read_parquet_from_s3(parquet_key)
+                source_keys.append(parquet_key)
+                # Đọc file parquet từ S3 qua pyarrow.dataset; PNT-11 tổng hợp mọi dòng của file input nên không lọc theo năm
+                df = await read_parquet_dataset_async(parquet_key)
                 if key != "beg_report":
                     var_single_settings = setting.setting_cols.var_single_settings
                     var_cate_settings = setting.setting_cols.var_cate_settings
@@ -356,7 +361,7 @@ class MOFReportController(BaseController):
                             detail=f"Data in {key.upper()} needs to be validated before processing",
                         )
 
-                    dfs[key] = apply_mapping(df,var_single_settings, var_cate_settings)
+                    dfs[key] = await run_cpu(apply_mapping, df, var_single_settings, var_cate_settings)
                 else:
                     if valid_status != "hoan_thanh":
                         raise HTTPException(
@@ -367,24 +372,18 @@ class MOFReportController(BaseController):
 
             except KeyError as e:
                 raise HTTPException(status_code=409, detail=f"Missing required field in {key.upper()}: {str(e)}")
+            except HTTPException:
+                raise
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Error loading {key.upper()} parquet: {str(e)}")
 
         # process GWP, CLM, and RES data
+        job_progress(len(settings_list), len(settings_list) + 2, "Summarizing report")
         try:
-            dfgwp = summary_gwp(dfs["gwp"])
-            dfclm = summary_claim(dfs["clm"])
-            dfres = summary_reserve(dfs["res"],request_body.res_json_settings.templateName)
-            if request_body.begining_report is not None:
-                dfbeg = summary_begining_report(dfs["beg_report"])
-                dfcombine = combine_summaries(dfgwp, dfclm, dfres, dfbeg)
-            else:
-                if request_body.res_json_settings.templateName != "RES_PNT_11_02":
-                    raise HTTPException(
-                        status_code=409,
-                        detail="Vui lòng sử dụng mẫu RES_PNT_11_02 để có số liệu đầu kỳ!",
-                    )
-                dfcombine = combine_summaries(dfgwp, dfclm, dfres, None)
+            dfcombine = await run_cpu(
+                self._summarize_pnt_11, dfs, request_body.res_json_settings.templateName,
+                request_body.begining_report is not None
+            )
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error processing data: {str(e)}")
         
@@ -403,16 +402,12 @@ class MOFReportController(BaseController):
             raise HTTPException(status_code=500, detail=f"Error generating table name: {str(e)}")
 
         # Lưu file parquet lên S3
+        job_progress(len(settings_list) + 1, len(settings_list) + 2, "Uploading report")
         try:
-            buffer = io.BytesIO()
-            dfcombine.to_parquet(buffer, index=False)
-            buffer.seek(0)
-            upload_to_s3(
-                bucket=cfg["BUCKET"],
-                key=s3_key,
-                data_bytes=buffer.getvalue(),
-                mimetype="application/octet-stream"
-            )
+            await write_parquet_to_s3_async(dfcombine, s3_key, profile="small_report", lineage=source_keys)
+        except HTTPException:
+            # Timeout (504) của IO executor
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error uploading parquet to S3: {str(e)}")
 
@@ -429,6 +424,13 @@ class MOFReportController(BaseController):
         }
     
     async def mof_pnt_bctcq(self, request_body: FinancialStatementRequest):
+        # Request giống hệt đang chạy / vừa xong dùng chung kết quả
+        return await request_flights.run(
+            request_key("mof_pnt_bctcq", request_body), self._run_report, "mof_pnt_bctcq", self._mof_pnt_bctcq,
+            request_body
+        )
+
+    async def _mof_pnt_bctcq(self, request_body: FinancialStatementRequest):
         start_time = datetime.now()
         user_id = request_body.userID
         user_name = request_body.userName
@@ -455,7 +457,9 @@ class MOFReportController(BaseController):
             # Lấy key file parquet từ URL
             parquet_key = extract_parquet_key(table_name)
             # Đọc file parquet từ S3
-            gl_data = read_parquet_from_s3(parquet_key)
+            job_progress(0, 3, "Loading GL data")
+            gl_data = await read_parquet_from_s3_async(parquet_key)
+            source_keys = [parquet_key] # các file input, lưu vào lineage của báo cáo
             
             # 2. Validate DEBIT_ACC và CREDIT_ACC mapping
             var_single_settings = gl_settings.setting_cols.var_single_settings
@@ -515,16 +519,18 @@ class MOFReportController(BaseController):
                         )
                     
                     beg_parquet_key = extract_parquet_key(beg_table_name)
-                    opening_balance_data = read_parquet_from_s3(beg_parquet_key)
+                    opening_balance_data = await read_parquet_from_s3_async(beg_parquet_key)
+                    source_keys.append(beg_parquet_key)
                     
                 except Exception as e:
                     # Log warning but continue without opening balance
                     print(f"Warning: Could not load opening balance data: {str(e)}")
                     opening_balance_data = None
 
-            results = create_financial_report(gl_data, user_id, type_company
-                                              , opening_balance_data, report_year
-                                              , report_period_code, report_period_value
+            job_progress(1, 3, "Creating financial reports")
+            results = await run_cpu(create_financial_report, gl_data, user_id, type_company
+                                    , opening_balance_data, report_year
+                                    , report_period_code, report_period_value
             )
             # 4. Process Trial Balance
             if results["trial_balance"] is None or results["trial_balance"].empty:
@@ -544,103 +550,33 @@ class MOFReportController(BaseController):
             # Generate file names
             base_name = f"{user_name}_{report_code}_{report_year}{report_period_code}{report_period_value}"
             
-            saved_files = []
-            
-            # Save Trial Balance
-            if trial_balance is not None and not trial_balance.empty:
-                tb_file_name = f"{base_name}_TRIAL_BALANCE.parquet"
-                tb_s3_key = f"report-software/mof/{user_name}/financial_reports/{tb_file_name}"
-                
-                buffer = io.BytesIO()
-                trial_balance.to_parquet(buffer, index=False)
-                buffer.seek(0)
-                upload_to_s3(
-                    bucket=cfg["BUCKET"],
-                    key=tb_s3_key,
-                    data_bytes=buffer.getvalue(),
-                    mimetype="application/octet-stream"
-                )
-                saved_files.append({"type": "trial_balance", "file_name": tb_file_name, "s3_key": tb_s3_key})
-            
-            # Save Balance Sheet
-            if balance_sheet is not None and not balance_sheet.empty:
-                bs_file_name = f"{base_name}_BALANCE_SHEET.parquet"
-                bs_s3_key = f"report-software/mof/{user_name}/financial_reports/{bs_file_name}"
-                
-                buffer = io.BytesIO()
-                balance_sheet.to_parquet(buffer, index=False)
-                buffer.seek(0)
-                upload_to_s3(
-                    bucket=cfg["BUCKET"],
-                    key=bs_s3_key,
-                    data_bytes=buffer.getvalue(),
-                    mimetype="application/octet-stream"
-                )
-                saved_files.append({"type": "balance_sheet", "file_name": bs_file_name, "s3_key": bs_s3_key})
-            
-            # Save PL01
-            if pl01_report is not None and not pl01_report.empty:
-                pl01_file_name = f"{base_name}_PL01.parquet"
-                pl01_s3_key = f"report-software/mof/{user_name}/financial_reports/{pl01_file_name}"
-                
-                buffer = io.BytesIO()
-                pl01_report.to_parquet(buffer, index=False)
-                buffer.seek(0)
-                upload_to_s3(
-                    bucket=cfg["BUCKET"],
-                    key=pl01_s3_key,
-                    data_bytes=buffer.getvalue(),
-                    mimetype="application/octet-stream"
-                )
-                saved_files.append({"type": "pl01", "file_name": pl01_file_name, "s3_key": pl01_s3_key})
-            
-            # Save PL02
-            if pl02_report is not None and not pl02_report.empty:
-                pl02_file_name = f"{base_name}_PL02.parquet"
-                pl02_s3_key = f"report-software/mof/{user_name}/financial_reports/{pl02_file_name}"
-                
-                buffer = io.BytesIO()
-                pl02_report.to_parquet(buffer, index=False)
-                buffer.seek(0)
-                upload_to_s3(
-                    bucket=cfg["BUCKET"],
-                    key=pl02_s3_key,
-                    data_bytes=buffer.getvalue(),
-                    mimetype="application/octet-stream"
-                )
-                saved_files.append({"type": "pl02", "file_name": pl02_file_name, "s3_key": pl02_s3_key})
-            
-            # Save CF01
-            if cf01_report is not None and not cf01_report.empty:
-                cf01_file_name = f"{base_name}_CF01.parquet"
-                cf01_s3_key = f"report-software/mof/{user_name}/financial_reports/{cf01_file_name}"
-                
-                buffer = io.BytesIO()
-                cf01_report.to_parquet(buffer, index=False)
-                buffer.seek(0)
-                upload_to_s3(
-                    bucket=cfg["BUCKET"],
-                    key=cf01_s3_key,
-                    data_bytes=buffer.getvalue(),
-                    mimetype="application/octet-stream"
-                )
-                saved_files.append({"type": "cf01", "file_name": cf01_file_name, "s3_key": cf01_s3_key})
-
-            # Save CF02
-            if cf02_report is not None and not cf02_report.empty:
-                cf02_file_name = f"{base_name}_CF02.parquet"
-                cf02_s3_key = f"report-software/mof/{user_name}/financial_reports/{cf02_file_name}"
-                
-                buffer = io.BytesIO()
-                cf02_report.to_parquet(buffer, index=False)
-                buffer.seek(0)
-                upload_to_s3(
-                    bucket=cfg["BUCKET"],
-                    key=cf02_s3_key,
-                    data_bytes=buffer.getvalue(),
-                    mimetype="application/octet-stream"
-                )
-                saved_files.append({"type": "cf02", "file_name": cf02_file_name, "s3_key": cf02_s3_key})
+            # Serialize và upload song song các báo cáo (thứ tự kết quả giữ nguyên như danh sách dưới)
+            reports = [
+                ("trial_balance", "TRIAL_BALANCE", trial_balance),
+                ("balance_sheet", "BALANCE_SHEET", balance_sheet),
+                ("pl01", "PL01", pl01_report),
+                ("pl02", "PL02", pl02_report),
+                ("cf01", "CF01", cf01_report),
+                ("cf02", "CF02", cf02_report),
+            ]
+
+            job_progress(2, 3, "Uploading reports")
+            writer = ParquetArtifactWriter()
+            file_names = {}
+            for report_type, suffix, report_df in reports:
+                if report_df is not None and not report_df.empty:
+                    file_name = f"{base_name}_{suffix}.parquet"
+                    s3_key = f"report-software/mof/{user_name}/financial_reports/{file_name}"
+                    file_names[report_type] = file_name
+                    writer.submit(report_type, report_df, s3_key, profile="small_report", lineage=source_keys)
+
+            upload_results = await wait_for_uploads_async(writer)
+            ParquetArtifactWriter.raise_for_errors(upload_results)
+
+            saved_files = [
+                {"type": item["name"], "file_name": file_names[item["name"]], "s3_key": item["s3_key"]}
+                for item in upload_results
+            ]
 
         except HTTPException:
             # Re-raise HTTP exceptions
@@ -668,5 +604,77 @@ class MOFReportController(BaseController):
             },
         }
 
+    @staticmethod
+    def _convert_import_columns(df: pd.DataFrame, system_name_type: dict) -> pd.DataFrame:
+        """Chuyển kiểu các cột của file import MOF theo data_type của thiết lập mapping"""
+        date_formats = [
+            "%d/%m/%Y %H:%M",  # 01/01/2019 01:15
+            "%d/%m/%Y",  # 01/01/2019
+            "%Y-%m-%d %H:%M:%S",  # 2019-01-01 01:15:00
+            "%Y-%m-%d",  # 2019-01-01
+        ]
+
+        for col, dtype in system_name_type.items():
+            if dtype.lower() == "date":
+                for date_format in date_formats:
+                    try:
+                        df[col] = pd.to_datetime(
+                            df[col].astype(str).str.strip(),
+                            format=date_format,
+                            errors="raise",
+                        )
+                        break
+                    except ValueError:
+                        continue
+
+                if not pd.api.types.is_datetime64_any_dtype(df[col]):
+                    df[col] = pd.to_datetime(df[col], errors="coerce")
+
+                if hasattr(df[col], "dt") and df[col].dt.tz:
+                    df[col] = df[col].dt.tz_localize(None)
+
+                df[col] = pd.to_datetime(df[col].dt.strftime("%Y-%m-%d"))
+            elif dtype.lower() == "double" or dtype.lower() == "integer":
+                df[col] = pd.to_numeric(df[col], errors="coerce")
+            elif dtype.lower() == "text":
+                # df[col] = df[col].apply(lambda x: str(x) if not pd.isnull(x) else "Unknown")
+                df[col] = df[col].astype(str).fillna("Unknown")
+
+        # Change format of COVERAGE_ID column to "0xxxxx"
+        if "COVERAGE_ID" in df.columns:
+            pattern = re.compile(r"^0.")
+            df["COVERAGE_ID"] = df["COVERAGE_ID"].astype(str).agg(lambda x: f"0{x}" if not pattern.match(x) else x)
+        return df
+
+    @staticmethod
+    def _summarize_pnt_11(dfs: dict, template_name: str, has_begining_report: bool) -> pd.DataFrame:
+        """Tổng hợp GWP / CLM / RES (và số liệu đầu kỳ nếu có) thành bảng PNT-11"""
+        dfgwp = summary_gwp(dfs["gwp"])
+        dfclm = summary_claim(dfs["clm"])
+        dfres = summary_reserve(dfs["res"],template_name)
+        if has_begining_report:
+            dfbeg = summary_begining_report(dfs["beg_report"])
+            dfcombine = combine_summaries(dfgwp, dfclm, dfres, dfbeg)
+        else:
+            if template_name != "RES_PNT_11_02":
+                raise HTTPException(
+                    status_code=409,
+                    detail="Vui lòng sử dụng mẫu RES_PNT_11_02 để có số liệu đầu kỳ!",
+                )
+            dfcombine = combine_summaries(dfgwp, dfclm, dfres, None)
+        return dfcombine
+
+    async def mof_pnt_11_job(self, request_body: MOF_PNT_11_Request):
+        return await run_io(
+            job_manager.submit, "mof_pnt_11", self._mof_pnt_11, request_body,
+            dedupe_key=request_key("mof_pnt_11", request_body), timeout=STORAGE_WRITE_TIMEOUT, operation="submit job"
+        )
+
+    async def mof_pnt_bctcq_job(self, request_body: FinancialStatementRequest):
+        return await run_io(
+            job_manager.submit, "mof_pnt_bctcq", self._mof_pnt_bctcq, request_body,
+            dedupe_key=request_key("mof_pnt_bctcq", request_body), timeout=STORAGE_WRITE_TIMEOUT, operation="submit job"
+        )
+
 mof_car_controller = MOFReportController()
 router = mof_car_controller.router
@@ -3,6 +3,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from controllers.ping_controller import router as ping_router
 from controllers.glm_controller import router as glm_router
 from controllers.mof_controller import router as mof_router
+from controllers.job_controller import router as job_router
+from controllers.metrics_controller import router as metrics_router
+from modules.jobs import job_manager
 
 app = FastAPI(title="mcp_export", version="0.1.0")
 
@@ -17,6 +20,13 @@ app.add_middleware(
 app.include_router(ping_router)
 app.include_router(glm_router)
 app.include_router(mof_router)
+app.include_router(job_router)
+app.include_router(metrics_router)
+
+@app.on_event("startup")
+async def start_job_maintenance():
+    # Heartbeat cho job của worker này + đánh dấu job mồ côi (worker cũ đã chết) và dọn bản ghi job quá hạn
+    job_manager.start()
 
 @app.get("/")
 async def root():
@@ -0,0 +1,166 @@
+import os
+import json
+from functools import lru_cache
+from typing import Optional
+import numpy as np
+import pandas as pd
+from modules.GLM.glm_varb_analysis import generate_amount_labels, generate_single_unit_labels
+
+# Tắt để _process_category_columns dùng lại categorize_car / categorize_health (pd.cut) như trước
+GLM_BINNING_ENGINE_ENABLED = os.getenv("GLM_BINNING_ENGINE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Key trong metadata của file parquet import chứa thiết lập bin của các cột _GROUP đã lưu sẵn
+BIN_SPECS_METADATA_KEY = "glm_bins"
+NAN_LABEL = "NaN"
+# Số cạnh bin tối đa để tìm bin bằng so sánh thay vì np.searchsorted (mã bin vẫn vừa int8)
+_COMPARE_MAX_EDGES = 32
+
+# Biến phân nhóm của từng sản phẩm → kiểu nhãn, giống categorize_car / categorize_health
+_LABEL_KINDS = {
+    "CAR": {
+        "VEHICLE_VALUE_GROUP": "amount",
+        "VEHICLE_AGE_GROUP": "single_unit",
+        "VEHICLE_SEATS_GROUP": "single_unit",
+    },
+    "HEALTH": {
+        "SUM_ASSURED_GROUP": "amount",
+        "CERT_AGE_GROUP": "single_unit",
+        "BENEFIT_CODE_GROUP": "single_unit",
+    },
+}
+
+class BinSpec:
+    """
+    Thiết lập bin đã biên dịch của một biến: cạnh bin (float64), nhãn và CategoricalDtype (ordered) dùng chung.
+
+    assign() cho kết quả giống pd.cut(bins=..., labels=..., include_lowest=True) của categorize_car / categorize_health:
+    tìm bin trên mảng float64 (so sánh với từng cạnh hoặc np.searchsorted) rồi tạo Categorical từ mã số nguyên,
+    giá trị ngoài khoảng / không phải số vào category 'NaN' (chỉ thêm category này khi có giá trị như vậy).
+    """
+
+    def __init__(self, product_name: str, var_name: str, bins: tuple, unit: str, edges: np.ndarray, labels: list):
+        self.product_name = product_name
+        self.var_name = var_name
+        self.bins = bins
+        self.unit = unit
+        self.edges = edges
+        self.labels = labels
+        self.dtype = pd.CategoricalDtype(labels, ordered=True)
+        self.dtype_with_nan = pd.CategoricalDtype(labels + [NAN_LABEL], ordered=True)
+        self.code_dtype = np.int8 if len(labels) + 1 <= np.iinfo(np.int8).max else np.int32
+
+    def codes(self, values) -> np.ndarray:
+        """Mã bin của từng giá trị (theo thứ tự nhãn); len(labels) cho giá trị vào category 'NaN'"""
+        x = pd.to_numeric(values, errors='coerce')
+        x = np.asarray(x, dtype=np.float64)
+        if len(self.edges) <= _COMPARE_MAX_EDGES:
+            # Ít cạnh (trường hợp thường gặp): đếm số cạnh < x bằng các phép so sánh vector,
+            # nhanh hơn searchsorted (tìm nhị phân từng phần tử) mà cho cùng kết quả side='left'
+            ids = np.zeros(len(x), dtype=np.int8)
+            for edge in self.edges:
+                ids += x > edge
+        else:
+            ids = np.searchsorted(self.edges, x, side='left')
+        # include_lowest: giá trị bằng cạnh đầu tiên thuộc bin đầu tiên
+        ids[x == self.edges[0]] = 1
+        missing = np.isnan(x) | (ids == 0) | (ids == len(self.edges))
+        codes = (ids - 1).astype(self.code_dtype)
+        codes[missing] = len(self.labels)
+        return codes
+
+    def assign(self, values) -> pd.Categorical:
+        codes = self.codes(values)
+        if (codes == len(self.labels)).any():
+            return pd.Categorical.from_codes(codes, dtype=self.dtype_with_nan)
+        return pd.Categorical.from_codes(codes, dtype=self.dtype)
+
+    def restore(self, series: pd.Series) -> pd.Series:
+        """Cột đã phân nhóm đọc lại từ file import: đưa về đúng category như assign() trên cùng các dòng"""
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            categories = series.cat.categories
+            has_nan = NAN_LABEL in categories and bool((series.cat.codes == categories.get_loc(NAN_LABEL)).any())
+        else:
+            has_nan = bool((series == NAN_LABEL).any())
+        return series.astype(self.dtype_with_nan if has_nan else self.dtype)
+
+    def to_metadata(self) -> dict:
+        return {
+            "product": self.product_name,
+            "bins": ["Infinity" if edge == float("inf") else edge for edge in self.bins],
+            "unit": self.unit,
+        }
+
+    def matches(self, stored: Optional[dict]) -> bool:
+        return stored == self.to_metadata()
+
+@lru_cache(maxsize=256)
+def compile_bin_spec(product_name: str, var_name: str, bins: tuple, unit: str) -> Optional[BinSpec]:
+    """
+    Biên dịch (và cache) thiết lập bin của một biến.
+    Trả về None khi engine không xử lý được (biến không có nhãn, bin rỗng / không tăng dần, nhãn trùng...):
+    caller dùng categorize_car / categorize_health để giữ nguyên kết quả và thông báo lỗi như trước.
+    """
+    kind = _LABEL_KINDS.get(product_name, {}).get(var_name)
+    if kind is None or not bins:
+        return None
+    try:
+        if kind == "amount":
+            edges, labels = generate_amount_labels(list(bins), unit="m")  # hardcode for đồng or VND
+        else:
+            edges, labels = generate_single_unit_labels(list(bins), unit)
+        edges = np.asarray(edges, dtype=np.float64)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if len(edges) != len(labels) + 1 or len(labels) == 0 or np.isnan(edges).any() \
+            or not np.all(np.diff(edges) > 0) or len(set(labels)) != len(labels) or NAN_LABEL in labels:
+        return None
+    return BinSpec(product_name, var_name, bins, unit, edges, list(labels))
+
+def parse_bin_setting(setting) -> tuple:
+    """(cột _GROUP, tuple bins với 'Infinity' → inf, unit) từ một phần tử của var_cate_settings"""
+    col = list(setting.keys())[0]
+    var_settings = setting[col]
+    if isinstance(var_settings, dict):
+        bins, unit = var_settings["bin"], var_settings.get("unit")
+    else:
+        bins, unit = var_settings.bin, var_settings.unit
+    bins = tuple(float("inf") if x == "Infinity" else float(x) for x in bins)
+    return col, bins, unit
+
+def source_column(col: str) -> str:
+    """Cột gốc của biến phân nhóm (bỏ hậu tố _GROUP)"""
+    return col.split("_GROUP")[0]
+
+def bin_specs_metadata(specs: dict) -> dict:
+    """Metadata parquet cho các cột đã phân nhóm lưu cùng file import: {cột _GROUP: thiết lập bin}"""
+    return {BIN_SPECS_METADATA_KEY: json.dumps({col: spec.to_metadata() for col, spec in specs.items()})}
+
+def stored_bin_specs(metadata: Optional[dict]) -> dict:
+    """Đọc lại thiết lập bin từ metadata của file (xem bin_specs_metadata), {} nếu không có / không đọc được"""
+    raw = (metadata or {}).get(BIN_SPECS_METADATA_KEY)
+    if not raw:
+        return {}
+    try:
+        stored = json.loads(raw)
+    except (TypeError, ValueError):
+        return {}
+    return stored if isinstance(stored, dict) else {}
+
+def bin_columns(df: pd.DataFrame, var_category_settings: list, product_name: str) -> dict:
+    """
+    Phân nhóm các cột _GROUP của file import theo var_cate_settings, để lưu sẵn cùng file.
+    Chỉ các biến engine biên dịch được mới được thêm vào df; trả về {cột _GROUP: BinSpec} của các cột đã thêm.
+    """
+    specs = {}
+    if df.empty:
+        return specs
+    for setting in var_category_settings:
+        col, bins, unit = parse_bin_setting(setting)
+        col_import = source_column(col)
+        if col == col_import or col_import not in df.columns:
+            continue
+        spec = compile_bin_spec(product_name, col, bins, unit)
+        if spec is None:
+            continue
+        df[col] = spec.assign(df[col_import])
+        specs[col] = spec
+    return specs
@@ -0,0 +1,237 @@
+import os
+import copy
+import numpy as np
+import pandas as pd
+from modules.GLM.glm_varb_analysis import setup_analysis_params, claim_columns
+from modules.GLM.glm_kernel import (
+    factorize_dim, level_index, group_sums, downcast_sums, group_nunique, first_occurrence_mask,
+    present_codes, cartesian_groups
+)
+
+# Số nhóm tối đa (năm × tích số mức của các biến) để suy bảng từ cube; vượt quá thì dùng hàm gốc
+GLM_CUBE_MAX_GROUPS = int(os.getenv("GLM_CUBE_MAX_GROUPS", 5_000_000))
+
+class GLMCube:
+    """
+    Data cube của dữ liệu phân tích GLM: gom các dòng thành cell theo (năm, mã của mọi biến phân tích).
+
+    Mỗi cell lưu:
+    - các measure cộng được: NUM_CLAIMS, CLAIM_PMT (mọi dòng, một cặp cho mỗi additional code) và EXPOSURE_YEAR, EXPOSURE_PREM, SUM_ASSURED
+      (chỉ dòng đầu tiên của mỗi COUNT_NAME trong năm, tương đương drop_duplicates của calculate_pivot_tables)
+    - tập ID hợp đồng / chứng nhận (số thứ tự của COUNT_NAME) dạng CSR: id_values[id_indptr[c]:id_indptr[c + 1]]
+      đã sắp xếp, để đếm nunique chính xác khi gộp cell (không cộng được như các measure khác)
+
+    Bảng k chiều bất kỳ (2WA / 3WA / 4WA) được suy ra bằng cách gộp cell thay vì quét lại toàn bộ dòng
+    cho từng tổ hợp biến và từng năm. Năm 0 (tất cả các năm) là một grouping set riêng vì dòng đầu tiên
+    của mỗi COUNT_NAME khác với khi tính theo từng năm.
+
+    So với calculate_pivot_tables trên từng năm: số đếm (nunique ID, NUM_CLAIMS nguyên) chính xác; tổng float
+    (CLAIM_PMT, EXPOSURE_*, SUM_ASSURED) cộng theo thứ tự khác nên chỉ khớp trong rtol 1e-9, không trùng từng bit.
+    """
+
+    def __init__(self, df_table: pd.DataFrame, dims: list, years: list, productName: str,
+                 additional_apply: bool, additional_codes: str, claim_codes: list = None):
+        """:param claim_codes: nếu có, cell chứa cột NUM_CLAIMS / CLAIM_PMT của tất cả các code này (xem select_code_pivot)"""
+        df_table['CAL_YEAR'] = df_table['CAL_YEAR'].astype(int)
+        COUNT_NAME, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED = setup_analysis_params(
+            productName, additional_apply, additional_codes
+        )
+        if claim_codes is None:
+            claims = [NUM_CLAIMS, CLAIM_PMT]
+        else:
+            claims = [col for col in claim_columns(productName, additional_apply, claim_codes) if col in df_table.columns]
+        self.columns = (COUNT_NAME, claims, SUM_ASSURED)
+        self.dims = list(dict.fromkeys(dims))
+
+        # Mã số nguyên của từng biến: category → mã category (đủ mọi category), biến thường → factorize có sắp xếp
+        self.levels = {}
+        dim_codes = {}
+        for dim in self.dims:
+            codes, levels, ordered = factorize_dim(df_table[dim])
+            self.levels[dim] = (levels, ordered)
+            dim_codes[dim] = codes
+
+        count_codes, count_uniques = pd.factorize(df_table[COUNT_NAME])
+        count_codes = count_codes.astype(np.int64)
+        self.count_size = len(count_uniques) + 1
+
+        other_base = df_table[claims].reset_index(drop=True)
+        exposure_base = df_table[['EXPOSURE_YEAR', 'EXPOSURE_PREM', SUM_ASSURED]].reset_index(drop=True)
+
+        # Kiểu gốc của các measure để tổng về lại kiểu như groupby().sum()
+        self.dtypes = {**other_base.dtypes.to_dict(), **exposure_base.dtypes.to_dict()}
+
+        self.grouping_sets = []
+        years = [int(year) for year in years]
+        yearly = [year for year in years if year != 0]
+        if yearly:
+            year_codes, year_values = pd.factorize(df_table['CAL_YEAR'], sort=True)
+            year_codes = year_codes.astype(np.int64)
+            first_in_year = first_occurrence_mask(year_codes * self.count_size + count_codes + 1)
+            self.grouping_sets.append(self._build_cells(
+                year_codes, list(year_values), yearly, first_in_year, dim_codes, count_codes, other_base, exposure_base
+            ))
+        if 0 in years:
+            all_codes = np.zeros(len(df_table), dtype=np.int64)
+            self.grouping_sets.append(self._build_cells(
+                all_codes, [0], [0], first_occurrence_mask(count_codes), dim_codes, count_codes, other_base, exposure_base
+            ))
+
+    def _build_cells(self, year_codes, year_values, years, first_mask, dim_codes, count_codes,
+                     other_base, exposure_base) -> dict:
+        # Mã cell: ghép dần mã năm và mã từng biến, factorize lại sau mỗi bước để giá trị không tràn int64.
+        # Factorize không sắp xếp nên cell id tăng theo thứ tự xuất hiện đầu tiên.
+        cell_ids = year_codes
+        for dim in self.dims:
+            n_levels = len(self.levels[dim][0])
+            cell_ids, _ = pd.factorize(cell_ids * (n_levels + 1) + dim_codes[dim] + 1)
+            cell_ids = cell_ids.astype(np.int64)
+        n_cells = int(cell_ids.max()) + 1 if len(cell_ids) else 0
+        first_rows = np.flatnonzero(first_occurrence_mask(cell_ids))
+
+        exposure_ids = np.where(first_mask, cell_ids, n_cells)
+        other = {column: group_sums(cell_ids, other_base[column].to_numpy(), n_cells) for column in other_base.columns}
+        exposure = {column: group_sums(exposure_ids, exposure_base[column].to_numpy(), n_cells + 1)[:n_cells]
+                    for column in exposure_base.columns}
+
+        # Tập ID của mỗi cell (CSR): cặp (cell, ID) không trùng, sắp xếp theo cell rồi theo ID
+        counted = count_codes >= 0
+        pairs = np.unique(cell_ids[counted] * self.count_size + count_codes[counted])
+        pair_cells = pairs // self.count_size
+        id_dtype = np.uint32 if self.count_size < np.iinfo(np.uint32).max else np.uint64
+        id_indptr = np.zeros(n_cells + 1, dtype=np.int64)
+        id_indptr[1:] = np.cumsum(np.bincount(pair_cells, minlength=n_cells))
+
+        return {
+            'year_values': year_values,
+            'years': years,
+            'n_cells': n_cells,
+            'cell_year': year_codes[first_rows],
+            'cell_codes': {dim: dim_codes[dim][first_rows] for dim in self.dims},
+            'other': other,
+            'exposure': exposure,
+            'exposure_rows': np.bincount(cell_ids[first_mask], minlength=n_cells),
+            'id_indptr': id_indptr,
+            'id_values': (pairs % self.count_size).astype(id_dtype),
+            'pair_cells': pair_cells,
+            'present': {},
+        }
+
+    def remap(self, dim: str, level_map: np.ndarray, levels: pd.Index, ordered) -> "GLMCube":
+        """
+        Cube có mã của `dim` gộp lại theo level_map (mã cũ → mã mới trong `levels`), ví dụ khi phân nhóm lại
+        các bucket giá trị của một biến. Dùng chung measure và tập ID của cell với cube gốc nên gần như không tốn gì.
+        """
+        cube = copy.copy(self)
+        cube.levels = {**self.levels, dim: (levels, ordered)}
+        cube.grouping_sets = [
+            {**cells, 'cell_codes': {**cells['cell_codes'], dim: level_map[cells['cell_codes'][dim]]}, 'present': {}}
+            for cells in self.grouping_sets
+        ]
+        return cube
+
+    @property
+    def nbytes(self) -> int:
+        """Bộ nhớ (ước lượng) của các mảng trong cell"""
+        total = 0
+        for cells in self.grouping_sets:
+            for value in cells.values():
+                arrays = value.values() if isinstance(value, dict) else [value]
+                total += sum(array.nbytes for array in arrays if isinstance(array, np.ndarray))
+        return total
+
+    def _present_codes(self, cells: dict, dim: str, size: int, year_index: int, exposure_only: bool) -> np.ndarray:
+        """Các mã của biến xuất hiện trong năm (bỏ NaN), tính một lần rồi giữ lại trong cells"""
+        key = (dim, year_index, exposure_only)
+        if key not in cells['present']:
+            in_year = cells['cell_year'] == year_index
+            if exposure_only:
+                in_year &= cells['exposure_rows'] > 0
+            cells['present'][key] = present_codes(cells['cell_codes'][dim], size, in_year)
+        return cells['present'][key]
+
+    def _product_groups(self, cells: dict, byvars: list, sizes: list, year_index: int, exposure_only: bool) -> np.ndarray:
+        """Nhóm của pivot_table(observed=False) khi có biến category, theo quy tắc của kernel (cartesian_groups)"""
+        orders = [self.levels[dim][1] for dim in byvars]
+        present = [None if ordered is not None else self._present_codes(cells, dim, size, year_index, exposure_only)
+                   for dim, size, ordered in zip(byvars, sizes, orders)]
+        return cartesian_groups(orders, sizes, present)
+
+    def pivots(self, byvars) -> dict:
+        """
+        Bảng pivot của tổ hợp biến cho mọi năm đã chuẩn bị, suy ra từ cell.
+
+        Trả về {năm: bảng tương đương calculate_pivot_tables(df của năm đó, byvars, ...)}: nunique chính xác
+        (hợp các tập ID), số đếm nguyên chính xác; tổng float cộng từ tổng của cell nên khớp bản gốc trong rtol 1e-9.
+        Năm không có trong kết quả (không có dữ liệu, tổ hợp quá nhiều nhóm...) thì caller dùng hàm gốc.
+        """
+        byvars = list(byvars)
+        COUNT_NAME = self.columns[0]
+        if any(dim not in self.levels for dim in byvars) or len(set(byvars)) != len(byvars):
+            return {}
+        sizes = [len(self.levels[dim][0]) for dim in byvars]
+        combos_per_year = int(np.prod(sizes, dtype=object))
+        if combos_per_year == 0:
+            return {}
+        has_category = any(self.levels[dim][1] is not None for dim in byvars)
+
+        result = {}
+        for cells in self.grouping_sets:
+            n_groups = len(cells['year_values']) * combos_per_year
+            if n_groups > GLM_CUBE_MAX_GROUPS:
+                continue
+
+            # Mã nhóm của từng cell (năm, mã các biến); cell có biến NaN vào nhóm n_groups và bị bỏ
+            valid = np.ones(cells['n_cells'], dtype=bool)
+            group_ids = cells['cell_year'].copy()
+            for dim, size in zip(byvars, sizes):
+                codes = cells['cell_codes'][dim]
+                valid &= codes >= 0
+                group_ids = group_ids * size + codes
+            group_ids = np.where(valid, group_ids, n_groups)
+            exposure_ids = np.where(cells['exposure_rows'] > 0, group_ids, n_groups)
+
+            other_cells = np.bincount(group_ids, minlength=n_groups + 1)
+            exposure_cells = np.bincount(exposure_ids, minlength=n_groups + 1)
+            sums = {}
+            for frame, ids in ((cells['other'], group_ids), (cells['exposure'], exposure_ids)):
+                for column, values in frame.items():
+                    sums[column] = group_sums(ids, values, n_groups + 1)
+
+            # nunique = số cặp (nhóm, ID) khác nhau sau khi hợp tập ID của các cell trong nhóm
+            nunique = group_nunique(
+                group_ids[cells['pair_cells']], cells['id_values'].astype(np.int64), self.count_size, n_groups + 1
+            )
+
+            for year in cells['years']:
+                if year not in cells['year_values']:
+                    continue
+                year_index = cells['year_values'].index(year)
+                low, high = year_index * combos_per_year, (year_index + 1) * combos_per_year
+                if not other_cells[low:high].any() or not exposure_cells[low:high].any():
+                    continue
+                if has_category:
+                    other_local = self._product_groups(cells, byvars, sizes, year_index, False)
+                    exposure_local = self._product_groups(cells, byvars, sizes, year_index, True)
+                else:
+                    other_local = np.flatnonzero(other_cells[low:high])
+                    exposure_local = np.flatnonzero(exposure_cells[low:high])
+
+                other_year = pd.DataFrame({
+                    COUNT_NAME: nunique[low + other_local],
+                    **{column: downcast_sums(sums[column][low + other_local], self.dtypes[column]) for column in cells['other']},
+                }, index=self._group_index(byvars, sizes, other_local))
+                exposure_year = pd.DataFrame(
+                    {column: downcast_sums(sums[column][low + exposure_local], self.dtypes[column]) for column in cells['exposure']},
+                    index=self._group_index(byvars, sizes, exposure_local)
+                )
+
+                result[year] = pd.concat(
+                    [other_year.sort_index(axis=1), exposure_year.sort_index(axis=1)], axis=1
+                ).reset_index()
+        return result
+
+    def _group_index(self, byvars: list, sizes: list, local_groups: np.ndarray) -> pd.MultiIndex:
+        codes = np.unravel_index(local_groups, sizes) if len(local_groups) else [np.array([], dtype=np.int64)] * len(sizes)
+        arrays = [level_index(*self.levels[dim], dim_codes, dim) for dim, dim_codes in zip(byvars, codes)]
+        return pd.MultiIndex.from_arrays(arrays, names=byvars)
@@ -0,0 +1,158 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+import pandas as pd
+from config.log_config import logger
+from modules.GLM.glm_varb_analysis import setup_analysis_params, claim_columns
+from modules.GLM.glm_cube import GLMCube
+from modules.GLM.glm_binning import BinSpec, source_column
+
+# Tắt để mỗi request 1WA luôn tính lại từ dữ liệu gốc
+GLM_HISTOGRAM_ENABLED = os.getenv("GLM_HISTOGRAM_ENABLED", "true").lower() in ("1", "true", "yes")
+# Số bucket tối đa của một biến: ít giá trị khác nhau hơn thì mỗi giá trị một bucket (phân nhóm lại được với mọi cạnh bin),
+# nhiều hơn thì gộp các giá trị liền nhau thành bucket (cạnh bin mới rơi vào giữa bucket → tính lại từ dữ liệu)
+GLM_HISTOGRAM_MAX_BUCKETS = int(os.getenv("GLM_HISTOGRAM_MAX_BUCKETS", 100_000))
+GLM_HISTOGRAM_CACHE_MAX_BYTES = int(os.getenv("GLM_HISTOGRAM_CACHE_MAX_BYTES", 512 * 1024 ** 2))
+
+class BinHistogram:
+    """
+    Histogram mịn của một biến phân nhóm (cột gốc dạng số của biến _GROUP): một GLMCube theo (năm, bucket giá trị),
+    mỗi cell giữ các measure cộng được và tập ID hợp đồng của các dòng trong bucket.
+
+    Khi chỉ cạnh bin thay đổi, bảng pivot 1WA của biến được suy ra bằng cách gộp bucket theo bin mới (pivots),
+    không cần quét lại dữ liệu: chi phí chỉ phụ thuộc số bucket và số năm, không phụ thuộc số dòng.
+    nunique được tính chính xác từ tập ID (không dùng sketch xấp xỉ) nên số đếm khớp chính xác khi tính từ dữ liệu;
+    tổng float cộng từ tổng của bucket nên khớp trong rtol 1e-9.
+    """
+
+    def __init__(self, df_table: pd.DataFrame, var_name: str, years: list, productName: str,
+                 additional_apply: bool, additional_codes: str, claim_codes: list):
+        self.var_name = var_name
+        x = np.asarray(pd.to_numeric(df_table[source_column(var_name)], errors='coerce'), dtype=np.float64)
+        present = ~np.isnan(x)
+        values = np.unique(x[present])
+        step = max(-(-len(values) // GLM_HISTOGRAM_MAX_BUCKETS), 1)
+        n_buckets = -(-len(values) // step)
+        # Khoảng giá trị [low, high] của từng bucket; bucket cuối cùng (n_buckets) chứa giá trị không phải số
+        self.low = values[::step]
+        self.high = values[np.minimum(np.arange(1, n_buckets + 1) * step, len(values)) - 1]
+        self.has_missing = not present.all()
+
+        buckets = np.full(len(x), n_buckets, dtype=np.int64)
+        buckets[present] = np.searchsorted(values, x[present]) // step
+
+        COUNT_NAME, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED = setup_analysis_params(
+            productName, additional_apply, additional_codes
+        )
+        claims = [col for col in claim_columns(productName, additional_apply, claim_codes) if col in df_table.columns]
+        columns = list(dict.fromkeys(['CAL_YEAR', COUNT_NAME, *claims, 'EXPOSURE_YEAR', 'EXPOSURE_PREM', SUM_ASSURED]))
+        frame = df_table[columns].copy()
+        frame[var_name] = pd.Categorical.from_codes(buckets, categories=np.arange(n_buckets + 1))
+        self.cube = GLMCube(frame, [var_name], years, productName, additional_apply, additional_codes,
+                            claim_codes=claim_codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.cube.nbytes + self.low.nbytes + self.high.nbytes
+
+    def pivots(self, spec: BinSpec) -> dict:
+        """
+        {năm: pivot 1WA của biến với thiết lập bin `spec`} như OWA_grouping_set_pivots trên dữ liệu đã phân nhóm
+        (các tổng cộng từ tổng của bucket nên có thể lệch ở chữ số cuối của float).
+        Trả về {} nếu có cạnh bin nằm giữa một bucket (caller tính lại từ dữ liệu).
+        """
+        low_codes = spec.codes(self.low).astype(np.int64)
+        if not np.array_equal(low_codes, spec.codes(self.high)):
+            return {}
+        nan_code = len(spec.labels)
+        level_map = np.append(low_codes, nan_code)
+        # Category 'NaN' chỉ có khi dữ liệu có giá trị rơi vào đó, như categorize_car / categorize_health
+        has_nan = self.has_missing or bool((low_codes == nan_code).any())
+        dtype = spec.dtype_with_nan if has_nan else spec.dtype
+        return self.cube.remap(self.var_name, level_map, dtype.categories, True).pivots([self.var_name])
+
+class OWAPreaggregate:
+    """
+    Kết quả trung gian của 1WA dùng lại giữa các request trên cùng dữ liệu (cùng file, năm và additional code):
+    - pivots: {biến thường: {năm: pivot chứa cột của mọi code}}, không phụ thuộc thiết lập bin
+    - histograms: {biến _GROUP: BinHistogram} để suy ra pivot khi thiết lập bin thay đổi
+    - available: với mỗi code, dữ liệu có đủ cột NUM_CLAIMS / CLAIM_PMT hay không
+    """
+
+    def __init__(self):
+        self.pivots = {}
+        self.histograms = {}
+        self.available = None
+
+    def owa_pivots(self, combination: str, spec: Optional[BinSpec]) -> Optional[dict]:
+        """Pivot của biến theo năm nếu suy ra được mà không cần dữ liệu, ngược lại None"""
+        if combination in self.histograms:
+            if spec is None:
+                return None
+            return self.histograms[combination].pivots(spec) or None
+        return self.pivots.get(combination)
+
+    def covers(self, var_combinations: list, specs: dict, years: list) -> bool:
+        """Mọi biến, mọi năm và mọi code của request đều suy ra được từ preaggregate (không cần đọc dữ liệu)"""
+        if not self.available or not all(self.available):
+            return False
+        for combination in var_combinations:
+            pivots = self.owa_pivots(combination, specs.get(combination))
+            if pivots is None or any(int(year) not in pivots for year in years):
+                return False
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        total = sum(histogram.nbytes for histogram in self.histograms.values())
+        for pivots in self.pivots.values():
+            total += sum(int(pivot.memory_usage(deep=True).sum()) for pivot in pivots.values())
+        return total
+
+class PreaggregateCache:
+    """Cache LRU (trong process) của OWAPreaggregate theo dữ liệu, giới hạn tổng bộ nhớ bởi `max_bytes`"""
+
+    def __init__(self, max_bytes: int = GLM_HISTOGRAM_CACHE_MAX_BYTES, enabled: bool = GLM_HISTOGRAM_ENABLED):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[OWAPreaggregate]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            self._entries.move_to_end(key)
+            return item[0]
+
+    def put(self, key: str, entry: OWAPreaggregate):
+        """Thêm / cập nhật entry (kích thước được tính lại vì entry lớn dần qua các request)"""
+        nbytes = entry.nbytes
+        if nbytes > self.max_bytes:
+            logger.info(f"1WA preaggregate ({nbytes / 1024 / 1024:.2f} MB) exceeds cache budget, not cached")
+            self.invalidate(key)
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous[1]
+            self._entries[key] = (entry, nbytes)
+            self._total_bytes += nbytes
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted
+
+    def invalidate(self, key: Optional[str] = None):
+        """Xoá một key (hoặc toàn bộ cache nếu key=None)"""
+        with self._lock:
+            keys = list(self._entries.keys()) if key is None else [key]
+            for k in keys:
+                item = self._entries.pop(k, None)
+                if item is not None:
+                    self._total_bytes -= item[1]
+
+preaggregate_cache = PreaggregateCache()
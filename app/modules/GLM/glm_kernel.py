@@ -0,0 +1,236 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Tắt để calculate_pivot_tables dùng lại pandas.pivot_table như trước
+GLM_PIVOT_KERNEL_ENABLED = os.getenv("GLM_PIVOT_KERNEL_ENABLED", "true").lower() in ("1", "true", "yes")
+# Số nhóm tối đa (tích số mức của các biến) để đánh mã nhóm trực tiếp bằng ravel; vượt quá thì factorize lại
+GLM_KERNEL_DENSE_GROUPS = int(os.getenv("GLM_KERNEL_DENSE_GROUPS", 4_000_000))
+
+# bincount cộng bằng float64: tổng số nguyên chính xác khi |tổng| < 2**53
+_FLOAT_EXACT_INT = 2 ** 53
+
+def factorize_dim(series: pd.Series) -> tuple:
+    """
+    Mã số nguyên của một biến phân tích, theo đúng thứ tự nhóm của pivot_table:
+    category → mã category (đủ mọi category, ordered giữ nguyên); biến thường → factorize có sắp xếp.
+    NaN → -1. Trả về (codes int64, levels, ordered hoặc None nếu không phải category).
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy().astype(np.int64), series.cat.categories, series.cat.ordered
+    codes, uniques = pd.factorize(series, sort=True)
+    return codes.astype(np.int64), uniques, None
+
+def level_index(levels: pd.Index, ordered, codes: np.ndarray, name: str) -> pd.Index:
+    """Index giá trị của biến từ mã (CategoricalIndex nếu biến là category)"""
+    if ordered is not None:
+        return pd.CategoricalIndex(levels.take(codes), categories=levels, ordered=ordered, name=name)
+    return pd.Index(levels.take(codes), name=name)
+
+def group_sums(ids: np.ndarray, values, minlength: int) -> np.ndarray:
+    """
+    Tổng theo nhóm bằng np.bincount: NaN bị bỏ qua (nhóm toàn NaN = 0), float giữ kiểu,
+    số nguyên / bool cộng trong int64 (uint64) - dùng downcast_sums để về kiểu như groupby().sum().
+    Số nguyên có tổng có thể vượt 2**53 thì cộng chính xác bằng sort + np.add.reduceat.
+    """
+    values = np.asarray(values)
+    kind = values.dtype.kind
+    if kind == "f":
+        weights = np.where(np.isnan(values), 0, values) if np.isnan(values).any() else values
+        return np.bincount(ids, weights=weights, minlength=minlength).astype(values.dtype, copy=False)
+    if kind not in "iub":
+        raise TypeError(f"Unsupported dtype for group_sums: {values.dtype}")
+
+    work_dtype = np.uint64 if kind == "u" else np.int64
+    if len(values) == 0:
+        return np.zeros(minlength, dtype=work_dtype)
+    bound = max(abs(int(values.min())), abs(int(values.max()))) * len(values)
+    if bound < _FLOAT_EXACT_INT:
+        sums = np.rint(np.bincount(ids, weights=values.astype(np.float64), minlength=minlength)).astype(work_dtype)
+    else:
+        order = np.argsort(ids, kind="stable")
+        sorted_ids = ids[order]
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        sums = np.zeros(max(minlength, int(sorted_ids[-1]) + 1), dtype=work_dtype)
+        sums[sorted_ids[starts]] = np.add.reduceat(values[order].astype(work_dtype), starts)
+    return sums
+
+def downcast_sums(sums: np.ndarray, dtype) -> np.ndarray:
+    """
+    Kiểu kết quả như groupby().sum() của pandas: tổng của cột số nguyên nhỏ (int8, uint16...) về lại kiểu gốc
+    nếu mọi tổng vừa kiểu đó, ngược lại giữ int64 / uint64; bool → int64.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind not in "iu" or sums.dtype == dtype:
+        return sums
+    if len(sums):
+        info = np.iinfo(dtype)
+        if sums.min() < info.min or sums.max() > info.max:
+            return sums
+    return sums.astype(dtype)
+
+def group_nunique(ids: np.ndarray, id_codes: np.ndarray, id_size: int, minlength: int) -> np.ndarray:
+    """
+    Số ID khác nhau trong mỗi nhóm (tương đương nunique, bỏ ID NaN = mã -1):
+    mã hoá cặp (nhóm, ID) thành một số nguyên, lấy các cặp không trùng rồi đếm theo nhóm.
+    """
+    keep = id_codes >= 0
+    if not keep.all():
+        ids, id_codes = ids[keep], id_codes[keep]
+    # Sort-unique: sắp xếp rồi giữ phần tử khác phần tử trước (nhanh hơn hash của pd.unique nhiều lần)
+    pairs = np.sort(ids * id_size + id_codes)
+    if len(pairs):
+        pairs = pairs[np.r_[True, pairs[1:] != pairs[:-1]]]
+    return np.bincount(pairs // id_size, minlength=minlength)
+
+def first_occurrence_mask(keys: np.ndarray) -> np.ndarray:
+    """Mask dòng xuất hiện đầu tiên của mỗi khoá (tương đương ~duplicated() trên khoá đã mã hoá số nguyên)"""
+    return ~pd.Series(keys).duplicated().to_numpy()
+
+def first_occurrence_of_codes(codes: np.ndarray) -> np.ndarray:
+    """
+    first_occurrence_mask cho mã của pd.factorize (không sort): mã được đánh theo thứ tự xuất hiện,
+    nên dòng đầu tiên của một mã là dòng có mã lớn hơn mọi mã trước nó. NaN (-1) cũng là một khoá.
+    """
+    mask = np.empty(len(codes), dtype=bool)
+    if len(codes) == 0:
+        return mask
+    mask[0] = True
+    mask[1:] = codes[1:] > np.maximum.accumulate(codes)[:-1]
+    missing = np.flatnonzero(codes < 0)
+    if len(missing):
+        mask[missing[0]] = True
+    return mask
+
+def present_codes(codes: np.ndarray, size: int, mask: np.ndarray = None) -> np.ndarray:
+    """Các mã (khác NaN) xuất hiện trong các dòng của mask, tăng dần"""
+    selected = codes if mask is None else codes[mask]
+    return np.flatnonzero(np.bincount(selected[selected >= 0], minlength=size))
+
+def cartesian_groups(orders: list, sizes: list, present: list) -> np.ndarray:
+    """
+    Nhóm của pivot_table(observed=False) khi có biến category: tích Descartes các mức, thứ tự từ điển.
+    Biến category (ordered khác None) lấy mọi category; biến thường lấy các mã trong `present` (present_codes).
+    Dùng chung cho kernel và GLMCube.
+    """
+    axes = [np.arange(size) if ordered is not None else codes for ordered, size, codes in zip(orders, sizes, present)]
+    if any(len(axis) == 0 for axis in axes):
+        return np.array([], dtype=np.int64)
+    grid = np.meshgrid(*axes, indexing="ij")
+    return np.ravel_multi_index([axis.ravel() for axis in grid], sizes)
+
+def aggregate_pivot_tables(df_table: pd.DataFrame, byvar_list: list, COUNT_NAME: str, NUM_CLAIMS: str,
+                           CLAIM_PMT: str, SUM_ASSURED: str, exposure_index: dict = None):
+    """
+    Kernel NumPy cho calculate_pivot_tables: cùng bảng kết quả với hai pivot_table + drop_duplicates + concat.
+
+    1. Mã hoá các biến thành số nguyên (factorize_dim) và ghép thành mã nhóm dày đặc.
+    2. Tổng bằng np.bincount (group_sums), nunique bằng unique trên cặp (nhóm, ID) (group_nunique).
+    3. Dòng exposure là dòng đầu tiên của mỗi COUNT_NAME (như drop_duplicates), dùng chung mã nhóm.
+    Tổng float cộng tuần tự theo thứ tự dòng nên có thể lệch pivot_table (cộng Kahan) ở chữ số cuối.
+    Trả về None để caller dùng pivot_table khi: bảng rỗng; byvar_list rỗng / trùng / trùng cột giá trị; cột giá trị
+    không phải số / bool; factorize có sắp xếp của biến lỗi (TypeError); biến chỉ có NaN; không dòng nào có đủ
+    giá trị của mọi biến; quá nhiều nhóm (không dense) khi có biến category.
+    :param exposure_index: mã COUNT_NAME và mask dòng đầu tiên đã tính sẵn cho các dòng của df_table (xem year_slice)
+    """
+    byvar_list = list(byvar_list)
+    other_columns = [NUM_CLAIMS, CLAIM_PMT]
+    exposure_columns = ['EXPOSURE_YEAR', 'EXPOSURE_PREM', SUM_ASSURED]
+    value_columns = [COUNT_NAME] + other_columns + exposure_columns
+    n_rows = len(df_table)
+    if n_rows == 0 or not byvar_list or len(set(byvar_list)) != len(byvar_list) or set(byvar_list) & set(value_columns):
+        return None
+    if any(df_table[column].dtype.kind not in "iufb" for column in other_columns + exposure_columns):
+        return None
+
+    try:
+        dims = [factorize_dim(df_table[byvar]) for byvar in byvar_list]
+    except TypeError:
+        # Giá trị không so sánh được để sắp xếp (kiểu hỗn hợp)
+        return None
+    sizes = [len(levels) for _, levels, _ in dims]
+    if 0 in sizes:
+        return None
+    has_category = any(ordered is not None for _, _, ordered in dims)
+
+    valid = np.ones(n_rows, dtype=bool)
+    for codes, _, _ in dims:
+        valid &= codes >= 0
+    dense = int(np.prod(sizes, dtype=object)) <= max(2 * n_rows, GLM_KERNEL_DENSE_GROUPS)
+    if not dense and has_category:
+        return None
+
+    # Mã nhóm theo thứ tự từ điển của mã các biến; dòng có biến NaN vào nhóm n_groups và bị bỏ
+    ids = np.zeros(n_rows, dtype=np.int64)
+    span = 1
+    for (codes, _, _), size in zip(dims, sizes):
+        ids = ids * size + np.where(valid, codes, 0)
+        span *= size
+        if not dense and span > GLM_KERNEL_DENSE_GROUPS:
+            ids, uniques = pd.factorize(ids, sort=True)
+            ids = ids.astype(np.int64)
+            span = len(uniques)
+    n_groups = span
+    ids = np.where(valid, ids, n_groups)
+
+    if exposure_index is not None:
+        count_codes, count_size = exposure_index['count_codes'], exposure_index['count_size']
+        first_mask = exposure_index['first_mask']
+    else:
+        count_codes, count_uniques = pd.factorize(df_table[COUNT_NAME])
+        count_codes = count_codes.astype(np.int64)
+        count_size = len(count_uniques) + 1
+        # drop_duplicates coi các NaN là trùng nhau nên -1 cũng là một khoá
+        first_mask = first_occurrence_of_codes(count_codes)
+    exposure_ids = np.where(first_mask, ids, n_groups)
+
+    other_rows = np.bincount(ids, minlength=n_groups + 1)[:n_groups]
+    exposure_rows = np.bincount(exposure_ids, minlength=n_groups + 1)[:n_groups]
+    if not other_rows.any() or not exposure_rows.any():
+        return None
+
+    if has_category:
+        orders = [ordered for _, _, ordered in dims]
+        other_present = [present_codes(codes, size) for (codes, _, _), size in zip(dims, sizes)]
+        exposure_present = [present_codes(codes, size, first_mask) for (codes, _, _), size in zip(dims, sizes)]
+        other_groups = cartesian_groups(orders, sizes, other_present)
+        exposure_groups = cartesian_groups(orders, sizes, exposure_present)
+    else:
+        other_groups = np.flatnonzero(other_rows)
+        exposure_groups = np.flatnonzero(exposure_rows)
+
+    if dense:
+        def group_codes(groups):
+            return np.unravel_index(groups, sizes)
+    else:
+        # Mã các biến lấy từ dòng đầu tiên của mỗi nhóm
+        rows = np.flatnonzero(first_occurrence_mask(ids))
+        first_rows = np.full(n_groups + 1, -1, dtype=np.int64)
+        first_rows[ids[rows]] = rows
+
+        def group_codes(groups):
+            rows = first_rows[groups]
+            return [codes[rows] for codes, _, _ in dims]
+
+    def group_index(groups):
+        arrays = [level_index(levels, ordered, dim_codes, byvar)
+                  for (_, levels, ordered), dim_codes, byvar in zip(dims, group_codes(groups), byvar_list)]
+        if len(arrays) == 1:
+            return arrays[0]
+        return pd.MultiIndex.from_arrays(arrays, names=byvar_list)
+
+    def column_sums(column, column_ids, groups):
+        values = df_table[column].to_numpy()
+        return downcast_sums(group_sums(column_ids, values, n_groups + 1)[groups], values.dtype)
+
+    nunique = group_nunique(ids, count_codes, count_size, n_groups + 1)
+    other_pivot = pd.DataFrame({
+        COUNT_NAME: nunique[other_groups],
+        **{column: column_sums(column, ids, other_groups) for column in other_columns},
+    }, index=group_index(other_groups))
+    exposure_pivot = pd.DataFrame(
+        {column: column_sums(column, exposure_ids, exposure_groups) for column in exposure_columns},
+        index=group_index(exposure_groups)
+    )
+
+    return pd.concat([other_pivot.sort_index(axis=1), exposure_pivot.sort_index(axis=1)], axis=1).reset_index()
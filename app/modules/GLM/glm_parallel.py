@@ -0,0 +1,124 @@
+import os
+import uuid
+import tempfile
+from typing import Callable, Optional
+import pandas as pd
+import pyarrow as pa
+from concurrent.futures.process import BrokenProcessPool
+from config.log_config import logger
+from utils.executors import get_process_executor, reset_process_executor, PROCESS_EXECUTOR_MAX_WORKERS
+
+GLM_PARALLEL_ENABLED = os.getenv("GLM_PARALLEL_ENABLED", "true").lower() in ("1", "true", "yes")
+# Số process dùng cho một phân tích (không vượt quá kích thước process pool)
+GLM_PARALLEL_WORKERS = int(os.getenv("GLM_PARALLEL_WORKERS", PROCESS_EXECUTOR_MAX_WORKERS))
+# Chỉ chạy song song khi đủ lớn để bù chi phí chia sẻ dữ liệu và khởi động worker
+GLM_PARALLEL_MIN_COMBINATIONS = int(os.getenv("GLM_PARALLEL_MIN_COMBINATIONS", 8))
+GLM_PARALLEL_MIN_ROWS = int(os.getenv("GLM_PARALLEL_MIN_ROWS", 200_000))
+# Thư mục chứa file Arrow IPC chia sẻ với worker: /dev/shm (RAM) nếu có, không thì thư mục tạm
+GLM_SHARED_DATA_DIR = os.getenv(
+    "GLM_SHARED_DATA_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+)
+
+def parallel_workers(n_combinations: int, n_rows: int) -> int:
+    """Số worker nên dùng cho một phân tích; 0 hoặc 1 nghĩa là chạy tuần tự trong process hiện tại"""
+    if not GLM_PARALLEL_ENABLED or n_combinations < GLM_PARALLEL_MIN_COMBINATIONS or n_rows < GLM_PARALLEL_MIN_ROWS:
+        return 0
+    return max(min(GLM_PARALLEL_WORKERS, PROCESS_EXECUTOR_MAX_WORKERS, n_combinations), 0)
+
+def split_batches(items: list, n_batches: int) -> list:
+    """Chia `items` thành tối đa n_batches đoạn liên tiếp gần bằng nhau: [(vị trí bắt đầu, đoạn)]"""
+    n_batches = max(min(n_batches, len(items)), 1)
+    size, extra = divmod(len(items), n_batches)
+    batches = []
+    start = 0
+    for index in range(n_batches):
+        end = start + size + (1 if index < extra else 0)
+        batches.append((start, items[start:end]))
+        start = end
+    return [batch for batch in batches if batch[1]]
+
+class SharedArrowFrame:
+    """
+    DataFrame được ghi một lần thành file Arrow IPC (không nén) trong GLM_SHARED_DATA_DIR.
+    Worker mở file bằng memory map (load_shared_frame): các process dùng chung page cache thay vì
+    mỗi process nhận một bản pickle của dữ liệu. File bị xoá khi thoát khỏi context.
+    """
+
+    def __init__(self, df: pd.DataFrame, directory: str = GLM_SHARED_DATA_DIR):
+        self.path, self.nbytes = write_arrow_file(df, directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def write_arrow_file(df: pd.DataFrame, directory: str = GLM_SHARED_DATA_DIR) -> tuple:
+    """Ghi DataFrame thành file Arrow IPC (không nén) trong `directory`: (đường dẫn, số bytes của bảng)"""
+    path = os.path.join(directory, f"glm-{uuid.uuid4().hex}.arrow")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    try:
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    except BaseException:
+        remove_files([path])
+        raise
+    return path, table.nbytes
+
+def remove_files(paths: list):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def take_result_frame(path: str) -> pd.DataFrame:
+    """
+    Đọc file kết quả do worker ghi (write_arrow_file) rồi xoá file. Đọc hẳn vào bộ nhớ (không memory map)
+    để file trong GLM_SHARED_DATA_DIR (/dev/shm là RAM) được giải phóng ngay.
+    """
+    try:
+        with pa.OSFile(path, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+    finally:
+        remove_files([path])
+    return table.to_pandas()
+
+def load_shared_frame(path: str) -> pd.DataFrame:
+    """Đọc file của SharedArrowFrame: cột numeric không null được map thẳng từ file (zero-copy, read-only)"""
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+def run_batches(worker: Callable, df: pd.DataFrame, items: list, n_workers: int, *args) -> Optional[list]:
+    """
+    Chạy worker(path, start, batch, *args) cho từng đoạn của `items` trên process pool dùng chung,
+    trả về kết quả theo thứ tự đoạn. Trả về None nếu không chạy được song song (không tạo được file chia sẻ,
+    pool hỏng...) để caller chạy tuần tự. Exception khác của worker được raise lại ở đây
+    (worker nên tự chuyển lỗi không pickle được thành giá trị trả về).
+    """
+    batches = split_batches(items, n_workers)
+    try:
+        shared = SharedArrowFrame(df)
+    except (OSError, pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        logger.warning(f"Parallel GLM analysis disabled for this request: {e}")
+        return None
+
+    with shared:
+        executor = get_process_executor()
+        try:
+            futures = [executor.submit(worker, shared.path, start, batch, *args) for start, batch in batches]
+            results = [future.result() for future in futures]
+        except BrokenProcessPool as e:
+            reset_process_executor(executor)
+            logger.warning(f"Process pool failed, running GLM analysis serially: {e}")
+            return None
+    logger.info(
+        f"Parallel GLM analysis: {len(items)} combinations in {len(batches)} batches, "
+        f"shared {shared.nbytes / 1024 / 1024:.1f} MB via {GLM_SHARED_DATA_DIR}"
+    )
+    return results
@@ -0,0 +1,126 @@
+import os
+import json
+from datetime import datetime, timezone
+from typing import Optional
+from config.log_config import logger
+from modules.storage import get_storage
+from modules.table_cache import make_cache_key
+
+# Tắt để mọi request phân tích luôn tính lại và ghi đè file kết quả
+GLM_RESULT_CACHE_ENABLED = os.getenv("GLM_RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Prefix trên storage chứa các entry (JSON) của cache kết quả, nhóm theo file nguồn và phiên bản (ETag) của file nguồn
+GLM_RESULT_CACHE_PREFIX = os.getenv("GLM_RESULT_CACHE_PREFIX", "report-software/glm/result-cache")
+# Số entry tối đa giữ cho một file nguồn, và tuổi tối đa (giây) của entry; entry cũ hơn bị xoá khi ghi entry mới
+GLM_RESULT_CACHE_MAX_ENTRIES = int(os.getenv("GLM_RESULT_CACHE_MAX_ENTRIES", 200))
+GLM_RESULT_CACHE_MAX_AGE = float(os.getenv("GLM_RESULT_CACHE_MAX_AGE", 30 * 24 * 3600))
+
+class GLMResultCache:
+    """
+    Cache (trên storage, dùng chung giữa các worker và sau khi restart) của bảng kết quả GLM 1WA..4WA:
+    key = (file nguồn + ETag, thiết lập phân tích đã chuẩn hoá, loại phân tích, additional code),
+    value = vị trí file kết quả đã ghi (s3_key, table_detail_name, sub_folder).
+
+    File kết quả nằm trong thư mục con theo digest của thiết lập (GLMAnalysis._generate_table_name, tên bảng không đổi)
+    nên các thiết lập khác nhau không ghi đè file của nhau; entry vẫn giữ ETag của file kết quả để chỉ hit khi file còn nguyên. File nguồn đổi nội dung thì
+    ETag nguồn đổi → miss. Dọn dẹp: entry trỏ tới file đã mất / bị ghi đè bị xoá khi lookup; khi ghi entry mới,
+    entry của phiên bản nguồn cũ, entry quá GLM_RESULT_CACHE_MAX_AGE và phần vượt GLM_RESULT_CACHE_MAX_ENTRIES bị xoá.
+    invalidate_source() xoá mọi entry của một file nguồn (import lại, xoá dữ liệu...).
+    """
+
+    def __init__(self, prefix: str = GLM_RESULT_CACHE_PREFIX, enabled: bool = GLM_RESULT_CACHE_ENABLED,
+                 max_entries: int = GLM_RESULT_CACHE_MAX_ENTRIES, max_age: float = GLM_RESULT_CACHE_MAX_AGE):
+        self.prefix = prefix.rstrip("/")
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+    def _source_prefix(self, source_key: str) -> str:
+        return f"{self.prefix}/{make_cache_key(source_key)}"
+
+    def _version_prefix(self, source: list) -> str:
+        return f"{self._source_prefix(source[1])}/{make_cache_key(source[2])[:16]}"
+
+    def make_key(self, source: list, settings: dict, analysis_type: str, add_codes: Optional[str],
+                 add_desc: Optional[str]) -> str:
+        """Key của một bảng kết quả; source = ["storage", S3 key, ETag] (GLMAnalysis._data_source)"""
+        digest = make_cache_key(source, settings, analysis_type, add_codes, add_desc)
+        return f"{self._version_prefix(source)}/{digest}.json"
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """Entry của key nếu có và file kết quả vẫn còn nguyên (cùng ETag), ngược lại None (entry hỏng bị xoá)"""
+        storage = get_storage()
+        try:
+            entry = json.loads(storage.get(key))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"GLM result cache lookup failed for {key}: {e}")
+            return None
+        try:
+            valid = storage.head(entry["s3_key"])["etag"] == entry["etag"]
+        except FileNotFoundError:
+            valid = False
+        except Exception as e:
+            logger.warning(f"GLM result cache lookup failed for {key}: {e}")
+            return None
+        if not valid:
+            self._delete_quietly(key)
+            return None
+        return entry
+
+    @staticmethod
+    def _delete_quietly(key: str):
+        try:
+            get_storage().delete(key)
+        except Exception as e:
+            logger.warning(f"Could not delete GLM result cache entry {key}: {e}")
+
+    def prune(self, source: list) -> int:
+        """
+        Xoá entry của các phiên bản cũ của file nguồn, entry quá hạn và phần vượt quá số entry tối đa (cũ nhất trước).
+        Chỉ xoá entry của cache, không xoá file kết quả (URL đã trả cho người dùng vẫn dùng được).
+        """
+        storage = get_storage()
+        version_prefix = self._version_prefix(source) + "/"
+        now = datetime.now(timezone.utc)
+        current, removed = [], 0
+        for item in storage.list(self._source_prefix(source[1]) + "/"):
+            modified = item.get("last_modified")
+            expired = modified is not None and (now - modified).total_seconds() > self.max_age
+            if not item["key"].startswith(version_prefix) or expired:
+                self._delete_quietly(item["key"])
+                removed += 1
+            else:
+                current.append(item)
+        if len(current) > self.max_entries:
+            oldest_first = sorted(current, key=lambda item: item.get("last_modified") or now)
+            for item in oldest_first[:len(current) - self.max_entries]:
+                self._delete_quietly(item["key"])
+                removed += 1
+        return removed
+
+    def store(self, key: str, save_result: dict):
+        """Ghi entry sau khi file kết quả đã ghi xong (xem prune() để dọn entry cũ); lỗi chỉ được log (lần sau tính lại)"""
+        try:
+            entry = {
+                "s3_key": save_result["s3_key"],
+                "table_detail_name": save_result["table_detail_name"],
+                "sub_folder": save_result["sub_folder"],
+                "etag": get_storage().head(save_result["s3_key"])["etag"],
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }
+            get_storage().put(key, json.dumps(entry).encode("utf-8"), content_type="application/json")
+        except Exception as e:
+            logger.warning(f"Could not store GLM result cache entry {key}: {e}")
+
+    def invalidate_source(self, source_key: str) -> int:
+        """Xoá mọi entry của file nguồn `source_key`, trả về số entry đã xoá"""
+        storage = get_storage()
+        objects = storage.list(self._source_prefix(source_key) + "/")
+        for item in objects:
+            storage.delete(item["key"])
+        if objects:
+            logger.info(f"Invalidated {len(objects)} GLM result cache entries of {source_key}")
+        return len(objects)
+
+glm_result_cache = GLMResultCache()
@@ -8,8 +8,11 @@ import sys
 import io
 from dateutil.parser import parse
 
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+# Đổi encoding của stream hiện tại thay vì bọc .buffer bằng TextIOWrapper mới: wrapper mới đóng stream gốc
+# khi bị thu hồi, làm hỏng stdout / stderr mà uvicorn hoặc pytest đang giữ
+for _stream in (sys.stdout, sys.stderr):
+    if hasattr(_stream, "reconfigure"):
+        _stream.reconfigure(encoding='utf-8')
 
 def check_duplicate_value(series, col):
     match col:
@@ -1,6 +1,17 @@
 import pandas as pd
 import numpy as np
 from fastapi import HTTPException
+from modules.GLM.glm_kernel import (
+    GLM_PIVOT_KERNEL_ENABLED,
+    aggregate_pivot_tables,
+    factorize_dim,
+    level_index,
+    group_sums,
+    downcast_sums,
+    group_nunique,
+    first_occurrence_mask,
+    first_occurrence_of_codes,
+)
 
 
 ########################## HELPER FUNCTIONS ##########################
@@ -149,12 +160,29 @@ def setup_analysis_params(productName: str, additional_apply: bool, additional_c
     
     return COUNT_NAME, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED
 
-def calculate_pivot_tables(df_table: pd.DataFrame, byvar_list: list, COUNT_NAME: str, NUM_CLAIMS: str, CLAIM_PMT: str, SUM_ASSURED: str):
+def calculate_pivot_tables(df_table: pd.DataFrame, byvar_list: list, COUNT_NAME: str, NUM_CLAIMS: str, CLAIM_PMT: str, SUM_ASSURED: str,
+                           exposure_index: dict = None):
     """
     Helper function để tính toán pivot tables
+    Dùng kernel NumPy (aggregate_pivot_tables); trường hợp kernel không xử lý thì dùng pandas.pivot_table như cũ.
+    :param exposure_index: mask dòng đầu tiên của mỗi COUNT_NAME đã tính sẵn (year_slice), thay cho drop_duplicates
+    """
+    if GLM_PIVOT_KERNEL_ENABLED:
+        df = aggregate_pivot_tables(df_table, byvar_list, COUNT_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED, exposure_index)
+        if df is not None:
+            return df
+    return calculate_pivot_tables_pandas(df_table, byvar_list, COUNT_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED, exposure_index)
+
+def calculate_pivot_tables_pandas(df_table: pd.DataFrame, byvar_list: list, COUNT_NAME: str, NUM_CLAIMS: str, CLAIM_PMT: str, SUM_ASSURED: str,
+                                  exposure_index: dict = None):
+    """
+    Bản pandas.pivot_table của calculate_pivot_tables (dùng khi kernel không xử lý được và để benchmark)
     """
     # Loại bỏ trùng lặp cho POLICY_ID để tính đúng EXPOSURE_YEAR và EXPOSURE_PREM
-    df_unique = df_table.drop_duplicates(subset=[COUNT_NAME])
+    if exposure_index is not None:
+        df_unique = df_table[exposure_index['first_mask']]
+    else:
+        df_unique = df_table.drop_duplicates(subset=[COUNT_NAME])
 
     # Tính toán riêng EXPOSURE_YEAR và EXPOSURE_PREM
     exposure_pivot = df_unique.pivot_table(
@@ -179,6 +207,46 @@ def calculate_pivot_tables(df_table: pd.DataFrame, byvar_list: list, COUNT_NAME:
 
     return df
 
+def prepare_year_index(df_table: pd.DataFrame, productName: str) -> dict:
+    """
+    Chỉ mục theo năm dùng chung cho mọi combination của một request (OWA_func / multiway_func), thay vì mỗi lần gọi
+    lại ép kiểu CAL_YEAR, lọc năm trên cả bảng và drop_duplicates(subset=[COUNT_NAME]):
+    - CAL_YEAR ép kiểu int và COUNT_NAME mã hoá số nguyên một lần
+    - mỗi năm (tính khi cần lần đầu rồi giữ lại): mask các dòng của năm, mã COUNT_NAME của các dòng đó
+      và mask dòng đầu tiên của mỗi COUNT_NAME trong năm (năm 0 = tất cả các năm)
+    """
+    df_table['CAL_YEAR'] = df_table['CAL_YEAR'].astype(int)
+    COUNT_NAME = setup_analysis_params(productName, False, "")[0]
+    # NaN → -1; drop_duplicates coi các NaN là trùng nhau nên -1 cũng là một khoá
+    count_codes, count_uniques = pd.factorize(df_table[COUNT_NAME])
+    return {
+        'df': df_table,
+        'count_codes': count_codes.astype(np.int64),
+        'count_size': len(count_uniques) + 1,
+        'years': {},
+    }
+
+def year_slice(year_index: dict, pol_year_ind: int) -> tuple:
+    """Dữ liệu của một năm cho calculate_pivot_tables: (bảng đã lọc năm, exposure_index)"""
+    df_table = year_index['df']
+    if pol_year_ind not in year_index['years']:
+        if pol_year_ind == 0:
+            year_mask = None
+            count_codes = year_index['count_codes']
+            first_mask = first_occurrence_of_codes(count_codes)
+        else:
+            year_mask = df_table['CAL_YEAR'].to_numpy() == pol_year_ind
+            count_codes = year_index['count_codes'][year_mask]
+            first_mask = first_occurrence_mask(count_codes)
+        year_index['years'][pol_year_ind] = (year_mask, {
+            'count_codes': count_codes,
+            'count_size': year_index['count_size'],
+            'first_mask': first_mask,
+        })
+    year_mask, exposure_index = year_index['years'][pol_year_ind]
+    # Lọc bằng mask trên cả bảng (take theo block) nhanh hơn chọn cột rồi lấy dòng
+    return (df_table if year_mask is None else df_table[year_mask]), exposure_index
+
 def setup_categorical_columns(df: pd.DataFrame, byvar_list: list):
     """
     Helper function để setup categorical columns
@@ -236,20 +304,39 @@ def OWA_func(pol_year_ind: int
              , byvar: str, var_code: str, productName: str
              , additional_apply: bool
              , additional_codes: str
-             , additional_descriptions: str) -> pd.DataFrame:
-
-    df_table['CAL_YEAR'] = df_table['CAL_YEAR'].astype(int)
-    if pol_year_ind != 0:
-        df_table = df_table.loc[df_table['CAL_YEAR'] == pol_year_ind]
+             , additional_descriptions: str
+             , year_index: dict = None) -> pd.DataFrame:
 
     # Setup parameters using helper function
     COUNT_NAME, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED = setup_analysis_params(
         productName, additional_apply, additional_codes
     )
 
+    if year_index is not None:
+        # Dòng của năm và mask drop_duplicates lấy từ chỉ mục dùng chung của request (prepare_year_index)
+        df_table, exposure_index = year_slice(year_index, pol_year_ind)
+    else:
+        df_table['CAL_YEAR'] = df_table['CAL_YEAR'].astype(int)
+        if pol_year_ind != 0:
+            df_table = df_table.loc[df_table['CAL_YEAR'] == pol_year_ind]
+        exposure_index = None
+
     # Calculate pivot tables using helper function
-    df = calculate_pivot_tables(df_table, [byvar], COUNT_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED)
-    
+    df = calculate_pivot_tables(df_table, [byvar], COUNT_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED, exposure_index)
+
+    return finalize_owa_table(df, pol_year_ind, byvar, var_code, productName,
+                              additional_apply, additional_codes, additional_descriptions)
+
+def finalize_owa_table(df: pd.DataFrame, pol_year_ind: int, byvar: str, var_code: str, productName: str,
+                       additional_apply: bool, additional_codes: str, additional_descriptions: str) -> pd.DataFrame:
+    """
+    Phần sau pivot của OWA_func: tính metrics, đặt nhãn và format bảng kết quả.
+    Dùng chung cho OWA_func và OWA_grouping_sets để hai đường tính cho ra cùng một bảng.
+    """
+    COUNT_NAME, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED = setup_analysis_params(
+        productName, additional_apply, additional_codes
+    )
+
     # Setup categorical columns using helper function
     df = setup_categorical_columns(df, [byvar])
     
@@ -275,26 +362,159 @@ def OWA_func(pol_year_ind: int
     # Format final dataframe using helper function
     return format_final_dataframe(df, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, new_order_col)
 
-# Updated TWO WAY ANALYSIS
-def TWA_func(pol_year_ind: int, df_table: pd.DataFrame, byvar1: str, byvar2: str, 
-             var_code: str, productName: str, 
-             additional_apply: bool = False, additional_codes: str = "", 
-             additional_descriptions: str = "") -> pd.DataFrame:
+######################## GROUPING SETS (1WA) ########################
+def claim_columns(productName: str, additional_apply: bool, codes: list) -> list:
+    """
+    Các cột NUM_CLAIMS / CLAIM_PMT của nhiều additional code (None = cột tổng, dùng cho ALLBENE), không trùng lặp.
+    Dùng để aggregate mọi code trong cùng một lần group thay vì chạy lại phân tích cho từng code.
+    """
+    columns = []
+    for code in codes:
+        _, _, NUM_CLAIMS, CLAIM_PMT, _ = setup_analysis_params(productName, additional_apply, code)
+        columns += [NUM_CLAIMS, CLAIM_PMT]
+    return list(dict.fromkeys(columns))
+
+def select_code_pivot(df: pd.DataFrame, byvars: list, productName: str,
+                      additional_apply: bool, additional_codes: str) -> pd.DataFrame:
+    """
+    Tách bảng pivot của một additional code từ bảng pivot có cột của nhiều code,
+    cùng thứ tự cột với calculate_pivot_tables (biến, các cột khác theo tên, các cột exposure theo tên)
+    """
+    COUNT_NAME, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED = setup_analysis_params(
+        productName, additional_apply, additional_codes
+    )
+    columns = (list(byvars) + sorted([COUNT_NAME, NUM_CLAIMS, CLAIM_PMT])
+               + sorted(['EXPOSURE_YEAR', 'EXPOSURE_PREM', SUM_ASSURED]))
+    return df[columns].copy()
 
+def prepare_owa_grouping_sets(df_table: pd.DataFrame, years: list, productName: str,
+                              additional_apply: bool, additional_codes: str, claim_codes: list = None) -> dict:
+    """
+    Chuẩn bị dữ liệu dùng chung cho mọi biến của 1WA (thay vì lọc năm + drop_duplicates cho từng biến, từng năm):
+    - CAL_YEAR và COUNT_NAME được mã hoá thành số nguyên một lần
+    - mask dòng đầu tiên của mỗi COUNT_NAME trong từng năm (tương đương drop_duplicates sau khi lọc năm)
+    - các grouping set: (mã năm, giá trị năm, mask, danh sách năm); năm 0 = tất cả các năm
+    :param claim_codes: nếu có, pivot chứa cột NUM_CLAIMS / CLAIM_PMT của tất cả các code này
+        (tách ra bằng select_code_pivot); cột không có trong dữ liệu bị bỏ qua
+    """
     df_table['CAL_YEAR'] = df_table['CAL_YEAR'].astype(int)
-    if pol_year_ind != 0:
-        df_table = df_table.loc[df_table['CAL_YEAR'] == pol_year_ind]
+    COUNT_NAME, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED = setup_analysis_params(
+        productName, additional_apply, additional_codes
+    )
+    if claim_codes is None:
+        claims = [NUM_CLAIMS, CLAIM_PMT]
+    else:
+        claims = [col for col in claim_columns(productName, additional_apply, claim_codes) if col in df_table.columns]
+
+    # NaN → -1; drop_duplicates coi các NaN là trùng nhau nên -1 cũng được xử lý như một giá trị
+    count_codes, count_uniques = pd.factorize(df_table[COUNT_NAME])
+    count_codes = count_codes.astype(np.int64)
+    count_size = len(count_uniques) + 1
+    # Các cột measure tách sẵn một lần, mỗi biến chỉ cộng theo nhóm trên hai frame này
+    other_base = df_table[claims].reset_index(drop=True)
+    exposure_base = df_table[['EXPOSURE_YEAR', 'EXPOSURE_PREM', SUM_ASSURED]].reset_index(drop=True)
+
+    grouping_sets = []
+    years = [int(year) for year in years]
+    yearly = [year for year in years if year != 0]
+    if yearly:
+        year_codes, year_values = pd.factorize(df_table['CAL_YEAR'], sort=True)
+        year_codes = year_codes.astype(np.int64)
+        first_in_year = first_occurrence_mask(year_codes * count_size + count_codes + 1)
+        grouping_sets.append((year_codes, list(year_values), first_in_year, yearly))
+    if 0 in years:
+        all_codes = np.zeros(len(df_table), dtype=np.int64)
+        grouping_sets.append((all_codes, [0], first_occurrence_mask(count_codes), [0]))
+
+    return {
+        'df': df_table,
+        'other_base': other_base,
+        'exposure_base': exposure_base,
+        'count_codes': count_codes,
+        'count_size': count_size,
+        'grouping_sets': grouping_sets,
+        'columns': (COUNT_NAME, claims, SUM_ASSURED),
+    }
+
+def OWA_grouping_set_pivots(context: dict, byvar: str) -> dict:
+    """
+    Tính pivot của một biến cho tất cả các năm trong một lần group theo mã (năm × giá trị biến).
 
-    # Setup parameters
+    Trả về {năm: bảng tương đương calculate_pivot_tables(df của năm đó, [byvar], ...)}:
+    cùng thứ tự dòng (pivot_table sort theo giá trị / thứ tự category), category không xuất hiện vẫn có dòng
+    (observed=False), giá trị NaN của biến bị bỏ qua. Số đếm chính xác; tổng float dùng group_sums (thứ tự cộng khác
+    pandas.pivot_table) nên khớp trong rtol 1e-9. Năm không có trong kết quả thì caller dùng OWA_func.
+    """
+    df_table = context['df']
+    other_base = context['other_base']
+    exposure_base = context['exposure_base']
+    count_codes = context['count_codes']
+    count_size = context['count_size']
+    COUNT_NAME, claims, SUM_ASSURED = context['columns']
+    if byvar == 'CAL_YEAR' or byvar in (COUNT_NAME, *claims, 'EXPOSURE_YEAR', 'EXPOSURE_PREM', SUM_ASSURED):
+        return {}
+
+    var_codes, levels, ordered = factorize_dim(df_table[byvar])
+    n_levels = len(levels)
+    if n_levels == 0:
+        return {}
+
+    valid = var_codes >= 0
+    pivots = {}
+    for year_codes, year_values, first_mask, years in context['grouping_sets']:
+        n_groups = len(year_values) * n_levels
+        # Dòng bị loại (biến NaN, không phải dòng đầu của COUNT_NAME) được gom vào nhóm n_groups rồi bỏ đi,
+        # tránh phải copy dữ liệu theo mask
+        group_ids = np.where(valid, year_codes * n_levels + var_codes, n_groups)
+        exposure_ids = np.where(first_mask, group_ids, n_groups)
+        other_rows = np.bincount(group_ids, minlength=n_groups + 1)
+        exposure_rows = np.bincount(exposure_ids, minlength=n_groups + 1)
+        other_sums = {column: group_sums(group_ids, other_base[column].to_numpy(), n_groups + 1)
+                      for column in other_base.columns}
+        exposure_sums = {column: group_sums(exposure_ids, exposure_base[column].to_numpy(), n_groups + 1)
+                         for column in exposure_base.columns}
+        nunique = group_nunique(group_ids, count_codes, count_size, n_groups + 1)
+
+        for year in years:
+            if year not in year_values:
+                continue
+            offset = year_values.index(year) * n_levels
+            other_groups = offset + np.flatnonzero(other_rows[offset:offset + n_levels])
+            exposure_groups = offset + np.flatnonzero(exposure_rows[offset:offset + n_levels])
+            if len(other_groups) == 0 or len(exposure_groups) == 0:
+                continue
+            if ordered is not None:
+                # observed=False: đủ mọi category, category không có dữ liệu có tổng = 0
+                other_groups = exposure_groups = np.arange(offset, offset + n_levels)
+
+            other_year = pd.DataFrame({
+                COUNT_NAME: nunique[other_groups],
+                **{column: downcast_sums(sums[other_groups], other_base[column].dtype) for column, sums in other_sums.items()},
+            }, index=level_index(levels, ordered, other_groups - offset, byvar))
+            exposure_year = pd.DataFrame(
+                {column: downcast_sums(sums[exposure_groups], exposure_base[column].dtype)
+                 for column, sums in exposure_sums.items()},
+                index=level_index(levels, ordered, exposure_groups - offset, byvar)
+            )
+
+            pivots[year] = pd.concat(
+                [other_year.sort_index(axis=1), exposure_year.sort_index(axis=1)], axis=1
+            ).reset_index()
+    return pivots
+
+def finalize_multiway_table(df: pd.DataFrame, pol_year_ind: int, byvars: list, var_code: str, productName: str,
+                            additional_apply: bool = False, additional_codes: str = "",
+                            additional_descriptions: str = "") -> pd.DataFrame:
+    """
+    Phần sau pivot của TWA_func / threeway_func / fourway_func: tính metrics, đặt nhãn và format bảng kết quả.
+    Dùng chung với GLMCube để bảng suy ra từ cube có cùng định dạng.
+    """
     COUNT_NAME, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED = setup_analysis_params(
         productName, additional_apply, additional_codes
     )
 
-    # Calculate pivot tables
-    df = calculate_pivot_tables(df_table, [byvar1, byvar2], COUNT_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED)
-    
     # Setup categorical columns
-    df = setup_categorical_columns(df, [byvar1, byvar2])
+    df = setup_categorical_columns(df, byvars)
 
     if df.empty:
         raise HTTPException(status_code=409, detail="Lỗi thiết lập file chưa đúng.")
@@ -304,113 +524,67 @@ def TWA_func(pol_year_ind: int, df_table: pd.DataFrame, byvar1: str, byvar2: str
 
     # Setup result columns
     df['VAR_YEAR'] = pol_year_ind
-    df['VAR_NAME_CODE'] = var_code + ": " + byvar1 + " & " + byvar2 + (": " + str(additional_codes) if additional_apply else "")
-    df['VAR_NAME1'] = byvar1 + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_NAME2'] = byvar2 + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_DETAIL1'] = df[byvar1].astype(str) + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_DETAIL2'] = df[byvar2].astype(str) + (": " + str(additional_descriptions) if additional_apply else "")
+    df['VAR_NAME_CODE'] = var_code + ": " + " & ".join(byvars) + (": " + str(additional_codes) if additional_apply else "")
+    for i, byvar in enumerate(byvars, start=1):
+        df[f'VAR_NAME{i}'] = byvar + (": " + str(additional_descriptions) if additional_apply else "")
+    for i, byvar in enumerate(byvars, start=1):
+        df[f'VAR_DETAIL{i}'] = df[byvar].astype(str) + (": " + str(additional_descriptions) if additional_apply else "")
 
-    df = df.drop(columns=[byvar1, byvar2])
+    df = df.drop(columns=list(byvars))
     df.rename(columns={COUNT_NAME: LABEL_NAME}, inplace=True)
-    
-    new_order_col = ['VAR_YEAR','VAR_NAME_CODE','VAR_NAME1','VAR_NAME2','VAR_DETAIL1','VAR_DETAIL2',
-                     LABEL_NAME,'NUM_CLAIMS','EXPOSURE_YEAR','EXPOSURE_PREM',
-                     'CLAIM_PMT','FREQUENCY','SEVERITY','AVG_PREMIUM','PURE_PREMIUM','LOSS_RATIO','GWP_%', 'SUM_ASSURED','AVG_SUM_ASSURED']
 
-    return format_final_dataframe(df, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, new_order_col)
+    new_order_col = (['VAR_YEAR','VAR_NAME_CODE']
+                     + [f'VAR_NAME{i}' for i in range(1, len(byvars) + 1)]
+                     + [f'VAR_DETAIL{i}' for i in range(1, len(byvars) + 1)]
+                     + [LABEL_NAME,'NUM_CLAIMS','EXPOSURE_YEAR','EXPOSURE_PREM',
+                        'CLAIM_PMT','FREQUENCY','SEVERITY','AVG_PREMIUM','PURE_PREMIUM','LOSS_RATIO','GWP_%', 'SUM_ASSURED','AVG_SUM_ASSURED'])
 
-# Updated THREE WAY ANALYSIS
-def threeway_func(pol_year_ind: int, df_table: pd.DataFrame, byvar1: str, byvar2: str, byvar3: str,
-                  var_code: str, productName: str, 
-                  additional_apply: bool = False, additional_codes: str = "", 
-                  additional_descriptions: str = "") -> pd.DataFrame:
+    return format_final_dataframe(df, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, new_order_col)
 
-    df_table['CAL_YEAR'] = df_table['CAL_YEAR'].astype(int)
-    if pol_year_ind != 0:
-        df_table = df_table.loc[df_table['CAL_YEAR'] == pol_year_ind]
+def multiway_func(pol_year_ind: int, df_table: pd.DataFrame, byvars: list,
+                  var_code: str, productName: str,
+                  additional_apply: bool = False, additional_codes: str = "",
+                  additional_descriptions: str = "", year_index: dict = None) -> pd.DataFrame:
 
     # Setup parameters
     COUNT_NAME, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED = setup_analysis_params(
         productName, additional_apply, additional_codes
     )
 
-    # Calculate pivot tables
-    df = calculate_pivot_tables(df_table, [byvar1, byvar2, byvar3], COUNT_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED)
-    
-    # Setup categorical columns
-    df = setup_categorical_columns(df, [byvar1, byvar2, byvar3])
+    if year_index is not None:
+        df_table, exposure_index = year_slice(year_index, pol_year_ind)
+    else:
+        df_table['CAL_YEAR'] = df_table['CAL_YEAR'].astype(int)
+        if pol_year_ind != 0:
+            df_table = df_table.loc[df_table['CAL_YEAR'] == pol_year_ind]
+        exposure_index = None
 
-    if df.empty:
-        raise HTTPException(status_code=409, detail="Lỗi thiết lập file chưa đúng.")
+    # Calculate pivot tables
+    df = calculate_pivot_tables(df_table, list(byvars), COUNT_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED, exposure_index)
 
-    # Calculate metrics
-    df = calculate_metrics(df, COUNT_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED)
+    return finalize_multiway_table(df, pol_year_ind, list(byvars), var_code, productName,
+                                   additional_apply, additional_codes, additional_descriptions)
 
-    # Setup result columns
-    df['VAR_YEAR'] = pol_year_ind
-    df['VAR_NAME_CODE'] = var_code + ": " + byvar1 + " & " + byvar2 + " & " + byvar3 + (": " + str(additional_codes) if additional_apply else "")
-    df['VAR_NAME1'] = byvar1 + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_NAME2'] = byvar2 + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_NAME3'] = byvar3 + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_DETAIL1'] = df[byvar1].astype(str) + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_DETAIL2'] = df[byvar2].astype(str) + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_DETAIL3'] = df[byvar3].astype(str) + (": " + str(additional_descriptions) if additional_apply else "")
-
-    df = df.drop(columns=[byvar1, byvar2, byvar3])
-    df.rename(columns={COUNT_NAME: LABEL_NAME}, inplace=True)
-    
-    new_order_col = ['VAR_YEAR','VAR_NAME_CODE','VAR_NAME1','VAR_NAME2','VAR_NAME3',
-                     'VAR_DETAIL1','VAR_DETAIL2','VAR_DETAIL3',
-                     LABEL_NAME,'NUM_CLAIMS','EXPOSURE_YEAR','EXPOSURE_PREM',
-                     'CLAIM_PMT','FREQUENCY','SEVERITY','AVG_PREMIUM','PURE_PREMIUM','LOSS_RATIO','GWP_%', 'SUM_ASSURED','AVG_SUM_ASSURED']
+# Updated TWO WAY ANALYSIS
+def TWA_func(pol_year_ind: int, df_table: pd.DataFrame, byvar1: str, byvar2: str, 
+             var_code: str, productName: str, 
+             additional_apply: bool = False, additional_codes: str = "", 
+             additional_descriptions: str = "", year_index: dict = None) -> pd.DataFrame:
+    return multiway_func(pol_year_ind, df_table, [byvar1, byvar2], var_code, productName,
+                         additional_apply, additional_codes, additional_descriptions, year_index)
 
-    return format_final_dataframe(df, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, new_order_col)
+# Updated THREE WAY ANALYSIS
+def threeway_func(pol_year_ind: int, df_table: pd.DataFrame, byvar1: str, byvar2: str, byvar3: str,
+                  var_code: str, productName: str, 
+                  additional_apply: bool = False, additional_codes: str = "", 
+                  additional_descriptions: str = "", year_index: dict = None) -> pd.DataFrame:
+    return multiway_func(pol_year_ind, df_table, [byvar1, byvar2, byvar3], var_code, productName,
+                         additional_apply, additional_codes, additional_descriptions, year_index)
 
 # Updated FOUR WAY ANALYSIS
 def fourway_func(pol_year_ind: int, df_table: pd.DataFrame, byvar1: str, byvar2: str, byvar3: str, byvar4: str,
                  var_code: str, productName: str, 
                  additional_apply: bool = False, additional_codes: str = "", 
-                 additional_descriptions: str = "") -> pd.DataFrame:
-
-    df_table['CAL_YEAR'] = df_table['CAL_YEAR'].astype(int)
-    if pol_year_ind != 0:
-        df_table = df_table.loc[df_table['CAL_YEAR'] == pol_year_ind]
-
-    # Setup parameters
-    COUNT_NAME, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED = setup_analysis_params(
-        productName, additional_apply, additional_codes
-    )
-
-    # Calculate pivot tables
-    df = calculate_pivot_tables(df_table, [byvar1, byvar2, byvar3, byvar4], COUNT_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED)
-    
-    # Setup categorical columns
-    df = setup_categorical_columns(df, [byvar1, byvar2, byvar3, byvar4])
-
-    if df.empty:
-        raise HTTPException(status_code=409, detail="Lỗi thiết lập file chưa đúng.")
-
-    # Calculate metrics
-    df = calculate_metrics(df, COUNT_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED)
-
-    # Setup result columns
-    df['VAR_YEAR'] = pol_year_ind
-    df['VAR_NAME_CODE'] = var_code + ": " + byvar1 + " & " + byvar2 + " & " + byvar3 + " & " + byvar4 + (": " + str(additional_codes) if additional_apply else "")
-    df['VAR_NAME1'] = byvar1 + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_NAME2'] = byvar2 + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_NAME3'] = byvar3 + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_NAME4'] = byvar4 + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_DETAIL1'] = df[byvar1].astype(str) + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_DETAIL2'] = df[byvar2].astype(str) + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_DETAIL3'] = df[byvar3].astype(str) + (": " + str(additional_descriptions) if additional_apply else "")
-    df['VAR_DETAIL4'] = df[byvar4].astype(str) + (": " + str(additional_descriptions) if additional_apply else "")
-
-    df = df.drop(columns=[byvar1, byvar2, byvar3, byvar4])
-    df.rename(columns={COUNT_NAME: LABEL_NAME}, inplace=True)
-    
-    new_order_col = ['VAR_YEAR','VAR_NAME_CODE','VAR_NAME1','VAR_NAME2','VAR_NAME3','VAR_NAME4',
-                     'VAR_DETAIL1','VAR_DETAIL2','VAR_DETAIL3','VAR_DETAIL4',
-                     LABEL_NAME,'NUM_CLAIMS','EXPOSURE_YEAR','EXPOSURE_PREM',
-                     'CLAIM_PMT','FREQUENCY','SEVERITY','AVG_PREMIUM','PURE_PREMIUM','LOSS_RATIO','GWP_%', 'SUM_ASSURED','AVG_SUM_ASSURED']
-
-    return format_final_dataframe(df, LABEL_NAME, NUM_CLAIMS, CLAIM_PMT, new_order_col)
\ No newline at end of file
+                 additional_descriptions: str = "", year_index: dict = None) -> pd.DataFrame:
+    return multiway_func(pol_year_ind, df_table, [byvar1, byvar2, byvar3, byvar4], var_code, productName,
+                         additional_apply, additional_codes, additional_descriptions, year_index)
@@ -0,0 +1,388 @@
+import io
+import os
+import json
+import hashlib
+import posixpath
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import urlparse, urlunparse
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config.log_config import logger
+from modules.storage import get_storage
+
+DATASET_CATALOG_ENABLED = os.getenv("DATASET_CATALOG_ENABLED", "true").lower() in ("1", "true", "yes")
+# Thư mục (trong prefix) chứa entry JSON của từng dataset, và bản gộp các entry
+CATALOG_ENTRIES_DIR = "_catalog"
+CATALOG_MANIFEST_NAME = "_catalog.parquet"
+# Số entry phải đọc lại trong một lần list vượt ngưỡng này thì ghi lại bản gộp
+CATALOG_COMPACT_THRESHOLD = int(os.getenv("CATALOG_COMPACT_THRESHOLD", 50))
+# Số thread ghi entry nền, và thời gian (giây) get_entry chờ lần record đang chạy của cùng file
+CATALOG_RECORD_WORKERS = int(os.getenv("CATALOG_RECORD_WORKERS", 2))
+CATALOG_RECORD_WAIT = float(os.getenv("CATALOG_RECORD_WAIT", 30))
+# Số dòng tối đa lấy mẫu để ước lượng số giá trị distinct của mỗi cột
+DISTINCT_SAMPLE_ROWS = 100_000
+
+MANIFEST_SCHEMA = pa.schema([
+    ("key", pa.string()),
+    ("name", pa.string()),
+    ("profile", pa.string()),
+    ("created_at", pa.timestamp("ms", tz="UTC")),
+    ("etag", pa.string()),
+    ("size_bytes", pa.int64()),
+    ("num_rows", pa.int64()),
+    ("num_row_groups", pa.int64()),
+    ("partition_by", pa.string()),
+    # Các trường lồng nhau lưu dạng JSON để manifest giữ schema phẳng, đơn giản
+    ("schema_json", pa.string()),
+    ("column_stats_json", pa.string()),
+    ("partitions_json", pa.string()),
+    ("lineage_json", pa.string()),
+    ("metadata_json", pa.string()),
+    # ETag của entry object tại thời điểm gộp: entry đổi ETag sau đó sẽ được đọc lại
+    ("entry_etag", pa.string()),
+])
+_JSON_FIELDS = {
+    "schema_json": "schema",
+    "column_stats_json": "column_stats",
+    "partitions_json": "partitions",
+    "lineage_json": "lineage",
+    "metadata_json": "metadata",
+}
+# Metadata của schema do pyarrow / writer quản lý, không đưa vào entry["metadata"]
+_RESERVED_METADATA_KEYS = {b"pandas", b"ARROW:schema", b"partition_by"}
+
+def catalog_prefix(key: str) -> str:
+    """
+    Prefix (thư mục) chứa manifest của một dataset.
+    Key dạng report-software/<module>/<user>/... → một manifest cho mỗi user của mỗi module,
+    các key khác dùng thư mục chứa file.
+    """
+    parts = key.split("/")
+    if len(parts) >= 4 and parts[0] == "report-software":
+        return "/".join(parts[:3])
+    return posixpath.dirname(key)
+
+def strip_url_query(url: str) -> str:
+    """Bỏ query string (chữ ký của signed URL) trước khi lưu URL nguồn vào lineage"""
+    parsed = urlparse(url)
+    return urlunparse(parsed._replace(query="", fragment=""))
+
+def _estimate_distinct(values: pd.Series) -> int:
+    """
+    Ước lượng số giá trị distinct từ mẫu theo GEE (Charikar et al.):
+    giá trị chỉ xuất hiện một lần trong mẫu được nhân sqrt(N / n), các giá trị còn lại đếm một lần.
+    """
+    total = len(values)
+    if total <= DISTINCT_SAMPLE_ROWS:
+        return int(values.nunique(dropna=True))
+    counts = values.sample(DISTINCT_SAMPLE_ROWS, random_state=0).value_counts(dropna=True)
+    singletons = int((counts == 1).sum())
+    estimate = (total / DISTINCT_SAMPLE_ROWS) ** 0.5 * singletons + (len(counts) - singletons)
+    return int(min(estimate, total))
+
+def _column_stats(metadata: pq.FileMetaData, data=None) -> dict:
+    """min / max / null_count từ statistics trong footer, distinct ước lượng từ dữ liệu (nếu có)"""
+    stats = {}
+    for rg_index in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg_index)
+        for col_index in range(row_group.num_columns):
+            column = row_group.column(col_index)
+            entry = stats.setdefault(column.path_in_schema, {"min": None, "max": None, "null_count": 0})
+            statistics = column.statistics
+            if statistics is None:
+                entry["null_count"] = None
+                continue
+            if entry["null_count"] is not None and statistics.has_null_count:
+                entry["null_count"] += statistics.null_count
+            if statistics.has_min_max:
+                if entry["min"] is None or statistics.min < entry["min"]:
+                    entry["min"] = statistics.min
+                if entry["max"] is None or statistics.max > entry["max"]:
+                    entry["max"] = statistics.max
+
+    if data is not None:
+        for name in stats:
+            try:
+                if isinstance(data, pa.Table):
+                    values = data.column(name).to_pandas() if name in data.column_names else None
+                else:
+                    values = data[name] if name in data.columns else None
+                if values is not None:
+                    stats[name]["distinct_estimate"] = _estimate_distinct(values)
+            except TypeError:
+                # Cột chứa giá trị không hash được (list, dict...)
+                continue
+    return stats
+
+def _partitions(metadata: pq.FileMetaData, partition_by: Optional[str]) -> list:
+    """Các giá trị phân vùng: mỗi row group chỉ chứa một giá trị nên lấy từ min của cột phân vùng"""
+    if not partition_by:
+        return []
+    values = set()
+    for rg_index in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg_index)
+        for col_index in range(row_group.num_columns):
+            column = row_group.column(col_index)
+            if column.path_in_schema == partition_by and column.statistics is not None and column.statistics.has_min_max:
+                values.add(column.statistics.min)
+    return sorted(values)
+
+def build_entry(key: str, metadata: pq.FileMetaData, data=None, profile: Optional[str] = None,
+                lineage: Optional[list] = None, size: Optional[int] = None, etag: Optional[str] = None) -> dict:
+    """Tạo một dòng catalog từ footer parquet (và dữ liệu vừa ghi nếu có)"""
+    arrow_schema = metadata.schema.to_arrow_schema()
+    schema_metadata = arrow_schema.metadata or {}
+    partition_by = schema_metadata.get(b"partition_by", b"").decode("utf-8") or None
+    custom_metadata = {
+        key.decode("utf-8"): value.decode("utf-8")
+        for key, value in schema_metadata.items() if key not in _RESERVED_METADATA_KEYS
+    }
+    return {
+        "key": key,
+        "name": posixpath.splitext(posixpath.basename(key))[0],
+        "profile": profile,
+        "created_at": datetime.now(timezone.utc),
+        "etag": etag,
+        "size_bytes": size,
+        "num_rows": metadata.num_rows,
+        "num_row_groups": metadata.num_row_groups,
+        "partition_by": partition_by,
+        "schema": [{"name": field.name, "type": str(field.type)} for field in arrow_schema],
+        "column_stats": _column_stats(metadata, data),
+        "partitions": _partitions(metadata, partition_by),
+        "lineage": lineage or [],
+        "metadata": custom_metadata,
+    }
+
+class DatasetCatalog:
+    """
+    Catalog các dataset (file import, bảng phân tích, báo cáo) theo từng user prefix.
+
+    Mỗi file có một entry riêng `<prefix>/_catalog/<sha256(key)>.json`: schema, số dòng, thống kê cột
+    (min / max / null / distinct ước lượng), phân vùng và lineage. Ghi một file chỉ put entry của chính nó
+    (không read-modify-write object dùng chung) nên các worker ghi đồng thời không làm mất entry của nhau.
+    Entry được ghi trên thread nền sau khi write_parquet_to_s3 / ParquetResultSink.close() ghi xong file,
+    thao tác ghi dữ liệu không phải chờ catalog.
+
+    list_entries() list các entry của prefix và chỉ đọc lại entry đổi ETag; `<prefix>/_catalog.parquet` là bản gộp
+    (compact) của các entry, chỉ để process mới khởi động đọc nhanh và có thể dựng lại bất cứ lúc nào.
+    """
+
+    def __init__(self, enabled: bool = DATASET_CATALOG_ENABLED):
+        self.enabled = enabled
+        self._entries = {}    # entry object key -> (etag, entry)
+        self._snapshots = {}  # prefix -> ETag của bản compact đã nạp
+        self._pending = {}    # dataset key -> Future của lần record đang chạy nền
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=CATALOG_RECORD_WORKERS, thread_name_prefix="catalog")
+        return self._executor
+
+    @staticmethod
+    def _entries_dir(prefix: str) -> str:
+        return posixpath.join(prefix, CATALOG_ENTRIES_DIR) if prefix else CATALOG_ENTRIES_DIR
+
+    @classmethod
+    def _entry_key(cls, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return posixpath.join(cls._entries_dir(catalog_prefix(key)), f"{digest}.json")
+
+    @staticmethod
+    def _manifest_key(prefix: str) -> str:
+        return posixpath.join(prefix, CATALOG_MANIFEST_NAME) if prefix else CATALOG_MANIFEST_NAME
+
+    @staticmethod
+    def _decode(payload: bytes) -> dict:
+        entry = json.loads(payload)
+        if entry.get("created_at"):
+            entry["created_at"] = datetime.fromisoformat(entry["created_at"])
+        return entry
+
+    def _put_entry(self, entry: dict):
+        payload = json.dumps(entry, default=str, ensure_ascii=False).encode("utf-8")
+        entry_key = self._entry_key(entry["key"])
+        result = get_storage().put(entry_key, payload, content_type="application/json")
+        with self._lock:
+            self._entries[entry_key] = (result.get("etag"), entry)
+
+    def _load_snapshot(self, prefix: str):
+        """Nạp bản compact (nếu có và chưa nạp) vào cache entry, kèm ETag của từng entry object"""
+        storage = get_storage()
+        manifest_key = self._manifest_key(prefix)
+        try:
+            etag = storage.head(manifest_key)["etag"]
+        except FileNotFoundError:
+            return
+        if self._snapshots.get(prefix) == etag:
+            return
+        table = pq.read_table(io.BytesIO(storage.get(manifest_key)))
+        loaded = {}
+        for row in table.to_pylist():
+            for column, field in _JSON_FIELDS.items():
+                row[field] = json.loads(row.pop(column)) if row.get(column) else None
+            entry_etag = row.pop("entry_etag")
+            loaded[self._entry_key(row["key"])] = (entry_etag, row)
+        with self._lock:
+            for entry_key, item in loaded.items():
+                self._entries.setdefault(entry_key, item)
+            self._snapshots[prefix] = etag
+
+    def _load(self, prefix: str) -> dict:
+        """{key: entry} của prefix: list các entry object, chỉ GET entry chưa có trong cache hoặc đã đổi ETag"""
+        storage = get_storage()
+        self._load_snapshot(prefix)
+        entries, fetched = {}, 0
+        for item in storage.list(self._entries_dir(prefix) + "/"):
+            entry_key = item["key"]
+            cached = self._entries.get(entry_key)
+            if cached is None or cached[0] != item["etag"]:
+                try:
+                    cached = (item["etag"], self._decode(storage.get(entry_key)))
+                except FileNotFoundError:
+                    continue
+                with self._lock:
+                    self._entries[entry_key] = cached
+                fetched += 1
+            entries[cached[1]["key"]] = cached[1]
+        if fetched >= CATALOG_COMPACT_THRESHOLD:
+            try:
+                self.compact(prefix, entries)
+            except Exception as e:
+                logger.warning(f"Could not compact dataset catalog {prefix}: {e}")
+        return entries
+
+    def compact(self, prefix: str, entries: Optional[dict] = None) -> int:
+        """
+        Gộp các entry của prefix thành `<prefix>/_catalog.parquet`. Bản compact chỉ là cache dẫn xuất
+        (entry object vẫn là nguồn chính) nên compact đồng thời từ nhiều worker không làm mất dữ liệu.
+        """
+        if entries is None:
+            entries = self._load(prefix)
+        rows = []
+        for key, entry in entries.items():
+            cached = self._entries.get(self._entry_key(key))
+            row = {name: entry.get(name) for name in MANIFEST_SCHEMA.names if name not in _JSON_FIELDS}
+            for column, field in _JSON_FIELDS.items():
+                row[column] = json.dumps(entry.get(field), default=str, ensure_ascii=False)
+            row["entry_etag"] = cached[0] if cached else None
+            rows.append(row)
+        table = pa.Table.from_pylist(sorted(rows, key=lambda row: row["key"]), schema=MANIFEST_SCHEMA)
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, compression="zstd")
+        result = get_storage().put(self._manifest_key(prefix), buffer.getvalue(), content_type="application/octet-stream")
+        self._snapshots[prefix] = result.get("etag")
+        return len(rows)
+
+    def _record(self, key: str, metadata: pq.FileMetaData, data, profile, lineage, size):
+        try:
+            etag = get_storage().head(key)["etag"]
+            self._put_entry(build_entry(key, metadata, data, profile, lineage, size, etag))
+        except Exception as e:
+            logger.warning(f"Could not update dataset catalog for {key}: {e}")
+
+    def record(self, key: str, metadata: pq.FileMetaData, data=None, profile: Optional[str] = None,
+               lineage: Optional[list] = None, size: Optional[int] = None) -> Optional[Future]:
+        """
+        Ghi / cập nhật entry của file vừa ghi trên thread nền, không chặn thao tác ghi dữ liệu.
+        Lỗi catalog chỉ được log; trả về Future để chờ khi cần (xem flush()).
+        """
+        if not self.enabled or posixpath.basename(key) == CATALOG_MANIFEST_NAME:
+            return None
+        future = self._get_executor().submit(self._record, key, metadata, data, profile, lineage, size)
+        with self._lock:
+            self._pending[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def _forget(self, key: str, future: Future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def flush(self, timeout: Optional[float] = None):
+        """Chờ các lần record đang chạy nền (khi shutdown / trong test)"""
+        with self._lock:
+            futures = list(self._pending.values())
+        wait(futures, timeout=timeout)
+
+    def describe(self, key: str) -> dict:
+        """Dựng entry chỉ từ footer của file (range read phần cuối file, không đọc dữ liệu)"""
+        storage = get_storage()
+        info = storage.head(key)
+        with storage.open_input_file(key) as source:
+            metadata = pq.ParquetFile(source).metadata
+        return build_entry(key, metadata, size=info["size"], etag=info["etag"])
+
+    def get_entry(self, key: str) -> Optional[dict]:
+        """
+        Entry của một dataset (một GET, không list cả prefix). Chưa có entry (file ghi trước khi có catalog,
+        record của worker khác chưa xong) thì dựng từ footer và ghi bổ sung nếu entry vẫn chưa xuất hiện.
+        """
+        if not self.enabled:
+            return None
+        storage = get_storage()
+        entry_key = self._entry_key(key)
+        try:
+            pending = self._pending.get(key)
+            if pending is not None:
+                wait([pending], timeout=CATALOG_RECORD_WAIT)
+            try:
+                return self._decode(storage.get(entry_key))
+            except FileNotFoundError:
+                pass
+            entry = self.describe(key)
+            try:
+                storage.head(entry_key)
+            except FileNotFoundError:
+                self._put_entry(entry)
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not read dataset catalog for {key}: {e}")
+            return None
+
+    def list_entries(self, prefix: str) -> list:
+        """Tất cả entry của prefix (ví dụ report-software/glm/<user>)"""
+        return sorted(self._load(prefix).values(), key=lambda entry: entry["key"])
+
+    def remove(self, key: str):
+        entry_key = self._entry_key(key)
+        get_storage().delete(entry_key)
+        with self._lock:
+            self._entries.pop(entry_key, None)
+
+    def rebuild(self, prefix: str) -> int:
+        """Dựng lại entry từ footer của mọi file parquet dưới prefix (giữ lại lineage / profile đã có), rồi compact"""
+        storage = get_storage()
+        existing = self._load(prefix)
+        entries = {}
+        for item in storage.list(prefix):
+            key = item["key"]
+            if not key.endswith(".parquet") or posixpath.basename(key) == CATALOG_MANIFEST_NAME:
+                continue
+            if catalog_prefix(key) != prefix:
+                continue
+            entry = self.describe(key)
+            previous = existing.get(key)
+            if previous:
+                entry["lineage"] = previous.get("lineage") or []
+                entry["profile"] = previous.get("profile")
+                entry["created_at"] = previous.get("created_at") or entry["created_at"]
+            self._put_entry(entry)
+            entries[key] = entry
+        for key in set(existing) - set(entries):
+            self.remove(key)
+        self.compact(prefix, entries)
+        return len(entries)
+
+dataset_catalog = DatasetCatalog()
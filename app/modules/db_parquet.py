@@ -1,43 +1,186 @@
-import boto3
-from botocore.client import Config
-import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from config.constants import S3
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from urllib.parse import urlparse
 from config.google_sheets_config import google_sheets_config
 from config.log_config import logger
 from typing import Any, Dict, Optional
+from fastapi import HTTPException
 from datetime import datetime
+from modules.storage import get_storage
+from modules.parquet_writer import write_parquet, ParquetStreamWriter, DEFAULT_WRITE_PROFILE
+from modules.catalog import dataset_catalog, strip_url_query
+from utils.executors import run_io, run_cancellable, io_cancel_event, STORAGE_READ_TIMEOUT, STORAGE_WRITE_TIMEOUT
 
 cfg = S3
 
+# Số upload chạy song song tối đa trong một process (không vượt quá connection pool của client)
+MAX_UPLOAD_WORKERS = int(cfg.get("MAX_UPLOAD_WORKERS", 8))
+
+def write_parquet_to_s3(data, key: str, bucket: Optional[str] = None, profile: Optional[str] = None,
+                        row_group_size: Optional[int] = None, partition_by: Optional[str] = None,
+                        lineage: Optional[list] = None, schema_metadata: Optional[dict] = None, **write_options) -> int:
+    """
+    Ghi DataFrame (hoặc pyarrow.Table) thành parquet và stream từng row group lên storage (S3 / local / memory).
+
+    Bộ nhớ phát sinh chỉ khoảng một row group cộng một part upload thay vì 2 lần kích thước file.
+    :param profile: Profile ghi trong modules.parquet_writer ("bulk_import", "analysis_result", "small_report")
+    :param partition_by: Cột phân vùng (ví dụ CAL_YEAR), mỗi row group chỉ chứa một giá trị
+    :param lineage: Các nguồn tạo ra file (key / URL input), lưu vào dataset catalog
+    :param schema_metadata: key/value thêm vào metadata của file (đọc lại qua entry["metadata"] của catalog)
+    :param write_options: ghi đè tham số của profile (compression, use_dictionary, ...)
+    :return: Số bytes đã ghi
+    """
+    with get_storage().open_writer(key, bucket=bucket) as sink:
+        metadata = write_parquet(data, sink, profile=profile, row_group_size=row_group_size,
+                                 partition_by=partition_by, schema_metadata=schema_metadata, **write_options)
+        size = sink.tell()
+    # Catalog chỉ theo dõi bucket mặc định; entry được ghi trên thread nền, không chặn lần ghi này
+    if bucket is None:
+        dataset_catalog.record(key, metadata, data=data, profile=profile or DEFAULT_WRITE_PROFILE,
+                               lineage=lineage, size=size)
+    return size
+
+class ParquetResultSink:
+    """
+    Bảng kết quả ghi dần lên storage: mỗi append() thêm một block vào ParquetStreamWriter
+    đang mở trên storage writer (S3 multipart / file local / memory), thay vì gom cả bảng trong RAM rồi mới ghi.
+    close() hoàn tất file, ghi dataset catalog (nền) và trả về số bytes như write_parquet_to_s3;
+    abort() huỷ file (object không xuất hiện trên storage).
+    """
+
+    def __init__(self, key: str, bucket: Optional[str] = None, profile: Optional[str] = None,
+                 lineage: Optional[list] = None, **write_options):
+        self.key = key
+        self.bucket = bucket
+        self.profile = profile or DEFAULT_WRITE_PROFILE
+        self.lineage = lineage
+        self._sink = get_storage().open_writer(key, bucket=bucket)
+        self._writer = ParquetStreamWriter(self._sink, profile=self.profile, **write_options)
+        self._closed = False
+
+    @property
+    def num_rows(self) -> int:
+        return self._writer.num_rows
+
+    def append(self, data):
+        self._writer.append(data)
+
+    def close(self) -> int:
+        if self._closed:
+            raise ValueError(f"Result sink for {self.key} is already closed")
+        self._closed = True
+        try:
+            metadata = self._writer.close()
+            size = self._sink.tell()
+        except BaseException:
+            self._writer.abort()
+            self._sink.abort()
+            raise
+        self._sink.close()
+        if self.bucket is None:
+            dataset_catalog.record(self.key, metadata, profile=self.profile, lineage=self.lineage, size=size)
+        return size
+
+    def abort(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._writer.abort()
+        self._sink.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        elif not self._closed:
+            self.close()
+
+_upload_executor = None
+_upload_executor_lock = threading.Lock()
+
+def get_upload_executor() -> ThreadPoolExecutor:
+    """Thread pool dùng chung (bounded) cho các upload chạy song song"""
+    global _upload_executor
+    if _upload_executor is None:
+        with _upload_executor_lock:
+            if _upload_executor is None:
+                _upload_executor = ThreadPoolExecutor(
+                    max_workers=MAX_UPLOAD_WORKERS, thread_name_prefix="parquet-upload"
+                )
+    return _upload_executor
+
+class ParquetArtifactWriter:
+    """
+    Serialize và upload nhiều output parquet độc lập song song.
+
+    Mỗi submit() đẩy một DataFrame lên thread pool dùng chung; results() đợi tất cả
+    hoàn tất và trả về kết quả theo đúng thứ tự submit, kể cả các output bị lỗi.
+    cancel() huỷ các upload chưa xong (writer abort, object không xuất hiện); writer tạo trong run_io
+    dùng luôn cờ huỷ của run_io.
+
+    Ví dụ:
+        writer = ParquetArtifactWriter()
+        writer.submit("pl01", pl01_report, pl01_s3_key)
+        writer.submit("pl02", pl02_report, pl02_s3_key)
+        results = writer.results()
+    """
+
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None):
+        self._executor = executor or get_upload_executor()
+        self._jobs = []
+        self._cancel = io_cancel_event() or threading.Event()
+
+    def submit(self, name: str, data, key: str, **write_options):
+        future = self._executor.submit(run_cancellable, self._cancel, write_parquet_to_s3, data, key, **write_options)
+        self._jobs.append((name, key, future))
+        return future
+
+    def submit_sink(self, name: str, sink: "ParquetResultSink"):
+        """Hoàn tất một ParquetResultSink (phần cuối file + footer) trên thread pool, kết quả nằm trong results()"""
+        future = self._executor.submit(run_cancellable, self._cancel, sink.close)
+        self._jobs.append((name, sink.key, future))
+        return future
+
+    def results(self) -> list:
+        """
+        Đợi tất cả upload và trả về list dict theo thứ tự submit:
+        {"name", "s3_key", "status", "size_bytes", "error"}
+        """
+        results = []
+        for name, key, future in self._jobs:
+            try:
+                size_bytes = future.result()
+                results.append({"name": name, "s3_key": key, "status": True, "size_bytes": size_bytes, "error": None})
+            except Exception as e:
+                results.append({"name": name, "s3_key": key, "status": False, "size_bytes": 0, "error": str(e)})
+        return results
+
+    def cancel(self):
+        """Huỷ các upload chưa hoàn tất (ví dụ khi đợi results() quá timeout)"""
+        self._cancel.set()
+
+    @staticmethod
+    def raise_for_errors(results: list):
+        """Raise RuntimeError gộp tất cả các output upload lỗi"""
+        errors = [f"{item['name']} ({item['s3_key']}): {item['error']}" for item in results if not item["status"]]
+        if errors:
+            raise RuntimeError("Failed to upload parquet: " + "; ".join(errors))
+
 def upload_parquet_to_s3_buffer(df, object_name):
 
-    s3 = boto3.client(
-        "s3",
-        region_name=cfg["REGION"],
-        endpoint_url=cfg["ENDPOINT"],
-        aws_access_key_id=cfg["ACCESS_KEY"],
-        aws_secret_access_key=cfg["SECRET_KEY"],
-        config=Config(s3={"addressing_style": "path"}),
-    )
-    buffer = io.BytesIO()
-    df.to_parquet(buffer, index=False)
-    buffer.seek(0)
-    s3.upload_fileobj(buffer, cfg["BUCKET"], object_name)
+    write_parquet_to_s3(df, object_name, profile="small_report")
     print(f"Uploaded DataFrame to s3://{cfg['BUCKET']}/{object_name}")
 
 def upload_to_s3(bucket, key, data_bytes, mimetype):
     try:
-        s3 = boto3.client(
-            "s3",
-            region_name=cfg["REGION"],
-            endpoint_url=cfg["ENDPOINT"],
-            aws_access_key_id=cfg["ACCESS_KEY"],
-            aws_secret_access_key=cfg["SECRET_KEY"],
-            config=Config(s3={"addressing_style": "path"}),
-        )
-        s3.put_object(Bucket=bucket, Key=key, Body=data_bytes, ContentType=mimetype)
+        get_storage().put(key, data_bytes, content_type=mimetype, bucket=bucket)
         file_url = f"{cfg['ENDPOINT'].rstrip('/')}/{bucket}/{key}"
         return file_url
     except Exception as e:
@@ -49,14 +192,82 @@ def read_parquet_from_s3(key):
     :param key: Đường dẫn (key) của file trên S3 bucket.
     :return: pandas.DataFrame
     """
-    s3_url = f"s3://{cfg['BUCKET']}/{key}"
-    storage_options = {
-        "key": cfg["ACCESS_KEY"],
-        "secret": cfg["SECRET_KEY"],
-        "client_kwargs": {"endpoint_url": cfg["ENDPOINT"]},
-    }
-    df = pd.read_parquet(s3_url, storage_options=storage_options)
-    return df
+    with get_storage().open_input_file(key) as source:
+        return pq.read_table(source).to_pandas()
+
+def build_in_filter(schema: pa.Schema, column: str, values: list):
+    """
+    Tạo pyarrow.dataset expression `column IN values`, ép kiểu values theo kiểu của cột trong file
+    để pyarrow có thể bỏ qua row group dựa trên statistics.
+    Trả về None nếu cột không tồn tại hoặc kiểu cột không hỗ trợ.
+    """
+    if column not in schema.names or not values:
+        return None
+
+    field_type = schema.field(column).type
+    value_type = field_type.value_type if pa.types.is_dictionary(field_type) else field_type
+
+    if pa.types.is_integer(value_type) or pa.types.is_floating(value_type):
+        value_set = pa.array(values).cast(value_type)
+    elif pa.types.is_string(value_type) or pa.types.is_large_string(value_type):
+        value_set = pa.array([str(v) for v in values], type=value_type)
+    else:
+        return None
+    return ds.field(column).isin(value_set)
+
+def read_parquet_dataset(key: str, columns: Optional[list] = None, filters: Optional[Dict[str, list]] = None) -> pd.DataFrame:
+    """
+    Đọc parquet trên storage qua pyarrow.dataset với projection và predicate pushdown.
+
+    Chỉ các column chunk của `columns` và các row group thoả `filters` mới được tải và decode.
+    :param filters: dict {column: list giá trị}, ví dụ {"CAL_YEAR": [2019, 2020]}
+    """
+    with get_storage().open_input_file(key) as source:
+        parquet_format = ds.ParquetFileFormat()
+        fragment = parquet_format.make_fragment(source)
+        dataset = ds.FileSystemDataset([fragment], schema=fragment.physical_schema, format=parquet_format)
+
+        expression = None
+        for column, values in (filters or {}).items():
+            column_filter = build_in_filter(dataset.schema, column, values)
+            if column_filter is not None:
+                expression = column_filter if expression is None else expression & column_filter
+
+        table = dataset.to_table(columns=columns, filter=expression)
+    return table.to_pandas()
+
+def get_object_etag(key: str, bucket: Optional[str] = None) -> str:
+    """Lấy ETag của object trên storage (HEAD request), dùng làm phiên bản dữ liệu cho cache key"""
+    return get_storage().head(key, bucket)["etag"]
+
+# Async wrappers: dùng trong async endpoint để I/O chạy trên IO executor, không chặn event loop
+async def write_parquet_to_s3_async(data, key: str, **kwargs) -> int:
+    return await run_io(write_parquet_to_s3, data, key, timeout=STORAGE_WRITE_TIMEOUT,
+                        operation=f"write {key}", **kwargs)
+
+async def read_parquet_from_s3_async(key: str) -> pd.DataFrame:
+    return await run_io(read_parquet_from_s3, key, timeout=STORAGE_READ_TIMEOUT, operation=f"read {key}")
+
+async def read_parquet_dataset_async(key: str, columns: Optional[list] = None,
+                                     filters: Optional[Dict[str, list]] = None) -> pd.DataFrame:
+    return await run_io(read_parquet_dataset, key, columns=columns, filters=filters,
+                        timeout=STORAGE_READ_TIMEOUT, operation=f"read {key}")
+
+async def wait_for_uploads_async(writer: "ParquetArtifactWriter") -> list:
+    """Đợi các upload của ParquetArtifactWriter kết thúc mà không chặn event loop; quá timeout thì huỷ các upload còn dở"""
+    try:
+        return await run_io(writer.results, timeout=STORAGE_WRITE_TIMEOUT, operation="parquet uploads")
+    except HTTPException:
+        writer.cancel()
+        raise
+
+def is_storage_url(parquet_url: str) -> bool:
+    """Kiểm tra URL (signed hoặc s3://) có trỏ tới bucket của hệ thống hay không"""
+    parsed = urlparse(parquet_url)
+    if parsed.scheme == "s3":
+        return parsed.netloc == cfg["BUCKET"]
+    endpoint = urlparse(cfg["ENDPOINT"])
+    return parsed.netloc == endpoint.netloc and parsed.path.lstrip('/').startswith(cfg["BUCKET"] + "/")
 
 def extract_parquet_key(parquet_url: str) -> str:
     parsed = urlparse(parquet_url)
@@ -67,6 +278,12 @@ def extract_parquet_key(parquet_url: str) -> str:
         path = path[len(bucket) + 1 :]
     return path
 
+def source_lineage(url: str) -> str:
+    """Nguồn ghi vào lineage của catalog: key nếu file nằm trong bucket, ngược lại URL đã bỏ chữ ký"""
+    if is_storage_url(url):
+        return extract_parquet_key(url)
+    return strip_url_query(url)
+
 class GoogleSheetToS3Service:
     def __init__(self):
         self.sheets_client = google_sheets_config.get_client()
@@ -137,8 +354,8 @@ class GoogleSheetToS3Service:
         try:
             logger.info(f"Saving DataFrame to S3: s3://{self.bucket_name}/{s3_key}")
             
-            # Sử dụng function từ db_parquet.py
-            upload_parquet_to_s3_buffer(df, s3_key)
+            # Sử dụng function từ db_parquet.py (chạy trên IO executor)
+            await run_io(upload_parquet_to_s3_buffer, df, s3_key, timeout=STORAGE_WRITE_TIMEOUT)
             
             # Tính toán file size (estimate từ memory usage)
             file_size_mb = df.memory_usage(deep=True).sum() / (1024 * 1024)
@@ -167,7 +384,7 @@ class GoogleSheetToS3Service:
             logger.info(f"Reading parquet from S3: s3://{self.bucket_name}/{s3_key}")
             
             # Sử dụng function từ db_parquet.py
-            df = read_parquet_from_s3(s3_key)
+            df = await read_parquet_from_s3_async(s3_key)
             
             logger.info(f"Successfully read {len(df)} rows and {len(df.columns)} columns from S3")
             return df
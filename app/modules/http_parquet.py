@@ -0,0 +1,281 @@
+import os
+import re
+import bisect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import httpx
+from config.log_config import logger
+from modules.catalog import strip_url_query
+from modules.db_parquet import build_in_filter
+
+# Số bytes cuối file tải trong request đầu tiên (footer + metadata của đa số file nằm trong khoảng này)
+HTTP_FOOTER_PREFETCH_BYTES = int(os.getenv("HTTP_FOOTER_PREFETCH_BYTES", 64 * 1024))
+# Hai range cách nhau không quá khoảng này thì gộp thành một request (tải thừa một ít, đỡ một round trip)
+HTTP_RANGE_COALESCE_BYTES = int(os.getenv("HTTP_RANGE_COALESCE_BYTES", 1024 * 1024))
+# Kích thước tối đa của một range sau khi gộp, để vẫn tải song song được
+HTTP_RANGE_MAX_REQUEST_BYTES = int(os.getenv("HTTP_RANGE_MAX_REQUEST_BYTES", 32 * 1024 * 1024))
+HTTP_RANGE_MAX_WORKERS = int(os.getenv("HTTP_RANGE_MAX_WORKERS", 8))
+HTTP_RANGE_TIMEOUT = float(os.getenv("HTTP_RANGE_TIMEOUT", 60))
+
+_CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+def coalesce_ranges(ranges: list, gap: int = HTTP_RANGE_COALESCE_BYTES,
+                    max_size: int = HTTP_RANGE_MAX_REQUEST_BYTES) -> list:
+    """Gộp các range (start, length) gần nhau; range lớn hơn max_size giữ nguyên"""
+    merged = []
+    for start, length in sorted(r for r in ranges if r[1] > 0):
+        if merged:
+            last_start, last_length = merged[-1]
+            last_end = last_start + last_length
+            end = max(last_end, start + length)
+            if start <= last_end + gap and end - last_start <= max_size:
+                merged[-1] = (last_start, end - last_start)
+                continue
+        merged.append((start, length))
+    return merged
+
+class HTTPRangeFile:
+    """
+    File-like chỉ đọc trên một URL HTTP(S) (signed URL) bằng Range request, dùng với pa.PythonFile.
+
+    Các đoạn đã tải được giữ trong bộ nhớ, đoạn chồng lấn / liền kề được gộp lại khi lưu nên các đoạn luôn rời nhau;
+    read() chỉ tải phần còn thiếu.
+    prefetch() tải song song nhiều range (đã gộp) trước khi reader parquet cần tới.
+    Server không hỗ trợ Range (trả 200) thì toàn bộ file được giữ lại sau request đầu tiên.
+    """
+
+    def __init__(self, url: str, max_workers: int = HTTP_RANGE_MAX_WORKERS, timeout: float = HTTP_RANGE_TIMEOUT):
+        self.url = url
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.closed = False
+        self.bytes_fetched = 0
+        self.requests_count = 0
+        self._position = 0
+        self._starts = []  # start của các đoạn đã tải (rời nhau), sắp xếp tăng dần
+        self._chunks = {}  # start -> bytes
+        self._lock = threading.Lock()
+        self._client = httpx.Client(
+            timeout=timeout, follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers),
+        )
+        self._size = self._fetch_tail(HTTP_FOOTER_PREFETCH_BYTES)
+
+    def _get(self, range_header: str) -> httpx.Response:
+        response = self._client.get(self.url, headers={"Range": range_header})
+        response.raise_for_status()
+        with self._lock:
+            self.bytes_fetched += len(response.content)
+            self.requests_count += 1
+        return response
+
+    def _store(self, start: int, data: bytes):
+        """Lưu đoạn [start, start + len(data)), gộp với các đoạn đã có chồng lấn hoặc liền kề"""
+        if not data:
+            return
+        end = start + len(data)
+        with self._lock:
+            first = bisect.bisect_right(self._starts, start) - 1
+            if first < 0 or self._starts[first] + len(self._chunks[self._starts[first]]) < start:
+                first += 1
+            last = bisect.bisect_right(self._starts, end)
+            overlapping = self._starts[first:last]
+            if not overlapping:
+                self._starts.insert(first, start)
+                self._chunks[start] = data
+                return
+            merged_start = min(start, overlapping[0])
+            merged_end = max(end, overlapping[-1] + len(self._chunks[overlapping[-1]]))
+            if merged_start == overlapping[0] and merged_end == overlapping[0] + len(self._chunks[overlapping[0]]):
+                return  # đã có trọn đoạn này
+            merged = bytearray(merged_end - merged_start)
+            for chunk_start in overlapping:
+                chunk = self._chunks.pop(chunk_start)
+                merged[chunk_start - merged_start:chunk_start - merged_start + len(chunk)] = chunk
+            merged[start - merged_start:end - merged_start] = data
+            self._starts[first:last] = [merged_start]
+            self._chunks[merged_start] = bytes(merged)
+
+    def _fetch_tail(self, length: int) -> int:
+        """Tải `length` bytes cuối (suffix range) và trả về kích thước file"""
+        response = self._get(f"bytes=-{length}")
+        if response.status_code != 206:
+            # Không hỗ trợ Range: đã có cả file
+            self._store(0, response.content)
+            return len(response.content)
+        match = _CONTENT_RANGE_RE.match(response.headers.get("Content-Range", ""))
+        if not match or match.group(3) == "*":
+            raise ValueError(f"Invalid Content-Range from {strip_url_query(self.url)}")
+        self._store(int(match.group(1)), response.content)
+        return int(match.group(3))
+
+    def _fetch(self, start: int, length: int):
+        response = self._get(f"bytes={start}-{start + length - 1}")
+        if response.status_code == 206:
+            self._store(start, response.content)
+        else:
+            self._store(0, response.content)
+
+    def _missing(self, start: int, length: int) -> list:
+        """Các khoảng trong [start, start + length) chưa được tải"""
+        end = min(start + length, self._size)
+        missing = []
+        position = start
+        with self._lock:
+            index = max(bisect.bisect_right(self._starts, position) - 1, 0)
+            while position < end and index < len(self._starts):
+                chunk_start = self._starts[index]
+                chunk_end = chunk_start + len(self._chunks[chunk_start])
+                if chunk_start > position:
+                    missing.append((position, min(chunk_start, end) - position))
+                position = max(position, chunk_end)
+                index += 1
+        if position < end:
+            missing.append((position, end - position))
+        return missing
+
+    def prefetch(self, ranges: list):
+        """Gộp các range (start, length) rồi tải song song phần chưa có"""
+        missing = []
+        for start, length in coalesce_ranges(ranges):
+            missing.extend(self._missing(start, length))
+        missing = coalesce_ranges(missing)
+        if not missing:
+            return
+        if len(missing) == 1:
+            self._fetch(*missing[0])
+            return
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as executor:
+            for future in [executor.submit(self._fetch, start, length) for start, length in missing]:
+                future.result()
+
+    def _read_cached(self, start: int, length: int) -> bytes:
+        """Đọc [start, start + length) từ đoạn đã tải chứa nó (các đoạn rời nhau nên chỉ có một đoạn)"""
+        end = start + length
+        with self._lock:
+            index = bisect.bisect_right(self._starts, start) - 1
+            if index >= 0:
+                chunk_start = self._starts[index]
+                chunk = self._chunks[chunk_start]
+                if chunk_start + len(chunk) >= end:
+                    return chunk[start - chunk_start:end - chunk_start]
+        raise IOError(f"Bytes {start}-{end} of {strip_url_query(self.url)} were not downloaded")
+
+    # --- file-like interface cho pa.PythonFile ---
+    def size(self) -> int:
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 0:
+            self._position = offset
+        elif whence == 1:
+            self._position += offset
+        else:
+            self._position = self._size + offset
+        return self._position
+
+    def read(self, nbytes: int = -1) -> bytes:
+        if nbytes is None or nbytes < 0:
+            nbytes = self._size - self._position
+        nbytes = max(min(nbytes, self._size - self._position), 0)
+        if nbytes == 0:
+            return b""
+        for start, length in self._missing(self._position, nbytes):
+            self._fetch(start, length)
+        data = self._read_cached(self._position, nbytes)
+        self._position += len(data)
+        return data
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def _row_group_matches(row_group: pq.RowGroupMetaData, filters: Dict[str, list]) -> bool:
+    """Row group có thể chứa giá trị cần lọc hay không (theo statistics min/max)"""
+    for col_index in range(row_group.num_columns):
+        column = row_group.column(col_index)
+        values = filters.get(column.path_in_schema)
+        if not values or column.statistics is None or not column.statistics.has_min_max:
+            continue
+        low, high = column.statistics.min, column.statistics.max
+        try:
+            if not any(low <= type(low)(value) <= high for value in values):
+                return False
+        except (TypeError, ValueError):
+            continue
+    return True
+
+def _column_chunk_range(column: pq.ColumnChunkMetaData) -> tuple:
+    start = column.data_page_offset
+    if column.has_dictionary_page and column.dictionary_page_offset and column.dictionary_page_offset < start:
+        start = column.dictionary_page_offset
+    return start, column.total_compressed_size
+
+def read_parquet_http(url: str, columns: Optional[list] = None, filters: Optional[Dict[str, list]] = None) -> pd.DataFrame:
+    """
+    Đọc parquet qua signed HTTP(S) URL bằng Range request thay vì tải cả file.
+
+    1. Tải phần cuối file (footer + metadata).
+    2. Chọn row group theo statistics của `filters` và column chunk theo `columns`.
+    3. Gộp các range gần nhau và tải song song, rồi decode bằng pyarrow.dataset (predicate như read_parquet_dataset).
+    :param filters: dict {column: list giá trị}, ví dụ {"CAL_YEAR": [2019, 2020]}
+    """
+    with HTTPRangeFile(url) as remote:
+        source = pa.PythonFile(remote, mode="r")
+        metadata = pq.ParquetFile(source).metadata
+        wanted = set(columns) if columns is not None else None
+
+        row_groups = []
+        ranges = []
+        for rg_index in range(metadata.num_row_groups):
+            row_group = metadata.row_group(rg_index)
+            if filters and not _row_group_matches(row_group, filters):
+                continue
+            row_groups.append(rg_index)
+            for col_index in range(row_group.num_columns):
+                column = row_group.column(col_index)
+                name = column.path_in_schema.split(".")[0]
+                if wanted is None or name in wanted or name in (filters or {}):
+                    ranges.append(_column_chunk_range(column))
+        remote.prefetch(ranges)
+
+        parquet_format = ds.ParquetFileFormat()
+        fragment = parquet_format.make_fragment(source, row_groups=row_groups)
+        dataset = ds.FileSystemDataset([fragment], schema=fragment.physical_schema, format=parquet_format)
+
+        expression = None
+        for column, values in (filters or {}).items():
+            column_filter = build_in_filter(dataset.schema, column, values)
+            if column_filter is not None:
+                expression = column_filter if expression is None else expression & column_filter
+
+        table = dataset.to_table(columns=columns, filter=expression)
+        logger.info(
+            f"HTTP range read {strip_url_query(url)}: {remote.bytes_fetched / max(remote.size(), 1):.0%} "
+            f"of {remote.size()} bytes in {remote.requests_count} requests, {len(row_groups)}/{metadata.num_row_groups} row groups"
+        )
+    return table.to_pandas()
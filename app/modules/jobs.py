@@ -0,0 +1,390 @@
+import os
+import json
+import time
+import socket
+import uuid
+import asyncio
+import inspect
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from config.log_config import logger
+from modules.storage import get_storage
+
+# Số job chạy đồng thời tối đa trong một process (mỗi job là một phân tích / báo cáo nặng)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# Số job đang chờ tối đa; vượt quá thì submit trả về 503 để client thử lại sau
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", 50))
+# Prefix trên storage chứa bản ghi job (JSON) và marker huỷ job
+JOB_STORAGE_PREFIX = os.getenv("JOB_STORAGE_PREFIX", "report-software/jobs")
+# Khoảng thời gian tối thiểu (giây) giữa hai lần ghi tiến độ lên storage
+JOB_PROGRESS_SAVE_INTERVAL = float(os.getenv("JOB_PROGRESS_SAVE_INTERVAL", 2))
+# Khoảng thời gian (giây) giữa hai lần kiểm tra marker huỷ trên storage (huỷ từ process / worker khác)
+JOB_CANCEL_POLL_INTERVAL = float(os.getenv("JOB_CANCEL_POLL_INTERVAL", 5))
+# Số job đã kết thúc giữ trong bộ nhớ (job cũ hơn vẫn đọc được từ storage)
+JOB_MEMORY_MAX_FINISHED = int(os.getenv("JOB_MEMORY_MAX_FINISHED", 500))
+# Chu kỳ (giây) process ghi heartbeat cho các job nó đang giữ; job chưa kết thúc mà heartbeat cũ hơn
+# JOB_STALE_SECONDS được coi là mất worker (process chết / bị restart) và chuyển sang failed
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", 30))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", 180))
+# Bản ghi job / marker huỷ cũ hơn JOB_RETENTION_SECONDS bị xoá; dọn dẹp chạy khi khởi động và mỗi JOB_CLEANUP_INTERVAL giây
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+JOB_CLEANUP_INTERVAL = float(os.getenv("JOB_CLEANUP_INTERVAL", 3600))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+_current_job: contextvars.ContextVar = contextvars.ContextVar("current_job", default=None)
+
+class JobCancelled(Exception):
+    """Raise tại checkpoint khi job đang chạy bị huỷ"""
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def _age_seconds(value) -> Optional[float]:
+    """Số giây từ thời điểm `value` (ISO string hoặc datetime) đến hiện tại; None nếu không đọc được"""
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value) if isinstance(value, str) else value
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - moment).total_seconds()
+
+class Job:
+    """Một job trong process: bản ghi (dict, ghi lên storage) + hàm cần chạy + cờ huỷ"""
+
+    def __init__(self, kind: str, func: Callable, args: tuple, kwargs: dict, store: "JobManager",
+                 dedupe_key: Optional[str] = None):
+        self.func = func
+        self.dedupe_key = dedupe_key
+        self.args = args
+        self.kwargs = kwargs
+        self.store = store
+        self.future = None
+        self.cancel_event = threading.Event()
+        self._record_lock = threading.Lock()
+        self._last_save = 0.0
+        self._last_cancel_poll = time.monotonic()
+        self.record = {
+            "job_id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": QUEUED,
+            "progress": 0.0,
+            "message": None,
+            "created_at": _now(),
+            "owner": store.owner,
+            "heartbeat_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "result": None,
+        }
+
+    @property
+    def job_id(self) -> str:
+        return self.record["job_id"]
+
+    @property
+    def status(self) -> str:
+        return self.record["status"]
+
+    def update(self, save: bool = True, **fields):
+        # Khoá để heartbeat (thread khác) không ghi bản ghi cũ đè lên trạng thái mới
+        with self._record_lock:
+            self.record.update(fields)
+            if save:
+                self._last_save = time.monotonic()
+                self.store.save(self.record)
+
+    def heartbeat(self):
+        with self._record_lock:
+            if self.record["status"] in FINISHED_STATUSES:
+                return
+            self.record["heartbeat_at"] = _now()
+            self._last_save = time.monotonic()
+            self.store.save(self.record)
+
+    def check_cancelled(self):
+        """Raise JobCancelled nếu job bị huỷ (trong process này hoặc qua marker trên storage)"""
+        if not self.cancel_event.is_set() and time.monotonic() - self._last_cancel_poll >= JOB_CANCEL_POLL_INTERVAL:
+            self._last_cancel_poll = time.monotonic()
+            if self.store.cancel_requested(self.job_id):
+                self.cancel_event.set()
+        if self.cancel_event.is_set():
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+    def progress(self, fraction: float, message: Optional[str] = None):
+        fraction = min(max(float(fraction), 0.0), 1.0)
+        save = time.monotonic() - self._last_save >= JOB_PROGRESS_SAVE_INTERVAL
+        self.update(save=save, progress=round(fraction, 4), message=message or self.record["message"])
+
+def job_checkpoint():
+    """
+    Điểm kiểm tra huỷ trong tính toán dài (vòng lặp theo combination, giữa các bước báo cáo).
+    Không làm gì nếu code không chạy trong job.
+    """
+    job = _current_job.get()
+    if job is not None:
+        job.check_cancelled()
+
+def job_progress(done: float, total: float = 1.0, message: Optional[str] = None):
+    """Báo tiến độ done / total của job đang chạy (kèm kiểm tra huỷ); không làm gì nếu không chạy trong job"""
+    job = _current_job.get()
+    if job is None:
+        return
+    job.check_cancelled()
+    job.progress(done / total if total else 1.0, message)
+
+class JobManager:
+    """
+    Chạy các tính toán dài (GLM 1WA..4WA, báo cáo MOF) dưới dạng job, ngoài vòng đời của HTTP request.
+
+    - submit() trả về bản ghi job (job_id) ngay; job chạy trên thread pool giới hạn JOB_WORKERS,
+      hàng đợi tối đa JOB_MAX_PENDING job (đầy thì 503)
+    - bản ghi job (trạng thái, tiến độ, lỗi, kết quả JSON) được ghi lên storage `<prefix>/<job_id>.json`
+      nên đọc được từ mọi worker / sau khi restart
+    - huỷ job: job đang chờ bị bỏ khỏi hàng đợi; job đang chạy dừng ở checkpoint tiếp theo (job_checkpoint /
+      job_progress); huỷ từ process khác qua marker `<prefix>/<job_id>.cancel`
+    - hàm của job có thể là hàm thường hoặc coroutine function (chạy bằng event loop riêng trong thread của job)
+    - bản ghi có `owner` (process giữ job) và `heartbeat_at` cập nhật mỗi JOB_HEARTBEAT_INTERVAL giây; job chưa kết thúc
+      mà heartbeat quá JOB_STALE_SECONDS (process đã chết) được chuyển sang failed khi đọc trạng thái hoặc khi dọn dẹp
+    - dọn dẹp (khi khởi động và định kỳ): xoá bản ghi / marker huỷ cũ hơn JOB_RETENTION_SECONDS
+    """
+
+    def __init__(self, max_workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING,
+                 prefix: str = JOB_STORAGE_PREFIX):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.prefix = prefix.rstrip("/")
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._maintenance = None
+
+    def _record_key(self, job_id: str) -> str:
+        return f"{self.prefix}/{job_id}.json"
+
+    def _cancel_key(self, job_id: str) -> str:
+        return f"{self.prefix}/{job_id}.cancel"
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job-worker")
+        return self._executor
+
+    def save(self, record: dict):
+        """Ghi bản ghi job lên storage; lỗi ghi chỉ được log, không làm hỏng job"""
+        try:
+            payload = json.dumps(jsonable_encoder(record), ensure_ascii=False).encode("utf-8")
+            get_storage().put(self._record_key(record["job_id"]), payload, content_type="application/json")
+        except Exception as e:
+            logger.warning(f"Could not save job record {record['job_id']}: {e}")
+
+    def _load(self, job_id: str) -> Optional[dict]:
+        if not job_id or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        try:
+            return json.loads(get_storage().get(self._record_key(job_id)))
+        except FileNotFoundError:
+            return None
+
+    def cancel_requested(self, job_id: str) -> bool:
+        try:
+            get_storage().head(self._cancel_key(job_id))
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"Could not check cancel marker of job {job_id}: {e}")
+            return False
+
+    def submit(self, kind: str, func: Callable, *args, dedupe_key: Optional[str] = None, **kwargs) -> dict:
+        """
+        Đưa `func(*args, **kwargs)` vào hàng đợi, trả về bản ghi job.
+        Có `dedupe_key` (modules.single_flight.request_key) thì job giống hệt đang chờ / đang chạy được dùng lại.
+        """
+        with self._lock:
+            if dedupe_key is not None:
+                for job in self._jobs.values():
+                    if job.dedupe_key == dedupe_key and job.status not in FINISHED_STATUSES \
+                            and not job.cancel_event.is_set():
+                        logger.info(f"Job {job.job_id} ({kind}) reused for an identical request")
+                        return dict(job.record)
+            pending = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            if pending >= self.max_pending:
+                raise HTTPException(
+                    status_code=503, detail="Job queue is full, please retry later", headers={"Retry-After": "30"}
+                )
+            job = Job(kind, func, args, kwargs, self, dedupe_key=dedupe_key)
+            self._jobs[job.job_id] = job
+            self._prune_locked()
+        self.start()
+        self.save(job.record)
+        job.future = self._get_executor().submit(self._run, job)
+        logger.info(f"Job {job.job_id} ({kind}) queued")
+        return dict(job.record)
+
+    def _prune_locked(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATUSES]
+        for job_id in finished[:max(len(finished) - JOB_MEMORY_MAX_FINISHED, 0)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: Job):
+        if job.cancel_event.is_set():
+            return
+        token = _current_job.set(job)
+        job.update(status=RUNNING, started_at=_now())
+        try:
+            result = job.func(*job.args, **job.kwargs)
+            if inspect.iscoroutine(result):
+                result = asyncio.run(result)
+            job.update(status=SUCCEEDED, progress=1.0, finished_at=_now(), result=jsonable_encoder(result))
+        except BaseException as e:
+            if job.cancel_event.is_set() or isinstance(e, JobCancelled):
+                job.update(status=CANCELLED, finished_at=_now(), message="Cancelled")
+            elif isinstance(e, HTTPException):
+                job.update(status=FAILED, finished_at=_now(), error={"status_code": e.status_code, "detail": e.detail})
+            else:
+                logger.exception(f"Job {job.job_id} failed")
+                job.update(status=FAILED, finished_at=_now(), error={"status_code": 500, "detail": str(e)})
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            _current_job.reset(token)
+            self._delete_quietly(self._cancel_key(job.job_id))
+            logger.info(f"Job {job.job_id} ({job.record['kind']}) {job.status}")
+
+    def _delete_quietly(self, key: str):
+        try:
+            get_storage().delete(key)
+        except Exception as e:
+            logger.warning(f"Could not delete job object {key}: {e}")
+
+    def _is_stale(self, record: dict) -> bool:
+        """Job chưa kết thúc nhưng không còn process nào giữ: không chạy trong process này và heartbeat quá hạn"""
+        if record["status"] in FINISHED_STATUSES or record["job_id"] in self._jobs:
+            return False
+        age = _age_seconds(record.get("heartbeat_at") or record.get("created_at"))
+        return age is not None and age > JOB_STALE_SECONDS
+
+    def _fail_stale(self, record: dict) -> dict:
+        logger.warning(f"Job {record['job_id']} lost its worker {record.get('owner')}, marking it failed")
+        record.update(
+            status=FAILED, finished_at=_now(),
+            error={"status_code": 500, "detail": "Job worker stopped before the job finished, please resubmit"},
+        )
+        self.save(record)
+        self._delete_quietly(self._cancel_key(record["job_id"]))
+        return record
+
+    def start(self):
+        """Chạy thread nền ghi heartbeat cho các job của process và dọn dẹp định kỳ (gọi khi app khởi động)"""
+        if self._maintenance is not None:
+            return
+        with self._lock:
+            if self._maintenance is None:
+                self._maintenance = threading.Thread(target=self._maintenance_loop, name="job-maintenance", daemon=True)
+                self._maintenance.start()
+
+    def _maintenance_loop(self):
+        next_cleanup = 0.0
+        while True:
+            if time.monotonic() >= next_cleanup:
+                next_cleanup = time.monotonic() + JOB_CLEANUP_INTERVAL
+                try:
+                    self.cleanup()
+                except Exception as e:
+                    logger.warning(f"Job cleanup failed: {e}")
+            with self._lock:
+                active = [job for job in self._jobs.values() if job.status not in FINISHED_STATUSES]
+            for job in active:
+                job.heartbeat()
+            time.sleep(JOB_HEARTBEAT_INTERVAL)
+
+    def cleanup(self) -> dict:
+        """
+        Chuyển job mất worker sang failed và xoá bản ghi / marker huỷ quá hạn lưu giữ.
+        Bản ghi của job còn sống được ghi lại theo heartbeat nên chỉ cần đọc các object lâu không đổi.
+        """
+        storage = get_storage()
+        removed, failed = 0, 0
+        for item in storage.list(self.prefix + "/"):
+            age = _age_seconds(item.get("last_modified"))
+            if age is None or age <= JOB_STALE_SECONDS:
+                continue
+            key = item["key"]
+            if age > JOB_RETENTION_SECONDS:
+                self._delete_quietly(key)
+                removed += 1
+                continue
+            if not key.endswith(".json"):
+                continue
+            try:
+                record = json.loads(storage.get(key))
+            except FileNotFoundError:
+                continue
+            if self._is_stale(record):
+                self._fail_stale(record)
+                failed += 1
+        if removed or failed:
+            logger.info(f"Job cleanup: {failed} lost jobs marked failed, {removed} expired objects removed")
+        return {"failed": failed, "removed": removed}
+
+    def get(self, job_id: str) -> dict:
+        """Bản ghi job (trong process này hoặc trên storage); 404 nếu không có"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return dict(job.record)
+        record = self._load(job_id)
+        if record is None:
+            raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+        if self._is_stale(record):
+            record = self._fail_stale(record)
+        return record
+
+    def result(self, job_id: str) -> Any:
+        """
+        Kết quả của job đã chạy xong, giống response của endpoint đồng bộ tương ứng.
+        Job lỗi → raise lại lỗi HTTP của job; chưa xong / đã huỷ → 409.
+        """
+        record = self.get(job_id)
+        if record["status"] == SUCCEEDED:
+            return record["result"]
+        if record["status"] == FAILED:
+            error = record.get("error") or {}
+            raise HTTPException(status_code=error.get("status_code", 500), detail=error.get("detail"))
+        if record["status"] == CANCELLED:
+            raise HTTPException(status_code=409, detail=f"Job '{job_id}' was cancelled")
+        raise HTTPException(status_code=409, detail=f"Job '{job_id}' is {record['status']}, result not available yet")
+
+    def cancel(self, job_id: str) -> dict:
+        """Huỷ job đang chờ / đang chạy; job đã kết thúc → 409"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            record = self.get(job_id)
+            if record["status"] in FINISHED_STATUSES:
+                raise HTTPException(status_code=409, detail=f"Job '{job_id}' already {record['status']}")
+            # Job của process / worker khác: để lại marker, worker đang chạy job sẽ dừng ở checkpoint
+            get_storage().put(self._cancel_key(job_id), b"", content_type="application/octet-stream")
+            return record
+
+        if job.status in FINISHED_STATUSES:
+            raise HTTPException(status_code=409, detail=f"Job '{job_id}' already {job.status}")
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            job.update(status=CANCELLED, finished_at=_now(), message="Cancelled")
+        return dict(job.record)
+
+job_manager = JobManager()
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from typing import Optional
+from config.log_config import logger
+from modules.s3_client import get_s3_client, cfg
+
+PARQUET_CACHE_ENABLED = os.getenv("PARQUET_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+PARQUET_CACHE_DIR = os.getenv(
+    "PARQUET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "mcp_export_parquet_cache")
+)
+PARQUET_CACHE_MAX_BYTES = int(os.getenv("PARQUET_CACHE_MAX_BYTES", 20 * 1024 ** 3))
+# Entry vừa được dùng trong khoảng này sẽ không bị evict (tránh xoá file reader sắp mở)
+PARQUET_CACHE_EVICT_GRACE_SECONDS = int(os.getenv("PARQUET_CACHE_EVICT_GRACE_SECONDS", 60))
+# Số lock file dùng chung (lock striping) để không sinh một lock file cho mỗi key
+_LOCK_STRIPES = 256
+_DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+class LocalParquetCache:
+    """
+    Read-through cache trên ổ đĩa local cho các object parquet trên S3.
+
+    - Mỗi lần đọc chỉ tốn một HEAD request để so ETag; object chỉ được tải lại khi ETag thay đổi.
+    - An toàn giữa nhiều uvicorn worker: mỗi entry được bảo vệ bởi file lock (flock),
+      file được tải vào file tạm rồi os.replace() nên reader không bao giờ thấy file dở dang.
+    - Tổng dung lượng bị giới hạn bởi `max_bytes`, vượt quá thì xoá entry ít dùng nhất (LRU theo mtime của metadata).
+    """
+
+    def __init__(self, cache_dir: str = PARQUET_CACHE_DIR, max_bytes: int = PARQUET_CACHE_MAX_BYTES,
+                 evict_grace_seconds: int = PARQUET_CACHE_EVICT_GRACE_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.evict_grace_seconds = evict_grace_seconds
+
+    def _ensure_dirs(self):
+        os.makedirs(os.path.join(self.cache_dir, "locks"), exist_ok=True)
+
+    def _entry_paths(self, bucket: str, key: str) -> tuple[str, str, str]:
+        digest = hashlib.sha256(f"{bucket}/{key}".encode("utf-8")).hexdigest()
+        data_path = os.path.join(self.cache_dir, f"{digest}.parquet")
+        meta_path = os.path.join(self.cache_dir, f"{digest}.json")
+        lock_path = os.path.join(self.cache_dir, "locks", f"{int(digest[:4], 16) % _LOCK_STRIPES:03d}.lock")
+        return data_path, meta_path, lock_path
+
+    @contextmanager
+    def _file_lock(self, lock_path: str, blocking: bool = True):
+        with open(lock_path, "a") as lock_file:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file.fileno(), flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_meta(meta_path: str) -> Optional[dict]:
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_meta(self, meta_path: str, meta: dict):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".json.tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def get_path(self, key: str, bucket: Optional[str] = None) -> str:
+        """
+        Trả về đường dẫn local của object S3, tải về nếu chưa có trong cache hoặc ETag đã thay đổi.
+        :param key: Key của file trên S3 bucket
+        """
+        bucket = bucket or cfg["BUCKET"]
+        self._ensure_dirs()
+        data_path, meta_path, lock_path = self._entry_paths(bucket, key)
+
+        s3 = get_s3_client()
+        etag = s3.head_object(Bucket=bucket, Key=key)["ETag"]
+
+        with self._file_lock(lock_path):
+            meta = self._read_meta(meta_path)
+            if meta and meta.get("etag") == etag and os.path.exists(data_path):
+                # Cập nhật mtime để làm thứ tự LRU
+                os.utime(meta_path, None)
+                return data_path
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".parquet.tmp")
+            try:
+                # IfMatch đảm bảo nội dung tải về đúng với ETag vừa HEAD
+                response = s3.get_object(Bucket=bucket, Key=key, IfMatch=etag)
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in response["Body"].iter_chunks(chunk_size=_DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                os.replace(tmp_path, data_path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            self._write_meta(meta_path, {
+                "bucket": bucket,
+                "key": key,
+                "etag": etag,
+                "size": os.path.getsize(data_path),
+                "cached_at": time.time(),
+            })
+            logger.info(f"Cached s3://{bucket}/{key} ({os.path.getsize(data_path) / 1024 / 1024:.2f} MB)")
+
+        self.evict()
+        return data_path
+
+    def invalidate(self, key: str, bucket: Optional[str] = None):
+        """Xoá entry của một key khỏi cache (ví dụ sau khi ghi đè object)"""
+        bucket = bucket or cfg["BUCKET"]
+        self._ensure_dirs()
+        data_path, meta_path, lock_path = self._entry_paths(bucket, key)
+        with self._file_lock(lock_path):
+            for path in (meta_path, data_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def evict(self):
+        """Xoá các entry ít được dùng nhất cho đến khi tổng dung lượng <= max_bytes"""
+        evict_lock = os.path.join(self.cache_dir, "locks", "evict.lock")
+        with self._file_lock(evict_lock, blocking=False) as acquired:
+            if not acquired:
+                # Worker khác đang evict
+                return
+
+            entries = []
+            total_bytes = 0
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".json"):
+                    continue
+                meta_path = os.path.join(self.cache_dir, name)
+                data_path = meta_path[: -len(".json")] + ".parquet"
+                try:
+                    last_used = os.path.getmtime(meta_path)
+                    size = os.path.getsize(data_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((last_used, meta_path, data_path, size))
+                total_bytes += size
+
+            if total_bytes <= self.max_bytes:
+                return
+
+            now = time.time()
+            for last_used, meta_path, data_path, size in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                if now - last_used < self.evict_grace_seconds:
+                    continue
+                meta = self._read_meta(meta_path)
+                if meta is None:
+                    continue
+                _, _, lock_path = self._entry_paths(meta["bucket"], meta["key"])
+                with self._file_lock(lock_path, blocking=False) as entry_locked:
+                    if not entry_locked:
+                        continue
+                    for path in (meta_path, data_path):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    total_bytes -= size
+                    logger.info(f"Evicted s3://{meta['bucket']}/{meta['key']} from parquet cache")
+
+parquet_cache = LocalParquetCache()
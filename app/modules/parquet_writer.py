@@ -0,0 +1,244 @@
+from typing import Optional
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Các profile ghi parquet dùng chung cho mọi nơi lưu file.
+# row_group_size được tách ra khi ghi, các key còn lại truyền thẳng cho pq.ParquetWriter.
+PARQUET_WRITE_PROFILES = {
+    # File import lớn, được đọc lại nhiều lần với chọn cột / lọc năm:
+    # zstd nén tốt hơn snappy mà vẫn giải nén nhanh, page index giúp bỏ qua page trong row group
+    "bulk_import": {
+        "row_group_size": 128_000,
+        "compression": "zstd",
+        "compression_level": 3,
+        "use_dictionary": True,
+        "dictionary_pagesize_limit": 2 * 1024 * 1024,
+        "data_page_size": 1024 * 1024,
+        "write_statistics": True,
+        "write_page_index": True,
+        "use_deprecated_int96_timestamps": False,
+        "coerce_timestamps": "ms",
+        "store_schema": True,
+    },
+    # Bảng kết quả phân tích GLM (1WA..4WA): vừa phải, ưu tiên ghi nhanh (báo cáo MOF dùng small_report)
+    "analysis_result": {
+        "row_group_size": 50_000,
+        "compression": "snappy",
+        "use_dictionary": True,
+        "data_page_size": 1024 * 1024,
+        "write_statistics": True,
+        "write_page_index": False,
+        "store_schema": True,
+    },
+    # Báo cáo nhỏ (vài trăm / vài nghìn dòng): một row group, không cần statistics
+    "small_report": {
+        "row_group_size": 1_000_000,
+        "compression": "snappy",
+        "use_dictionary": True,
+        "write_statistics": False,
+        "write_page_index": False,
+        "store_schema": True,
+    },
+}
+DEFAULT_WRITE_PROFILE = "analysis_result"
+
+def get_write_profile(profile: Optional[str] = None) -> dict:
+    """Trả về bản sao cấu hình của profile (mặc định DEFAULT_WRITE_PROFILE)"""
+    profile = profile or DEFAULT_WRITE_PROFILE
+    if profile not in PARQUET_WRITE_PROFILES:
+        raise ValueError(
+            f"Unknown parquet write profile '{profile}'. Available: {', '.join(PARQUET_WRITE_PROFILES)}"
+        )
+    return dict(PARQUET_WRITE_PROFILES[profile])
+
+def partition_slices(values: pd.Series, row_group_size: int) -> tuple[np.ndarray, list]:
+    """
+    Sắp xếp theo giá trị phân vùng và chia thành các lát (start, length) sao cho
+    mỗi lát chỉ chứa một giá trị (cột datetime được tính theo năm) và không vượt quá `row_group_size`.
+    :return: (thứ tự dòng sau khi sắp xếp ổn định, danh sách lát)
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        values = values.dt.year
+    # factorize(sort=True): NaN nhận code -1, được đưa về cuối
+    codes, _ = pd.factorize(values, sort=True)
+    codes = np.where(codes < 0, np.iinfo(codes.dtype).max, codes)
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+
+    bounds = np.flatnonzero(sorted_codes[1:] != sorted_codes[:-1]) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(sorted_codes)]))
+    slices = [
+        (chunk_start, min(row_group_size, end - chunk_start))
+        for start, end in zip(starts, ends)
+        for chunk_start in range(start, end, row_group_size)
+    ]
+    return order, slices
+
+def write_parquet(data, sink, profile: Optional[str] = None, row_group_size: Optional[int] = None,
+                  partition_by: Optional[str] = None, schema_metadata: Optional[dict] = None, **write_options):
+    """
+    Ghi DataFrame (hoặc pyarrow.Table) thành parquet vào `sink` (file-like / pyarrow stream) theo từng row group.
+
+    DataFrame được convert sang Arrow theo từng lát `row_group_size` dòng, nên bộ nhớ
+    phát sinh chỉ khoảng một row group thay vì cả bảng.
+    :param profile: Tên profile trong PARQUET_WRITE_PROFILES ("bulk_import", "analysis_result", "small_report")
+    :param partition_by: Cột phân vùng (ví dụ CAL_YEAR). Dữ liệu được sắp xếp theo cột này và mỗi row group
+        chỉ chứa một giá trị (một năm), nhờ statistics min/max mà reader lọc theo năm bỏ qua được các row group khác.
+    :param schema_metadata: key/value (str) thêm vào metadata của schema, ví dụ thiết lập bin của cột đã phân nhóm
+    :param write_options: ghi đè các tham số của profile (compression, use_dictionary, ...)
+    :return: pyarrow.parquet.FileMetaData của file vừa ghi (số dòng, row group, statistics từng cột)
+    """
+    options = {**get_write_profile(profile), **write_options}
+    profile_row_group_size = options.pop("row_group_size")
+    row_group_size = row_group_size or profile_row_group_size
+
+    if isinstance(data, pa.Table):
+        schema = data.schema
+        num_rows = data.num_rows
+    else:
+        schema = pa.Schema.from_pandas(data, preserve_index=False)
+        num_rows = len(data)
+
+    # Thứ tự dòng sau khi sắp theo cột phân vùng; không tạo bản sao đã sắp của cả bảng,
+    # mỗi row group chỉ take() đúng các dòng của nó
+    order = None
+    if partition_by and num_rows > 0:
+        values = data.column(partition_by).to_pandas() if isinstance(data, pa.Table) else data[partition_by]
+        order, slices = partition_slices(values, row_group_size)
+        # Ghi lại cột phân vùng vào metadata để reader biết layout của file
+        schema = schema.with_metadata({**(schema.metadata or {}), b"partition_by": partition_by.encode("utf-8")})
+    else:
+        slices = [(start, row_group_size) for start in range(0, max(num_rows, 1), row_group_size)]
+    if schema_metadata:
+        schema = schema.with_metadata({
+            **(schema.metadata or {}),
+            **{str(k).encode("utf-8"): str(v).encode("utf-8") for k, v in schema_metadata.items()},
+        })
+
+    def get_slice(start: int, length: int) -> pa.Table:
+        if isinstance(data, pa.Table):
+            return data.slice(start, length) if order is None else data.take(order[start:start + length])
+        part = data.iloc[start:start + length] if order is None else data.take(order[start:start + length])
+        return pa.Table.from_pandas(part, schema=schema, preserve_index=False)
+
+    with pq.ParquetWriter(sink, schema, **options) as writer:
+        for start, length in slices:
+            writer.write_table(get_slice(start, length), row_group_size=row_group_size)
+    return writer.writer.metadata
+
+def _stream_schema(schema: pa.Schema) -> pa.Schema:
+    """Schema cố định của file stream: nới số nguyên về int64 và float về float64 để các block sau cast được"""
+    fields = []
+    for field in schema:
+        if pa.types.is_integer(field.type) and field.type != pa.uint64():
+            field = field.with_type(pa.int64())
+        elif pa.types.is_floating(field.type):
+            field = field.with_type(pa.float64())
+        fields.append(field)
+    return pa.schema(fields, metadata=schema.metadata)
+
+class ParquetStreamWriter:
+    """
+    Ghi parquet kiểu append vào `sink`: nhận từng block (DataFrame / pyarrow.Table) và ghi thành row group
+    mỗi khi gom đủ `row_group_size` dòng, nên bộ nhớ chỉ khoảng một row group và mỗi dòng chỉ được copy
+    một số lần cố định (thay vì pd.concat bảng kết quả đang lớn dần sau mỗi block).
+
+    Schema của file lấy từ row group đầu tiên (số nguyên → int64, float → float64); các row group sau được cast (safe)
+    về schema này, cast làm mất dữ liệu thì raise pa.ArrowInvalid.
+    Không có block nào thì close() ghi file rỗng, giống ghi pd.DataFrame() rỗng.
+
+    Ví dụ:
+        with ParquetStreamWriter(sink, profile="analysis_result") as writer:
+            for df_block in blocks:
+                writer.append(df_block)
+        metadata = writer.metadata
+    """
+
+    def __init__(self, sink, profile: Optional[str] = None, row_group_size: Optional[int] = None, **write_options):
+        options = {**get_write_profile(profile), **write_options}
+        profile_row_group_size = options.pop("row_group_size")
+        self.row_group_size = row_group_size or profile_row_group_size
+        self.sink = sink
+        self.schema = None
+        self.metadata = None
+        self.num_rows = 0
+        self._options = options
+        self._writer = None
+        self._pending = []
+        self._pending_rows = 0
+
+    def append(self, data):
+        """Thêm một block; index của DataFrame bị bỏ như write_parquet"""
+        if len(data) == 0:
+            return
+        self._pending.append(data)
+        self._pending_rows += len(data)
+        self.num_rows += len(data)
+        if self._pending_rows >= self.row_group_size:
+            self._flush(final=False)
+
+    def _pending_table(self) -> pa.Table:
+        # Các DataFrame liền nhau được pd.concat rồi convert một lần: convert từng block nhỏ sang Arrow
+        # tốn chi phí cố định (metadata, từng cột) lớn hơn nhiều so với copy dữ liệu
+        tables, frames = [], []
+        for data in self._pending + [None]:
+            if isinstance(data, pd.DataFrame):
+                frames.append(data)
+                continue
+            if frames:
+                tables.append(pa.Table.from_pandas(pd.concat(frames, axis=0), preserve_index=False))
+                frames = []
+            if data is not None:
+                tables.append(data)
+        return pa.concat_tables(tables, promote_options="permissive") if len(tables) > 1 else tables[0]
+
+    def _flush(self, final: bool):
+        table = self._pending_table()
+        if self.schema is None:
+            self.schema = _stream_schema(table.schema)
+            self._writer = pq.ParquetWriter(self.sink, self.schema, **self._options)
+        table = table.cast(self.schema)
+
+        # Ghi các row group đủ dòng, phần lẻ giữ lại cho block sau (trừ lần cuối)
+        full_rows = table.num_rows if final else table.num_rows - table.num_rows % self.row_group_size
+        if full_rows:
+            self._writer.write_table(table.slice(0, full_rows), row_group_size=self.row_group_size)
+        rest = table.slice(full_rows)
+        self._pending = [rest] if rest.num_rows else []
+        self._pending_rows = rest.num_rows
+
+    def close(self) -> pq.FileMetaData:
+        """Ghi phần còn lại và footer, trả về FileMetaData (giống write_parquet)"""
+        if self.metadata is not None:
+            return self.metadata
+        if self._pending:
+            self._flush(final=True)
+        if self._writer is None:
+            self.schema = pa.schema([])
+            self._writer = pq.ParquetWriter(self.sink, self.schema, **self._options)
+        self._writer.close()
+        self.metadata = self._writer.writer.metadata
+        return self.metadata
+
+    def abort(self):
+        """Bỏ các block chưa ghi và đóng writer đang mở (caller tự huỷ `sink`)"""
+        self._pending = []
+        self._pending_rows = 0
+        if self._writer is not None and self.metadata is None:
+            try:
+                self._writer.close()
+            except Exception:
+                pass
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,82 @@
+import os
+import threading
+from urllib.parse import urlparse
+import boto3
+from botocore.config import Config
+from pyarrow import fs as pafs
+from config.constants import S3
+
+cfg = S3
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+_filesystem = None
+_filesystem_pid = None
+_filesystem_lock = threading.Lock()
+
+def _build_client_config() -> Config:
+    """Cấu hình botocore cho client dùng chung: connection pool, keep-alive, adaptive retries"""
+    return Config(
+        s3={"addressing_style": "path"},
+        max_pool_connections=int(cfg.get("MAX_POOL_CONNECTIONS", 50)),
+        tcp_keepalive=True,
+        connect_timeout=int(cfg.get("CONNECT_TIMEOUT", 10)),
+        read_timeout=int(cfg.get("READ_TIMEOUT", 120)),
+        retries={
+            "mode": "adaptive",
+            "max_attempts": int(cfg.get("MAX_ATTEMPTS", 5)),
+        },
+    )
+
+def get_s3_client():
+    """
+    Trả về boto3 S3 client dùng chung cho toàn bộ process.
+
+    Client được tạo một lần (lazy) và tái sử dụng connection pool giữa các request.
+    boto3 client là thread-safe, nhưng việc tạo client thì không, nên khởi tạo được
+    bảo vệ bằng lock. Nếu process bị fork (uvicorn workers), client được tạo lại
+    để không chia sẻ socket với process cha.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                session = boto3.session.Session()
+                _client = session.client(
+                    "s3",
+                    region_name=cfg["REGION"],
+                    endpoint_url=cfg["ENDPOINT"],
+                    aws_access_key_id=cfg["ACCESS_KEY"],
+                    aws_secret_access_key=cfg["SECRET_KEY"],
+                    config=_build_client_config(),
+                )
+                _client_pid = pid
+    return _client
+
+def get_s3_filesystem() -> pafs.S3FileSystem:
+    """
+    Trả về pyarrow S3FileSystem dùng chung, cùng cấu hình với get_s3_client().
+
+    Dùng cho pyarrow.dataset để đọc parquet có chọn cột / lọc row group
+    (range request) thay vì tải toàn bộ object về.
+    """
+    global _filesystem, _filesystem_pid
+    pid = os.getpid()
+    if _filesystem is None or _filesystem_pid != pid:
+        with _filesystem_lock:
+            if _filesystem is None or _filesystem_pid != pid:
+                endpoint = urlparse(cfg["ENDPOINT"])
+                _filesystem = pafs.S3FileSystem(
+                    access_key=cfg["ACCESS_KEY"],
+                    secret_key=cfg["SECRET_KEY"],
+                    region=cfg["REGION"],
+                    endpoint_override=endpoint.netloc or cfg["ENDPOINT"],
+                    scheme=endpoint.scheme or "https",
+                    connect_timeout=int(cfg.get("CONNECT_TIMEOUT", 10)),
+                    request_timeout=int(cfg.get("READ_TIMEOUT", 120)),
+                )
+                _filesystem_pid = pid
+    return _filesystem
@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+import threading
+import concurrent.futures
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+from fastapi import HTTPException
+from config.log_config import logger
+from modules.table_cache import make_cache_key
+from modules.db_parquet import is_storage_url, extract_parquet_key
+
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+# Thời gian (giây) giữ kết quả vừa tính xong: request giống hệt trong khoảng này (UI retry...) nhận lại kết quả đó
+SINGLE_FLIGHT_RESULT_TTL = float(os.getenv("SINGLE_FLIGHT_RESULT_TTL", 30))
+SINGLE_FLIGHT_MAX_RESULTS = int(os.getenv("SINGLE_FLIGHT_MAX_RESULTS", 128))
+
+# Tham số query chỉ là chữ ký / hạn của presigned URL (S3, GCS, CloudFront), không xác định file
+_SIGNATURE_PARAM_PREFIXES = ("x-amz-", "x-goog-")
+_SIGNATURE_PARAMS = {"signature", "expires", "awsaccesskeyid", "key-pair-id", "policy"}
+
+def canonical_url(url: str) -> str:
+    """
+    URL nguồn dạng không phụ thuộc lần ký: file trong bucket của hệ thống → S3 key (như GLMAnalysis._data_source),
+    URL ngoài → bỏ các tham số chữ ký, giữ các tham số khác (có thể xác định file)
+    """
+    if is_storage_url(url):
+        return "storage:" + extract_parquet_key(url)
+    parsed = urlparse(url)
+    query = [(name, value) for name, value in parse_qsl(parsed.query, keep_blank_values=True)
+             if not name.lower().startswith(_SIGNATURE_PARAM_PREFIXES) and name.lower() not in _SIGNATURE_PARAMS]
+    return urlunparse(parsed._replace(query=urlencode(query), fragment=""))
+
+def _canonical_payload(value):
+    if isinstance(value, dict):
+        return {key: _canonical_payload(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_canonical_payload(item) for item in value]
+    if isinstance(value, str) and urlparse(value).scheme in ("http", "https", "s3"):
+        return canonical_url(value)
+    return value
+
+def request_key(name: str, request_body) -> str:
+    """
+    Key canonical của request: tên endpoint + body (pydantic model hoặc dict) dạng JSON sắp xếp key.
+    URL trong body (tableName / parquet_url là signed URL) được chuẩn hoá bằng canonical_url, để cùng file
+    ký lại (UI retry, người dùng khác) vẫn gộp được với request đang chạy.
+    """
+    payload = request_body.model_dump(mode="json") if hasattr(request_body, "model_dump") else request_body
+    return make_cache_key(name, _canonical_payload(payload))
+
+class SingleFlight:
+    """
+    Gộp các request giống hệt nhau đang chạy đồng thời (cùng key): chỉ request đầu tiên tính toán,
+    các request sau chờ và nhận cùng kết quả (hoặc cùng lỗi). Kết quả thành công được giữ thêm `ttl` giây.
+
+    Kết quả dùng chung là concurrent.futures.Future nên chờ được từ mọi event loop (kể cả loop riêng của job).
+    """
+
+    def __init__(self, ttl: float = SINGLE_FLIGHT_RESULT_TTL, max_results: int = SINGLE_FLIGHT_MAX_RESULTS,
+                 enabled: bool = SINGLE_FLIGHT_ENABLED):
+        self.ttl = ttl
+        self.max_results = max_results
+        self.enabled = enabled
+        self._inflight = {}
+        self._results: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key: str):
+        item = self._results.get(key)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del self._results[key]
+            return None
+        return item
+
+    async def run(self, key: str, func: Callable, *args, **kwargs) -> Any:
+        """Kết quả của `await func(*args, **kwargs)`, dùng chung với các lần gọi cùng key đang chạy / vừa xong"""
+        if not self.enabled:
+            return await func(*args, **kwargs)
+
+        with self._lock:
+            cached = self._cached(key)
+            if cached is not None:
+                return cached[1]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._inflight[key] = future
+
+        if not leader:
+            logger.info(f"Coalesced duplicate request {key[:12]} with the in-flight computation")
+            # shield: request chờ bị huỷ không làm huỷ kết quả dùng chung
+            return await asyncio.shield(asyncio.wrap_future(future))
+
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            self._finish(key, future, exception=HTTPException(
+                status_code=503, detail="Identical request was cancelled, please retry"
+            ))
+            raise
+        except Exception as e:
+            self._finish(key, future, exception=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    def _finish(self, key: str, future: concurrent.futures.Future, result=None, exception: Optional[BaseException] = None):
+        with self._lock:
+            self._inflight.pop(key, None)
+            if exception is None and self.ttl > 0:
+                self._results[key] = (time.monotonic() + self.ttl, result)
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_results:
+                    self._results.popitem(last=False)
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+
+    def invalidate(self, key: Optional[str] = None):
+        """Xoá kết quả đã giữ của một key (hoặc tất cả nếu key=None), ví dụ sau khi import lại dữ liệu"""
+        with self._lock:
+            if key is None:
+                self._results.clear()
+            else:
+                self._results.pop(key, None)
+
+request_flights = SingleFlight()
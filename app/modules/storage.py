@@ -0,0 +1,473 @@
+import io
+import os
+import hashlib
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Optional
+import pyarrow as pa
+from botocore.exceptions import ClientError
+from config.log_config import logger
+from modules.s3_client import get_s3_client, get_s3_filesystem, cfg
+from modules.parquet_cache import parquet_cache, PARQUET_CACHE_ENABLED
+from utils.executors import OperationCancelled, io_cancel_event, raise_if_cancelled
+
+# Backend lưu trữ: "s3" (mặc định), "local" (ổ đĩa local / NVMe) hoặc "memory" (benchmark, chạy thử không cần S3).
+# Đọc từ config.constants (S3["STORAGE_BACKEND"], S3["STORAGE_LOCAL_ROOT"]); biến môi trường cùng tên ghi đè config
+STORAGE_LOCAL_ROOT = os.getenv("STORAGE_LOCAL_ROOT", cfg.get("STORAGE_LOCAL_ROOT", "storage"))
+
+# S3 yêu cầu mỗi part (trừ part cuối) tối thiểu 5 MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+MULTIPART_PART_SIZE = max(int(cfg.get("MULTIPART_PART_SIZE", 16 * 1024 * 1024)), MIN_PART_SIZE)
+
+class S3MultipartWriter:
+    """
+    File-like object chỉ ghi (write-only) stream dữ liệu lên S3 bằng multipart upload.
+
+    Dữ liệu được gom vào buffer, mỗi khi đủ `part_size` thì upload thành một part,
+    nên bộ nhớ chiếm dụng tối đa khoảng một part. File nhỏ hơn một part được
+    upload bằng một lần put_object khi close().
+    Thao tác bị huỷ (quá timeout của run_io) → part tiếp theo / close() raise OperationCancelled và multipart upload bị abort.
+    """
+
+    def __init__(self, key: str, bucket: Optional[str] = None, part_size: int = MULTIPART_PART_SIZE,
+                 content_type: str = "application/octet-stream"):
+        self.bucket = bucket or cfg["BUCKET"]
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.content_type = content_type
+        self.closed = False
+        self._s3 = get_s3_client()
+        self._buffer = bytearray()
+        self._position = 0
+        self._upload_id = None
+        self._parts = []
+        self._cancel = io_cancel_event()
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        return self._position
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed S3MultipartWriter")
+        self._buffer += data
+        self._position += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(self.part_size)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self, size: int):
+        raise_if_cancelled(self._cancel, f"upload {self.key}")
+        if self._upload_id is None:
+            response = self._s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+            )
+            self._upload_id = response["UploadId"]
+
+        with memoryview(self._buffer) as view:
+            chunk = bytes(view[:size])
+        del self._buffer[:size]
+
+        part_number = len(self._parts) + 1
+        response = self._s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            PartNumber=part_number, Body=chunk,
+        )
+        self._parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            raise_if_cancelled(self._cancel, f"upload {self.key}")
+            if self._upload_id is None:
+                # File nhỏ: một lần PUT là đủ
+                self._s3.put_object(
+                    Bucket=self.bucket, Key=self.key,
+                    Body=bytes(self._buffer), ContentType=self.content_type,
+                )
+            else:
+                if self._buffer:
+                    self._upload_part(len(self._buffer))
+                raise_if_cancelled(self._cancel, f"upload {self.key}")
+                self._s3.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                    MultipartUpload={"Parts": self._parts},
+                )
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.closed = True
+            self._buffer = bytearray()
+
+    def abort(self):
+        """Huỷ multipart upload đang dở để S3 không giữ lại các part mồ côi"""
+        self.closed = True
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            try:
+                self._s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except Exception as e:
+                logger.warning(f"Could not abort multipart upload for {self.key}: {e}")
+            self._upload_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class StorageBackend(ABC):
+    """
+    Interface lưu trữ object dùng chung cho mọi nơi đọc / ghi file (parquet, excel...).
+
+    Key là đường dẫn trong bucket (ví dụ "report-software/glm/<user>/analysis_data/<file>.parquet").
+    Thông tin object (head / list) là dict: {"key", "size", "etag", "last_modified"}.
+    Object không tồn tại → FileNotFoundError.
+    """
+
+    name = "base"
+
+    def __init__(self, bucket: Optional[str] = None):
+        self.bucket = bucket or cfg["BUCKET"]
+
+    @abstractmethod
+    def put(self, key: str, data: bytes, content_type: Optional[str] = None, bucket: Optional[str] = None) -> dict:
+        """Ghi cả object một lần"""
+
+    @abstractmethod
+    def open_writer(self, key: str, content_type: Optional[str] = None, bucket: Optional[str] = None):
+        """
+        Trả về file-like object chỉ ghi, dùng với `with`. Object chỉ xuất hiện khi close() thành công,
+        nếu có exception trong context thì phần đã ghi bị huỷ.
+        """
+
+    @abstractmethod
+    def get(self, key: str, bucket: Optional[str] = None) -> bytes:
+        ...
+
+    @abstractmethod
+    def head(self, key: str, bucket: Optional[str] = None) -> dict:
+        ...
+
+    @abstractmethod
+    def list(self, prefix: str = "", bucket: Optional[str] = None) -> list:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str, bucket: Optional[str] = None):
+        ...
+
+    def open_input_file(self, key: str, bucket: Optional[str] = None) -> pa.NativeFile:
+        """
+        Mở object dưới dạng pyarrow random-access file để reader parquet chỉ đọc footer,
+        các column chunk và row group cần thiết.
+        """
+        return pa.BufferReader(self.get(key, bucket))
+
+class S3Storage(StorageBackend):
+    """Backend S3 (boto3 client dùng chung trong modules.s3_client)"""
+
+    name = "s3"
+
+    def put(self, key, data, content_type=None, bucket=None):
+        raise_if_cancelled(operation=f"upload {key}")
+        extra = {"ContentType": content_type} if content_type else {}
+        response = get_s3_client().put_object(Bucket=bucket or self.bucket, Key=key, Body=data, **extra)
+        return {"key": key, "size": len(data), "etag": response.get("ETag"), "last_modified": None}
+
+    def open_writer(self, key, content_type=None, bucket=None):
+        return S3MultipartWriter(key, bucket or self.bucket, content_type=content_type or "application/octet-stream")
+
+    def get(self, key, bucket=None):
+        try:
+            response = get_s3_client().get_object(Bucket=bucket or self.bucket, Key=key)
+        except ClientError as e:
+            self._raise_not_found(e, key)
+        return response["Body"].read()
+
+    def head(self, key, bucket=None):
+        try:
+            response = get_s3_client().head_object(Bucket=bucket or self.bucket, Key=key)
+        except ClientError as e:
+            self._raise_not_found(e, key)
+        return {
+            "key": key,
+            "size": response["ContentLength"],
+            "etag": response["ETag"],
+            "last_modified": response.get("LastModified"),
+        }
+
+    def list(self, prefix="", bucket=None):
+        paginator = get_s3_client().get_paginator("list_objects_v2")
+        objects = []
+        for page in paginator.paginate(Bucket=bucket or self.bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                objects.append({
+                    "key": item["Key"],
+                    "size": item["Size"],
+                    "etag": item["ETag"],
+                    "last_modified": item["LastModified"],
+                })
+        return objects
+
+    def delete(self, key, bucket=None):
+        get_s3_client().delete_object(Bucket=bucket or self.bucket, Key=key)
+
+    def open_input_file(self, key, bucket=None):
+        bucket = bucket or self.bucket
+        if PARQUET_CACHE_ENABLED:
+            # Đọc qua cache local, chỉ tải lại khi ETag trên S3 thay đổi
+            return pa.memory_map(parquet_cache.get_path(key, bucket))
+        # Không cache: range request trực tiếp lên S3
+        return get_s3_filesystem().open_input_file(f"{bucket}/{key}")
+
+    @staticmethod
+    def _raise_not_found(error: ClientError, key: str):
+        if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            raise FileNotFoundError(key) from error
+        raise error
+
+class _LocalFileWriter:
+    """Ghi vào file tạm cùng thư mục rồi os.replace() khi close, reader không bao giờ thấy file dở dang"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        self._file = os.fdopen(fd, "wb")
+        self.closed = False
+        self._cancel = io_cancel_event()
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def write(self, data) -> int:
+        return self._file.write(data)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            raise_if_cancelled(self._cancel, f"write {self.path}")
+        except OperationCancelled:
+            self.abort()
+            raise
+        self.closed = True
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self.closed = True
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+class LocalStorage(StorageBackend):
+    """Backend ổ đĩa local: object nằm tại <root>/<bucket>/<key>"""
+
+    name = "local"
+
+    def __init__(self, root: str = STORAGE_LOCAL_ROOT, bucket: Optional[str] = None):
+        super().__init__(bucket)
+        self.root = root
+
+    def _base_dir(self, bucket: Optional[str] = None) -> str:
+        return os.path.abspath(os.path.join(self.root, bucket or self.bucket))
+
+    def _path(self, key: str, bucket: Optional[str] = None) -> str:
+        base = self._base_dir(bucket)
+        path = os.path.abspath(os.path.join(base, key))
+        if not path.startswith(base + os.sep):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def _info(self, key: str, path: str) -> dict:
+        stat = os.stat(path)
+        return {
+            "key": key,
+            "size": stat.st_size,
+            # Không hash nội dung: size + mtime đủ để nhận biết file đã bị ghi đè
+            "etag": f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"',
+            "last_modified": datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+        }
+
+    def put(self, key, data, content_type=None, bucket=None):
+        with self.open_writer(key, content_type, bucket) as writer:
+            writer.write(data)
+        return self.head(key, bucket)
+
+    def open_writer(self, key, content_type=None, bucket=None):
+        return _LocalFileWriter(self._path(key, bucket))
+
+    def get(self, key, bucket=None):
+        with open(self._path(key, bucket), "rb") as f:
+            return f.read()
+
+    def head(self, key, bucket=None):
+        return self._info(key, self._path(key, bucket))
+
+    def list(self, prefix="", bucket=None):
+        base = self._base_dir(bucket)
+        objects = []
+        for dirpath, _, filenames in os.walk(base):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, base).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    objects.append(self._info(key, path))
+        return sorted(objects, key=lambda item: item["key"])
+
+    def delete(self, key, bucket=None):
+        path = self._path(key, bucket)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def open_input_file(self, key, bucket=None):
+        path = self._path(key, bucket)
+        if not os.path.exists(path):
+            raise FileNotFoundError(key)
+        return pa.memory_map(path)
+
+class _MemoryWriter(io.BytesIO):
+    """BytesIO chỉ commit vào MemoryStorage khi close() thành công"""
+
+    def __init__(self, storage: "MemoryStorage", bucket: str, key: str):
+        super().__init__()
+        self._storage = storage
+        self._bucket = bucket
+        self._key = key
+        self._aborted = False
+        self._cancel = io_cancel_event()
+
+    def close(self):
+        if not self.closed and not self._aborted:
+            try:
+                raise_if_cancelled(self._cancel, f"write {self._key}")
+            except OperationCancelled:
+                self.abort()
+                raise
+            self._storage._store(self._bucket, self._key, self.getvalue())
+        super().close()
+
+    def abort(self):
+        self._aborted = True
+        super().close()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+class MemoryStorage(StorageBackend):
+    """Backend in-memory trong process: dùng cho benchmark throughput và chạy thử không cần S3"""
+
+    name = "memory"
+
+    def __init__(self, bucket: Optional[str] = None):
+        super().__init__(bucket)
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def _store(self, bucket: str, key: str, data: bytes):
+        with self._lock:
+            self._objects[(bucket, key)] = {
+                "data": bytes(data),
+                "etag": f'"{hashlib.md5(data).hexdigest()}"',
+                "last_modified": datetime.now(timezone.utc),
+            }
+
+    def _entry(self, key: str, bucket: Optional[str] = None) -> dict:
+        entry = self._objects.get((bucket or self.bucket, key))
+        if entry is None:
+            raise FileNotFoundError(key)
+        return entry
+
+    def put(self, key, data, content_type=None, bucket=None):
+        raise_if_cancelled(operation=f"write {key}")
+        self._store(bucket or self.bucket, key, data)
+        return self.head(key, bucket)
+
+    def open_writer(self, key, content_type=None, bucket=None):
+        return _MemoryWriter(self, bucket or self.bucket, key)
+
+    def get(self, key, bucket=None):
+        return self._entry(key, bucket)["data"]
+
+    def head(self, key, bucket=None):
+        entry = self._entry(key, bucket)
+        return {"key": key, "size": len(entry["data"]), "etag": entry["etag"], "last_modified": entry["last_modified"]}
+
+    def list(self, prefix="", bucket=None):
+        bucket = bucket or self.bucket
+        with self._lock:
+            keys = sorted(key for b, key in self._objects if b == bucket and key.startswith(prefix))
+        return [self.head(key, bucket) for key in keys]
+
+    def delete(self, key, bucket=None):
+        with self._lock:
+            self._objects.pop((bucket or self.bucket, key), None)
+
+STORAGE_BACKENDS = {
+    "s3": S3Storage,
+    "local": LocalStorage,
+    "memory": MemoryStorage,
+}
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def configured_backend() -> str:
+    """Tên backend: biến môi trường STORAGE_BACKEND nếu có, không thì S3["STORAGE_BACKEND"] của config, mặc định là s3"""
+    return (os.getenv("STORAGE_BACKEND") or cfg.get("STORAGE_BACKEND") or "s3").lower()
+
+def get_storage() -> StorageBackend:
+    """Trả về backend lưu trữ dùng chung của process, chọn theo config (xem configured_backend)"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                backend = configured_backend()
+                if backend not in STORAGE_BACKENDS:
+                    raise ValueError(
+                        f"Unknown STORAGE_BACKEND '{backend}'. Available: {', '.join(STORAGE_BACKENDS)}"
+                    )
+                _storage = STORAGE_BACKENDS[backend]()
+                logger.info(f"Using '{_storage.name}' storage backend")
+    return _storage
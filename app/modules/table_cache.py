@@ -0,0 +1,141 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Optional
+import pandas as pd
+import pyarrow as pa
+from config.log_config import logger
+
+ARROW_TABLE_CACHE_ENABLED = os.getenv("ARROW_TABLE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ARROW_TABLE_CACHE_MAX_BYTES = int(os.getenv("ARROW_TABLE_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+def make_cache_key(*parts) -> str:
+    """Tạo cache key ổn định từ các thành phần (list/dict/tuple...) bằng JSON canonical + sha256"""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class _CacheEntry:
+    __slots__ = ("table", "nbytes", "refcount")
+
+    def __init__(self, table: pa.Table):
+        self.table = table
+        self.nbytes = table.nbytes
+        self.refcount = 0
+
+class ArrowTableCache:
+    """
+    Cache in-memory (trong process) cho các bảng Arrow đã decode và xử lý xong, dùng lại giữa các request.
+
+    - Bảng Arrow là immutable nên nhiều request có thể dùng chung; mỗi request nhận một DataFrame
+      riêng được tạo từ bảng (zero-copy với các cột numeric không null), thêm / thay / xoá cột không ảnh hưởng cache.
+      Các cột zero-copy là read-only: cần sửa giá trị thì gán cột mới (df[col] = ...), không ghi tại chỗ (df.loc[...] = ...).
+    - Tổng dung lượng bị giới hạn bởi `max_bytes`, vượt quá thì xoá entry ít dùng nhất (LRU).
+    - Entry đang được lease (refcount > 0) không bị evict vì bộ nhớ của nó vẫn đang được dùng.
+    """
+
+    def __init__(self, max_bytes: int = ARROW_TABLE_CACHE_MAX_BYTES, enabled: bool = ARROW_TABLE_CACHE_ENABLED):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _acquire(self, key: str) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.refcount += 1
+            self._entries.move_to_end(key)
+            return entry
+
+    def _release(self, entry: _CacheEntry):
+        with self._lock:
+            entry.refcount -= 1
+            self._evict_locked()
+
+    def _put(self, key: str, table: pa.Table) -> Optional[_CacheEntry]:
+        """Thêm bảng vào cache và trả về entry đã được acquire; None nếu bảng lớn hơn cả budget"""
+        if table.nbytes > self.max_bytes:
+            logger.info(f"Arrow table ({table.nbytes / 1024 / 1024:.2f} MB) exceeds cache budget, not cached")
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # Request khác có thể đã thêm cùng key trong lúc bảng này được xử lý
+                entry = _CacheEntry(table)
+                self._entries[key] = entry
+                self._total_bytes += entry.nbytes
+            entry.refcount += 1
+            self._entries.move_to_end(key)
+            self._evict_locked()
+            return entry
+
+    def _evict_locked(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key in list(self._entries.keys()):
+            if self._total_bytes <= self.max_bytes:
+                break
+            entry = self._entries[key]
+            if entry.refcount > 0:
+                continue
+            del self._entries[key]
+            self._total_bytes -= entry.nbytes
+            logger.info(f"Evicted arrow table {key[:12]} ({entry.nbytes / 1024 / 1024:.2f} MB) from memory cache")
+
+    @contextmanager
+    def lease(self, key: str, loader: Callable[[], pd.DataFrame]):
+        """
+        Trả về DataFrame của `key`, gọi `loader()` để tạo khi chưa có trong cache.
+        Entry được giữ (không bị evict) cho đến khi thoát khỏi context.
+
+            with cache.lease(key, lambda: build_df()) as df:
+                ...
+        """
+        if not self.enabled:
+            yield loader()
+            return
+
+        entry = self._acquire(key)
+        if entry is not None:
+            try:
+                yield entry.table.to_pandas(split_blocks=True)
+            finally:
+                self._release(entry)
+            return
+
+        df = loader()
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            # Cột object có kiểu lẫn lộn không chuyển được sang Arrow → vẫn chạy bình thường, chỉ không cache
+            logger.warning(f"Arrow table cache skipped: {e}")
+            yield df
+            return
+
+        entry = self._put(key, table)
+        try:
+            # Lần đầu dùng luôn DataFrame vừa xử lý, không cần chuyển ngược từ Arrow
+            yield df
+        finally:
+            if entry is not None:
+                self._release(entry)
+
+    def invalidate(self, key: Optional[str] = None):
+        """Xoá một key (hoặc toàn bộ cache nếu key=None); entry đang được lease sẽ được giải phóng khi release"""
+        with self._lock:
+            keys = list(self._entries.keys()) if key is None else [key]
+            for k in keys:
+                entry = self._entries.pop(k, None)
+                if entry is not None:
+                    self._total_bytes -= entry.nbytes
+
+arrow_table_cache = ArrowTableCache()
@@ -2,19 +2,35 @@ from datetime import datetime
 import io
 import os
 from urllib.parse import urlparse
+from typing import Optional
 from fastapi import HTTPException
 import httpx
 import numpy as np
 import requests
 import pandas as pd
+import pyarrow as pa
 from exceptions import ConflictException
 import json
 import re
 from utils.json_encoder import NpEncoder
+from utils.executors import run_cpu, run_io, STORAGE_WRITE_TIMEOUT
 from modules.GLM.glm_valid_claim import analyze_dataframe_claim
 from modules.GLM.glm_valid_gwp import analyze_dataframe_gwp
 from modules.GLM.glm_valid_combine import analyze_dataframe_combine
-from modules.db_parquet import upload_to_s3, cfg
+from modules.db_parquet import (
+    write_parquet_to_s3_async,
+    read_parquet_dataset,
+    extract_parquet_key,
+    is_storage_url,
+    get_object_etag,
+    cfg,
+    ParquetArtifactWriter,
+    ParquetResultSink,
+    source_lineage,
+)
+from modules.catalog import dataset_catalog
+from modules.http_parquet import read_parquet_http
+from modules.table_cache import arrow_table_cache, make_cache_key
 from modules.GLM.glm_varb_analysis import (
     categorize_car,
     categorize_health,
@@ -22,7 +38,33 @@ from modules.GLM.glm_varb_analysis import (
     TWA_func,
     threeway_func,
     fourway_func,
+    finalize_owa_table,
+    finalize_multiway_table,
+    prepare_owa_grouping_sets,
+    OWA_grouping_set_pivots,
+    select_code_pivot,
+    setup_analysis_params,
+    prepare_year_index,
+)
+from modules.GLM.glm_cube import GLMCube
+from modules.GLM.glm_parallel import (
+    parallel_workers, run_batches, load_shared_frame, write_arrow_file, take_result_frame, remove_files,
+)
+from modules.GLM.glm_binning import (
+    GLM_BINNING_ENGINE_ENABLED, compile_bin_spec, parse_bin_setting, source_column,
+    bin_columns, bin_specs_metadata, stored_bin_specs,
 )
+from modules.GLM.glm_histogram import BinHistogram, OWAPreaggregate, preaggregate_cache
+from modules.GLM.glm_result_cache import glm_result_cache
+from modules.jobs import job_manager, job_checkpoint, job_progress
+from modules.single_flight import request_key
+
+# Cột dùng để sắp xếp / chia row group khi import dữ liệu GLM
+IMPORT_PARTITION_COLUMN = "CAL_YEAR"
+# 1WA: tính tất cả các năm của mỗi biến trong một lần groupby thay vì gọi OWA_func cho từng (biến, năm)
+GLM_GROUPING_SETS_ENABLED = os.getenv("GLM_GROUPING_SETS_ENABLED", "true").lower() in ("1", "true", "yes")
+# 2WA / 3WA / 4WA: suy ra mọi tổ hợp biến từ data cube thay vì quét lại dữ liệu cho từng (tổ hợp, năm)
+GLM_CUBE_ENABLED = os.getenv("GLM_CUBE_ENABLED", "true").lower() in ("1", "true", "yes")
 
 class GLMService:
     async def extract_mapping_columns(self, url_file: str) -> dict:
@@ -49,9 +91,10 @@ class GLMService:
 
         try:
             if file_extension == ".csv":
-                df = pd.read_csv(io.BytesIO(contents), nrows=2)
+                df = await run_cpu(pd.read_csv, io.BytesIO(contents), nrows=2)
             elif file_extension in [".xlsx", ".xls", ".xlsm"]:
-                df = pd.read_excel(io.BytesIO(contents), nrows=2, engine="openpyxl")
+                # openpyxl vẫn đọc cả workbook dù chỉ lấy 2 dòng → chạy trên CPU executor
+                df = await run_cpu(pd.read_excel, io.BytesIO(contents), nrows=2, engine="openpyxl")
             else:
                 raise HTTPException(status_code=400, detail="Unsupported file format")
         except ValueError as e:
@@ -265,24 +308,10 @@ class GLMService:
             # Download file
             contents, file_name, file_extension = await self.download_file_from_url(url_file)
             
-            # Parse file dựa trên extension
-            if file_extension == ".csv":
-                df_import = pd.read_csv(io.BytesIO(contents))
-                print(f"✓ CSV file parsed: {len(df_import):,} rows, {len(df_import.columns)} columns")
-                
-            elif file_extension in [".xlsx", ".xls", ".xlsm"]:
-                if include_data_sheets_only:
-                    # Parse Excel với chỉ DATA sheets
-                    df_import = self._parse_excel_data_sheets(contents, file_name, skiprows)
-                else:
-                    # Parse Excel thông thường (sheet đầu tiên)
-                    df_import = pd.read_excel(io.BytesIO(contents), skiprows=skiprows, engine="openpyxl")
-                    print(f"✓ Excel file parsed: {len(df_import):,} rows, {len(df_import.columns)} columns")
-                    
-            else:
-                raise HTTPException(status_code=400, detail=f"Unsupported file format: {file_extension}")
-                
-            return df_import
+            # Parse file dựa trên extension (trên CPU executor, không chặn event loop)
+            return await run_cpu(
+                self._parse_contents, contents, file_name, file_extension, skiprows, include_data_sheets_only
+            )
             
         except HTTPException:
             raise
@@ -291,6 +320,27 @@ class GLMService:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Unexpected error parsing file: {str(e)}")
 
+    def _parse_contents(self, contents: bytes, file_name: str, file_extension: str, skiprows: int = 1,
+                        include_data_sheets_only: bool = False) -> pd.DataFrame:
+        """Parse nội dung file đã tải về (CSV / Excel) thành DataFrame"""
+        if file_extension == ".csv":
+            df_import = pd.read_csv(io.BytesIO(contents))
+            print(f"✓ CSV file parsed: {len(df_import):,} rows, {len(df_import.columns)} columns")
+            
+        elif file_extension in [".xlsx", ".xls", ".xlsm"]:
+            if include_data_sheets_only:
+                # Parse Excel với chỉ DATA sheets
+                df_import = self._parse_excel_data_sheets(contents, file_name, skiprows)
+            else:
+                # Parse Excel thông thường (sheet đầu tiên)
+                df_import = pd.read_excel(io.BytesIO(contents), skiprows=skiprows, engine="openpyxl")
+                print(f"✓ Excel file parsed: {len(df_import):,} rows, {len(df_import.columns)} columns")
+                
+        else:
+            raise HTTPException(status_code=400, detail=f"Unsupported file format: {file_extension}")
+            
+        return df_import
+
     def _parse_excel_data_sheets(self, contents: bytes, file_name: str, skiprows: int = 1) -> pd.DataFrame:
         """
         Parse Excel file với chỉ các sheet có tên bắt đầu bằng "DATA"
@@ -398,29 +448,7 @@ class GLMService:
             df = await self.parse_file_from_url(url_file, skiprows, include_data_sheets_only)
             
             # Basic validation
-            validation_results = {
-                'total_rows': len(df),
-                'total_columns': len(df.columns),
-                'column_names': list(df.columns),
-                'has_data': len(df) > 0,
-                'memory_usage_mb': df.memory_usage(deep=True).sum() / (1024 * 1024)
-            }
-            
-            # Check expected columns if provided
-            if expected_columns:
-                missing_columns = [col for col in expected_columns if col not in df.columns]
-                extra_columns = [col for col in df.columns if col not in expected_columns]
-                
-                validation_results.update({
-                    'expected_columns': expected_columns,
-                    'missing_columns': missing_columns,
-                    'extra_columns': extra_columns,
-                    'has_all_expected_columns': len(missing_columns) == 0
-                })
-            
-            # Check for completely empty rows
-            empty_rows = df.isnull().all(axis=1).sum()
-            validation_results['empty_rows'] = empty_rows
+            validation_results = await run_cpu(self._basic_validation, df, expected_columns)
             
             return {
                 "status": True,
@@ -439,6 +467,34 @@ class GLMService:
                 "validation": None
             }
 
+    @staticmethod
+    def _basic_validation(df: pd.DataFrame, expected_columns: list = None) -> dict:
+        """Thống kê / kiểm tra cơ bản của file vừa parse (số dòng, cột thiếu, dòng rỗng...)"""
+        validation_results = {
+            'total_rows': len(df),
+            'total_columns': len(df.columns),
+            'column_names': list(df.columns),
+            'has_data': len(df) > 0,
+            'memory_usage_mb': df.memory_usage(deep=True).sum() / (1024 * 1024)
+        }
+        
+        # Check expected columns if provided
+        if expected_columns:
+            missing_columns = [col for col in expected_columns if col not in df.columns]
+            extra_columns = [col for col in df.columns if col not in expected_columns]
+            
+            validation_results.update({
+                'expected_columns': expected_columns,
+                'missing_columns': missing_columns,
+                'extra_columns': extra_columns,
+                'has_all_expected_columns': len(missing_columns) == 0
+            })
+        
+        # Check for completely empty rows
+        empty_rows = df.isnull().all(axis=1).sum()
+        validation_results['empty_rows'] = empty_rows
+        return validation_results
+
     async def _extract_request_data(self, request_body) -> dict:
         """Helper function để extract và validate request data"""
         try:
@@ -448,7 +504,9 @@ class GLMService:
                 "userName": request_body.json_settings["userName"],
                 "nameProduct": request_body.json_settings["nameProduct"],
                 "validStatus": request_body.json_settings.get("validStatus"),
-                "templateName": request_body.json_settings.get("templateName")
+                "templateName": request_body.json_settings.get("templateName"),
+                # Thiết lập bin (như var_cate_settings của phân tích) để lưu sẵn các cột _GROUP cùng file import
+                "varCateSettings": request_body.json_settings.get("var_cate_settings") or [],
             }
         except KeyError as e:
             raise HTTPException(status_code=400, detail=f"Missing required field: {str(e)}")
@@ -850,7 +908,7 @@ class GLMService:
         df_import, validation_info = await self._parse_and_prepare_data(request_data["url"])
         
         # Map columns
-        df_mapped, mapping_info = self._map_columns(df_import, request_body)
+        df_mapped, mapping_info = await run_cpu(self._map_columns, df_import, request_body)
         
         # Validate data
         if not (mapping_info["system_name_cols"] and mapping_info["business_name_cols"]):
@@ -859,12 +917,12 @@ class GLMService:
             )
 
         rq2json = json.dumps(request_body.model_dump(), ensure_ascii=False, indent=4)
-        status, message, validation_results = self._validate_data_by_function(
-            df_mapped, request_data["nameFunc"], json.loads(rq2json)
+        status, message, validation_results = await run_cpu(
+            self._validate_data_by_function, df_mapped, request_data["nameFunc"], json.loads(rq2json)
         )
 
         # Serialize validation results
-        updated_json_data = json.dumps(validation_results, cls=NpEncoder, indent=4)
+        updated_json_data = await run_cpu(json.dumps, validation_results, cls=NpEncoder, indent=4)
 
         # Return response
         return {
@@ -887,10 +945,12 @@ class GLMService:
         df_import, validation_info = await self._parse_and_prepare_data(request_data["url"])
         
         # Map columns
-        df_mapped, mapping_info = self._map_columns(df_import, request_body)
+        df_mapped, mapping_info = await run_cpu(self._map_columns, df_import, request_body)
         
         # Convert columns based on settings
-        df_converted = self._convert_column_types(df_mapped, mapping_info["system_name_type"], for_parquet=True)
+        df_converted = await run_cpu(
+            self._convert_column_types, df_mapped, mapping_info["system_name_type"], for_parquet=True
+        )
 
         # Extract additional codes mapping from VARS_AC variables
         list_additional = self._extract_additional_vars_ac(request_body)
@@ -904,48 +964,59 @@ class GLMService:
             request_data["templateName"]
         )
 
-        # Save parquet file to S3 with optimized settings
+        # Sắp xếp theo CAL_YEAR để mỗi row group chỉ chứa một năm → lọc theo năm chỉ đọc row group của năm đó
+        partition_by = IMPORT_PARTITION_COLUMN if IMPORT_PARTITION_COLUMN in df_converted.columns else None
+
+        # Lưu sẵn các cột _GROUP đã phân nhóm: phân tích cùng thiết lập bin đọc thẳng cột này, không phân nhóm lại
+        schema_metadata = None
+        if GLM_BINNING_ENGINE_ENABLED and request_data["varCateSettings"]:
+            try:
+                bin_specs = await run_cpu(
+                    bin_columns, df_converted, request_data["varCateSettings"], request_data["nameProduct"]
+                )
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Invalid var_cate_settings: {str(e)}")
+            schema_metadata = bin_specs_metadata(bin_specs) if bin_specs else None
+
+        # Save parquet file to S3 with optimized settings (stream từng row group, không buffer cả file)
         try:
-            buffer = io.BytesIO()
-            # Use pyarrow with specific settings for better compatibility
             try:
-                import pyarrow as pa
-                import pyarrow.parquet as pq
-                
-                # Create Arrow table
-                table = pa.Table.from_pandas(df_converted, preserve_index=False)
-                
-                # Write with optimized settings
-                pq.write_table(
-                    table, 
-                    buffer,
-                    compression='snappy',
-                    use_dictionary=True,
-                    row_group_size=50000,
-                    use_deprecated_int96_timestamps=False,
-                    coerce_timestamps='ms',
-                    store_schema=True
+                # Ghi trên IO executor để upload lớn không chặn event loop
+                file_size = await write_parquet_to_s3_async(
+                    df_converted,
+                    s3_key,
+                    profile="bulk_import",
+                    partition_by=partition_by,
+                    lineage=[source_lineage(request_data["url"])],
+                    schema_metadata=schema_metadata,
                 )
                 print(f"✅ Parquet saved with pyarrow optimization")
                 
+            except HTTPException:
+                # Timeout (504): không thử lại với writer mặc định
+                raise
             except Exception as arrow_error:
-                print(f"⚠️ Arrow failed, using pandas fallback: {arrow_error}")
-                # Fallback to pandas
-                df_converted.to_parquet(buffer, index=False, engine='pyarrow')
-            
-            buffer.seek(0)
-            upload_to_s3(
-                bucket=cfg["BUCKET"],
-                key=s3_key,
-                data_bytes=buffer.getvalue(),
-                mimetype="application/octet-stream"
-            )
+                print(f"⚠️ Arrow failed, using default parquet settings: {arrow_error}")
+                # Fallback to default writer settings
+                file_size = await write_parquet_to_s3_async(
+                    df_converted, s3_key, partition_by=partition_by, lineage=[source_lineage(request_data["url"])],
+                    schema_metadata=schema_metadata,
+                )
             
-            print(f"✅ Parquet file uploaded: {len(buffer.getvalue()) / 1024 / 1024:.2f} MB")
+            print(f"✅ Parquet file uploaded: {file_size / 1024 / 1024:.2f} MB")
             
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error uploading parquet to S3: {str(e)}")
 
+        # File import mới (hoặc ghi đè file cũ cùng key): bỏ các bảng kết quả đã cache của file này
+        try:
+            await run_io(glm_result_cache.invalidate_source, s3_key, timeout=STORAGE_WRITE_TIMEOUT,
+                         operation="invalidate GLM result cache")
+        except Exception as e:
+            print(f"⚠️ Could not invalidate GLM result cache of {s3_key}: {e}")
+
         # Return response
         return {
             "status": True,
@@ -1022,56 +1093,224 @@ class GLMAnalysis:
         except Exception as e:
             raise HTTPException(status_code=409, detail=f"Error processing request: {str(e)}")
 
+    def _resolve_cal_years(self, var_cal_year: list) -> list:
+        """Xử lý var_cal_year để tạo danh sách năm cần phân tích"""
+        if not var_cal_year:
+            return []
+        if len(var_cal_year) == 2:
+            if var_cal_year[0] < var_cal_year[1]:
+                # Trường hợp [2015, 2019] → tạo range [2015, 2016, 2017, 2018, 2019]
+                return list(range(var_cal_year[0], var_cal_year[1] + 1))
+            # Trường hợp [2015, 2015] → giữ nguyên [2015]
+            return [var_cal_year[0]]
+        # Các trường hợp khác (không nên xảy ra theo yêu cầu)
+        return list(set(var_cal_year))
+
     def _read_parquet_data(self, parquet_url: str, var_info: list, var_bf_category_cols: list, 
-                          var_single_cols: list, additional_apply: bool, additional_codes: list):
-        """Đoạn 2: Đọc file parquet"""
+                          var_single_cols: list, additional_apply: bool, additional_codes: list,
+                          var_cal_year: list = None):
+        """Đoạn 2: Đọc file parquet (chỉ đọc các cột cần thiết và các năm trong calYear)"""
         try:
-            # Đọc trực tiếp từ URL signed
-            df = pd.read_parquet(parquet_url)
-            
             # Select only required columns
+            columns = var_info + var_bf_category_cols + var_single_cols
             if additional_apply:
-                list_add = [f"{prefix}_{code}" for code in additional_codes for prefix in ["NUM_CLAIMS", "CLAIM_PMT"]]
-                df = df[var_info + var_bf_category_cols + var_single_cols + list_add]
+                columns += [f"{prefix}_{code}" for code in additional_codes for prefix in ["NUM_CLAIMS", "CLAIM_PMT"]]
+            # Loại bỏ cột trùng nhưng giữ nguyên thứ tự
+            columns = list(dict.fromkeys(columns))
+
+            # pol_year_ind == 0 nghĩa là lấy tất cả các năm → không lọc
+            years = self._resolve_cal_years(var_cal_year)
+            filters = {"CAL_YEAR": years} if years and 0 not in years else None
+
+            if is_storage_url(parquet_url):
+                parquet_key = extract_parquet_key(parquet_url)
+                entry = dataset_catalog.get_entry(parquet_key)
+                if entry is not None:
+                    # Kiểm tra cột qua catalog, không cần mở file dữ liệu
+                    available = {field["name"] for field in entry["schema"]}
+                    missing = [col for col in columns if col not in available]
+                    if missing:
+                        raise HTTPException(
+                            status_code=409,
+                            detail=f"Columns not found in dataset '{entry['name']}': {', '.join(missing)}"
+                        )
+                    # File chỉ chứa các năm được yêu cầu → bỏ bước lọc
+                    if filters and entry.get("partition_by") == "CAL_YEAR" and entry.get("partitions") \
+                            and set(entry["partitions"]) <= set(years):
+                        filters = None
+                # Đọc qua pyarrow.dataset: chỉ tải column chunk và row group cần thiết
+                df = read_parquet_dataset(parquet_key, columns=columns, filters=filters)
+            elif urlparse(parquet_url).scheme in ("http", "https"):
+                # URL ngoài hệ thống: Range request, chỉ tải footer và các column chunk / row group cần thiết
+                df = read_parquet_http(parquet_url, columns=columns, filters=filters)
             else:
-                df = df[var_info + var_bf_category_cols + var_single_cols]
+                # URL khác (s3:// bucket khác, đường dẫn local): đọc trực tiếp, chỉ chọn cột cần thiết
+                df = pd.read_parquet(parquet_url, columns=columns)
+                if filters and "CAL_YEAR" in df.columns:
+                    df = df[df["CAL_YEAR"].astype(int).isin(years)]
             return df
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=409, detail=f"Error reading parquet file from URL: {str(e)}")
 
-    def _process_category_columns(self, df: pd.DataFrame, var_category_settings: list, product_name: str):
-        """Đoạn 3: Xử lý category columns"""
+    def _process_category_columns(self, df: pd.DataFrame, var_category_settings: list, product_name: str,
+                                  stored_bins: dict = None):
+        """
+        Đoạn 3: Xử lý category columns
+        :param stored_bins: {cột _GROUP: BinSpec} của các cột đã phân nhóm sẵn khi import (xem _stored_bin_columns)
+        """
         try:
             df_processed = pd.DataFrame()
+            stored_bins = stored_bins or {}
             for setting in var_category_settings:
-                col = list(setting.keys())[0]  # Get column name
-                var_settings = setting[col]  # Get settings for this column
-
-                bins = var_settings.bin
-                units = var_settings.unit
-                # Convert infinity strings to float values
-                bins = [float("inf") if x == "Infinity" else float(x) for x in bins]
+                # Get column name, bins (infinity strings → float) and unit
+                col, bins, units = parse_bin_setting(setting)
 
                 # Get original column name without _GROUP suffix
-                col_import = col.split("_GROUP")[0]
-                df[col] = df[col_import]
-                if product_name == "HEALTH":
-                    df_processed = categorize_health(df, col, bins, units)
-                elif product_name == "CAR":
-                    df_processed = categorize_car(df, col, bins, units)
+                col_import = source_column(col)
+                spec = compile_bin_spec(product_name, col, bins, units) if GLM_BINNING_ENGINE_ENABLED else None
+                if col in stored_bins and not df.empty:
+                    # Cột đã phân nhóm khi import: chỉ đưa category về đúng dtype, không phân nhóm lại
+                    df[col] = stored_bins[col].restore(df.pop(col))
+                    df_processed = df
+                elif spec is not None and not df.empty:
+                    # Thiết lập bin đã biên dịch (cache) → mã category: so sánh vector với từng cạnh khi ≤ 32 cạnh, np.searchsorted khi nhiều hơn
+                    df[col] = spec.assign(df[col_import])
+                    df_processed = df
+                else:
+                    df[col] = df[col_import]
+                    if product_name == "HEALTH":
+                        df_processed = categorize_health(df, col, list(bins), units)
+                    elif product_name == "CAR":
+                        df_processed = categorize_car(df, col, list(bins), units)
 
             return df_processed
         except Exception as e:
             raise HTTPException(status_code=409, detail=f"Error processing category columns: {str(e)}")
 
-    def _generate_table_name_and_save(self, df_final: pd.DataFrame, parquet_url: str, 
-                                     user_name: str, name_func: str, product_name: str, 
-                                     analysis_type: str, additional_apply: bool, additional_codes: str):
-        """Đoạn 5: Đặt tên và lưu database/S3"""
+    def _stored_bin_columns(self, parquet_url: str, var_category_settings: list, product_name: str) -> dict:
+        """
+        Các cột _GROUP đã được phân nhóm và lưu cùng file khi import với đúng thiết lập bin của request
+        (theo metadata của file trong dataset catalog): {cột _GROUP: BinSpec}. Lỗi bất kỳ → {} (phân nhóm lại như thường).
+        """
+        if not GLM_BINNING_ENGINE_ENABLED or not var_category_settings or not is_storage_url(parquet_url):
+            return {}
+        try:
+            entry = dataset_catalog.get_entry(extract_parquet_key(parquet_url))
+            if entry is None:
+                return {}
+            stored = stored_bin_specs(entry.get("metadata"))
+            available = {field["name"] for field in entry["schema"]}
+            result = {}
+            for setting in var_category_settings:
+                col, bins, unit = parse_bin_setting(setting)
+                spec = compile_bin_spec(product_name, col, bins, unit)
+                if spec is not None and col != source_column(col) and col in available and spec.matches(stored.get(col)):
+                    result[col] = spec
+            return result
+        except Exception as e:
+            print(f"⚠️ Could not read stored bin columns of {parquet_url}: {e}")
+            return {}
+
+    @staticmethod
+    def _data_source(parquet_url: str) -> list:
+        """Nhận diện phiên bản file nguồn cho cache key"""
+        try:
+            if is_storage_url(parquet_url):
+                # Signed URL thay đổi theo mỗi lần ký → dùng S3 key + ETag để nhận diện đúng phiên bản file
+                parquet_key = extract_parquet_key(parquet_url)
+                return ["storage", parquet_key, get_object_etag(parquet_key)]
+            return ["url", parquet_url]
+        except Exception as e:
+            raise HTTPException(status_code=409, detail=f"Error reading parquet file from URL: {str(e)}")
+
+    def _analysis_data_cache_key(self, request_data: dict, var_category_settings: list) -> str:
+        """Cache key cho dữ liệu đã đọc + phân nhóm: (file nguồn, tập cột, năm, thiết lập bin)"""
+        source = self._data_source(request_data['parquet_url'])
+
+        bin_settings = []
+        for setting in var_category_settings:
+            col, bins, unit = parse_bin_setting(setting)
+            bin_settings.append([col, list(bins), unit])
+
+        return make_cache_key(
+            source,
+            request_data['product_name'],
+            request_data['var_info'],
+            request_data['var_bf_category_cols'],
+            request_data['var_single_cols'],
+            request_data['additional_codes'] if request_data['additional_apply'] else None,
+            self._resolve_cal_years(request_data['var_cal_year']),
+            bin_settings,
+        )
+
+    def _load_analysis_data(self, request_data: dict, var_category_settings: list):
+        """
+        Đoạn 2 + 3: Đọc parquet và xử lý category columns, dùng lại kết quả đã xử lý từ cache in-memory
+        nếu cùng file, cùng tập cột và cùng thiết lập bin (ví dụ khi chạy lần lượt các cặp 2WA).
+        Dùng với `with`: dữ liệu trong cache được giữ cho đến khi thoát khỏi context.
+        """
+        def loader():
+            stored_bins = self._stored_bin_columns(
+                request_data['parquet_url'], var_category_settings, request_data['product_name']
+            )
+            df = self._read_parquet_data(
+                request_data['parquet_url'],
+                request_data['var_info'],
+                request_data['var_bf_category_cols'] + list(stored_bins),
+                request_data['var_single_cols'],
+                request_data['additional_apply'],
+                request_data['additional_codes'],
+                request_data['var_cal_year']
+            )
+            return self._process_category_columns(df, var_category_settings, request_data['product_name'], stored_bins)
+
+        cache_key = self._analysis_data_cache_key(request_data, var_category_settings) if arrow_table_cache.enabled else None
+        return arrow_table_cache.lease(cache_key, loader)
+
+    def _owa_preaggregate(self, request_data: dict) -> tuple:
+        """
+        (OWAPreaggregate, key) dùng cho 1WA của request: cùng file, năm và additional code thì dùng chung,
+        không phụ thuộc thiết lập bin và tập biến. (None, None) nếu tắt hoặc không nhận diện được file nguồn.
+        """
+        if not (preaggregate_cache.enabled and GLM_GROUPING_SETS_ENABLED):
+            return None, None
+        try:
+            key = make_cache_key(
+                self._data_source(request_data['parquet_url']),
+                request_data['product_name'],
+                request_data['var_info'],
+                request_data['additional_codes'] if request_data['additional_apply'] else None,
+                self._resolve_cal_years(request_data['var_cal_year']),
+            )
+        except HTTPException:
+            return None, None
+        return preaggregate_cache.get(key) or OWAPreaggregate(), key
+
+    @staticmethod
+    def _bin_specs(request_data: dict) -> dict:
+        """{biến _GROUP: BinSpec} của các biến phân nhóm mà engine biên dịch được"""
+        specs = {}
+        try:
+            for setting in request_data['var_category_settings']:
+                col, bins, unit = parse_bin_setting(setting)
+                spec = compile_bin_spec(request_data['product_name'], col, bins, unit)
+                if spec is not None:
+                    specs[col] = spec
+        except Exception:
+            return {}
+        return specs
+
+    def _generate_table_name(self, parquet_url: str, user_name: str, name_func: str, product_name: str,
+                             analysis_type: str, additional_apply: bool, additional_codes: str,
+                             settings_digest: Optional[str] = None):
+        """
+        Đặt tên bảng kết quả và S3 key. Tên bảng giữ nguyên dạng {user}_{func}_{product}_{code}_{type}_{timestamp};
+        settings_digest (xem _analysis_settings) là thư mục con của sub_folder: chạy với thiết lập khác ghi ra file khác,
+        không ghi đè bảng mà URL đã trả cho lần chạy trước đang trỏ tới.
+        """
         try:
-            # Extract timestamp từ URL
-            from urllib.parse import urlparse
-            
             parsed_url = urlparse(parquet_url)
             file_path = parsed_url.path
             
@@ -1079,24 +1318,13 @@ class GLMAnalysis:
             match = re.search(r"_([0-9]{14})\.parquet", file_path)
             timestamp = match.group(1)
             
-            if additional_apply:
-                table_detail_name = f"{user_name}_{name_func}_{product_name}_{additional_codes}_{analysis_type}_{timestamp}"
-            else:
-                table_detail_name = f"{user_name}_{name_func}_{product_name}_AC00_{analysis_type}_{timestamp}"
+            code_part = additional_codes if additional_apply else "AC00"
+            table_detail_name = f"{user_name}_{name_func}_{product_name}_{code_part}_{analysis_type}_{timestamp}"
             sub_folder = f"report-software/glm/{user_name}/analysis_data"
+            if settings_digest:
+                sub_folder = f"{sub_folder}/{settings_digest}"
             s3_key = f"{sub_folder}/{table_detail_name}.parquet"
 
-            # Lưu file parquet lên S3
-            buffer = io.BytesIO()
-            df_final.to_parquet(buffer, index=False)
-            buffer.seek(0)
-            upload_to_s3(
-                bucket=cfg["BUCKET"],
-                key=s3_key,
-                data_bytes=buffer.getvalue(),
-                mimetype="application/octet-stream"
-            )
-
             return {
                 'table_detail_name': table_detail_name,
                 's3_key': s3_key,
@@ -1104,28 +1332,92 @@ class GLMAnalysis:
                 'sub_folder': sub_folder
             }
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error generating table name or saving: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error generating table name: {str(e)}")
 
-    def _process_analysis_generic(self, df_processed, request_data, analysis_func, var_combinations, add_codes=None, add_desc=None):
-        """Generic helper function để xử lý các loại analysis khác nhau"""
-        df_final = pd.DataFrame()
-        idx = 1
+    def _process_analysis_codes(self, df_processed, request_data, analysis_func, var_combinations, code_runs,
+                                sinks=None, var_code_start=1, allow_parallel=True, preaggregate=None):
+        """
+        Phân tích cho nhiều additional code cùng lúc, code_runs = [(add_codes, add_desc)].
+        Mỗi bảng con (combination, năm) được append vào sink của code tương ứng (ParquetResultSink ghi thẳng lên storage);
+        không truyền sinks thì gom trong RAM và trả về list bảng kết quả theo thứ tự code_runs.
+        Grouping sets (1WA) và cube (2WA / 3WA / 4WA) aggregate cột của mọi code trong cùng một lần group;
+        vòng lặp gốc vẫn chạy lại cho từng code.
+        Nhiều combination trên dữ liệu lớn thì chia đoạn cho process pool (_process_analysis_parallel),
+        trừ 1WA có preaggregate (chạy tuần tự để dùng lại / cập nhật pivot và histogram của preaggregate).
+        """
+        collect = sinks is None
+        if collect:
+            sinks = [_FrameCollector() for _ in code_runs]
 
-        # Xử lý var_cal_year để tạo range nếu cần
-        var_cal_year = request_data['var_cal_year']
-        
-        if len(var_cal_year) == 2:
-            if var_cal_year[0] < var_cal_year[1]:
-                # Trường hợp [2015, 2019] → tạo range [2015, 2016, 2017, 2018, 2019]
-                unique_years = list(range(var_cal_year[0], var_cal_year[1] + 1))
-            else:
-                # Trường hợp [2015, 2015] → giữ nguyên [2015]
-                unique_years = [var_cal_year[0]]
+        job_progress(0, len(var_combinations), f"Analyzing {len(var_combinations)} combinations")
+        if allow_parallel and preaggregate is None and self._process_analysis_parallel(
+            df_processed, request_data, analysis_func, var_combinations, code_runs, sinks
+        ):
+            return [sink.to_frame() for sink in sinks] if collect else sinks
+
+        if GLM_GROUPING_SETS_ENABLED and analysis_func == self._call_owa_func:
+            self._process_owa_grouping_sets(
+                df_processed, request_data, var_combinations, code_runs, sinks, var_code_start, preaggregate
+            )
+        elif GLM_CUBE_ENABLED and analysis_func in (self._call_twa_func, self._call_threeway_func, self._call_fourway_func):
+            self._process_cube_analysis(
+                df_processed, request_data, analysis_func, var_combinations, code_runs, sinks, var_code_start
+            )
         else:
-            # Các trường hợp khác (không nên xảy ra theo yêu cầu)
-            unique_years = list(set(var_cal_year))
+            year_index = self._year_index(df_processed, request_data)
+            for run_index, ((add_codes, add_desc), sink) in enumerate(zip(code_runs, sinks)):
+                job_progress(run_index, len(code_runs))
+                self._process_analysis_loop(
+                    df_processed, request_data, analysis_func, var_combinations, sink, add_codes, add_desc, var_code_start,
+                    year_index
+                )
+
+        return [sink.to_frame() for sink in sinks] if collect else sinks
+
+    def _process_analysis_parallel(self, df_processed, request_data, analysis_func, var_combinations, code_runs, sinks) -> bool:
+        """
+        Chia var_combinations thành các đoạn liên tiếp, mỗi đoạn chạy _process_analysis_codes trong một process
+        của pool trên dữ liệu chia sẻ qua Arrow IPC (memory map). Kết quả được append vào sinks theo thứ tự var_code,
+        giống hệt khi chạy tuần tự. Trả về False nếu không chạy song song (dữ liệu nhỏ, pool lỗi...).
+        """
+        n_workers = parallel_workers(len(var_combinations), len(df_processed))
+        func_name = getattr(analysis_func, "__name__", None)
+        if n_workers <= 1 or func_name not in ("_call_owa_func", "_call_twa_func", "_call_threeway_func", "_call_fourway_func"):
+            return False
+        # Chỉ gửi sang worker các thiết lập mà phần phân tích dùng tới
+        worker_request = {key: request_data[key] for key in ("var_cal_year", "product_name", "additional_apply")}
+        results = run_batches(
+            _analysis_batch_worker, df_processed, list(var_combinations), n_workers, worker_request, func_name, code_runs
+        )
+        if results is None:
+            return False
+
+        # Worker trả về đường dẫn file Arrow IPC của từng bảng kết quả (None nếu bảng rỗng)
+        files = [item for result in results if result[0] == "ok" for item in result[1] if isinstance(item, str)]
+        try:
+            # Lỗi của đoạn đầu tiên bị lỗi = lỗi gặp đầu tiên khi chạy tuần tự
+            for result in results:
+                if result[0] == "error":
+                    raise HTTPException(status_code=result[1], detail=result[2])
+            for result in results:
+                for sink, item in zip(sinks, result[1]):
+                    df_batch = take_result_frame(item) if isinstance(item, str) else item
+                    if df_batch is not None and not df_batch.empty:
+                        sink.append(df_batch)
+        finally:
+            remove_files(files)
+        return True
+
+    def _process_analysis_loop(self, df_processed, request_data, analysis_func, var_combinations, sink,
+                               add_codes=None, add_desc=None, var_code_start=1, year_index=None):
+        """Vòng lặp gốc: gọi analysis_func cho từng (combination, năm), append từng bảng vào sink"""
+        idx = var_code_start
+
+        # Xử lý var_cal_year để tạo range nếu cần
+        unique_years = self._resolve_cal_years(request_data['var_cal_year'])
 
         for combination in var_combinations:
+            job_checkpoint()
             for pol_year in unique_years:
                 try:
                     var_code = str(idx).zfill(3)
@@ -1136,21 +1428,194 @@ class GLMAnalysis:
                         var_code,
                         request_data,
                         add_codes,
-                        add_desc
+                        add_desc,
+                        year_index=year_index
                     )
-                    df_final = pd.concat([df_final, dftemp], axis=0)
-                    
                 except Exception as e:
                     combination_str = combination if isinstance(combination, str) else " & ".join(combination)
                     raise HTTPException(
                         status_code=409,
                         detail=f"Error in combination '{combination_str}' for year '{pol_year}': {str(e)}"
                     )
+                sink.append(dftemp)
             idx += 1
-        
-        return df_final
 
-    def _call_owa_func(self, pol_year, df_processed, combination, var_code, request_data, add_codes=None, add_desc=None):
+    @staticmethod
+    def _year_index(df_processed, request_data):
+        """Chỉ mục năm / dòng đầu tiên của mỗi hợp đồng dùng chung cho mọi lần gọi *_func của request"""
+        try:
+            return prepare_year_index(df_processed, request_data['product_name'])
+        except Exception:
+            # Thiếu cột, kiểu dữ liệu lạ...: để *_func báo lỗi như cũ
+            return None
+
+    @staticmethod
+    def _code_columns_available(df_processed, request_data, code_runs) -> list:
+        """Với mỗi code: dữ liệu có đủ cột NUM_CLAIMS / CLAIM_PMT của code đó hay không"""
+        available = []
+        for add_codes, _ in code_runs:
+            _, _, num_claims, claim_pmt, _ = setup_analysis_params(
+                request_data['product_name'], request_data['additional_apply'], add_codes
+            )
+            available.append(num_claims in df_processed.columns and claim_pmt in df_processed.columns)
+        return available
+
+    def _process_owa_grouping_sets(self, df_processed, request_data, var_combinations, code_runs, sinks, var_code_start=1,
+                                   preaggregate=None):
+        """
+        1WA qua grouping sets: mỗi biến chỉ groupby một lần cho tất cả các năm và tất cả additional code.
+        So với vòng lặp OWA_func: số đếm chính xác, tổng float trong rtol 1e-9 (thứ tự cộng khác);
+        (biến, năm, code) nào engine không tính được thì gọi lại OWA_func.
+        Có preaggregate thì pivot của biến thường và pivot suy từ histogram (biến _GROUP) được dùng lại,
+        các pivot vừa tính / histogram vừa dựng được ghi vào đó cho request sau; df_processed=None khi
+        preaggregate đã đủ cho cả request (OWAPreaggregate.covers).
+        """
+        unique_years = self._resolve_cal_years(request_data['var_cal_year'])
+        product_name = request_data['product_name']
+        additional_apply = request_data['additional_apply']
+        claim_codes = [add_codes for add_codes, _ in code_runs]
+        specs = self._bin_specs(request_data) if preaggregate is not None else {}
+        context = None
+        if df_processed is not None:
+            try:
+                context = prepare_owa_grouping_sets(
+                    df_processed, unique_years, product_name, additional_apply, code_runs[0][0], claim_codes=claim_codes
+                )
+            except Exception:
+                # Thiếu cột, kiểu dữ liệu lạ...: để OWA_func báo lỗi như cũ
+                context = None
+            available = self._code_columns_available(df_processed, request_data, code_runs)
+            if preaggregate is not None:
+                preaggregate.available = available
+        else:
+            available = preaggregate.available
+        # Chỉ mục năm cho các (combination, năm, code) phải gọi lại hàm gốc, tạo khi cần lần đầu
+        year_index = None
+
+        for idx, combination in enumerate(var_combinations, start=var_code_start):
+            job_progress(idx - var_code_start, len(var_combinations))
+            var_code = str(idx).zfill(3)
+            pivots = None
+            # Có dữ liệu thì biến _GROUP vẫn tính từ dữ liệu, histogram (tổng từ bucket) dành cho request không đọc dữ liệu
+            if preaggregate is not None and (df_processed is None or combination not in preaggregate.histograms):
+                try:
+                    pivots = preaggregate.owa_pivots(combination, specs.get(combination))
+                except Exception:
+                    pivots = None
+            if pivots is None:
+                try:
+                    pivots = OWA_grouping_set_pivots(context, combination) if context is not None else {}
+                except Exception:
+                    pivots = {}
+                if preaggregate is not None and df_processed is not None:
+                    self._update_preaggregate(
+                        preaggregate, df_processed, request_data, combination, pivots, unique_years, claim_codes, specs
+                    )
+
+            for pol_year in unique_years:
+                for run_index, (add_codes, add_desc) in enumerate(code_runs):
+                    try:
+                        if int(pol_year) in pivots and available[run_index]:
+                            dftemp = finalize_owa_table(
+                                select_code_pivot(pivots[int(pol_year)], [combination], product_name, additional_apply, add_codes),
+                                int(pol_year),
+                                combination,
+                                var_code,
+                                product_name,
+                                additional_apply,
+                                add_codes,
+                                add_desc
+                            )
+                        else:
+                            year_index = year_index or self._year_index(df_processed, request_data)
+                            dftemp = self._call_owa_func(
+                                pol_year, df_processed, combination, var_code, request_data, add_codes, add_desc,
+                                year_index=year_index
+                            )
+                    except Exception as e:
+                        raise HTTPException(
+                            status_code=409,
+                            detail=f"Error in combination '{combination}' for year '{pol_year}': {str(e)}"
+                        )
+                    sinks[run_index].append(dftemp)
+
+    @staticmethod
+    def _update_preaggregate(preaggregate, df_processed, request_data, combination, pivots, unique_years, claim_codes, specs):
+        """Ghi pivot của biến thường / dựng histogram của biến _GROUP vào preaggregate để request sau dùng lại"""
+        if combination in request_data['var_category_cols']:
+            # Pivot của biến _GROUP phụ thuộc thiết lập bin → lưu histogram theo giá trị gốc thay vì pivot
+            if combination in preaggregate.histograms or combination not in specs:
+                return
+            try:
+                preaggregate.histograms[combination] = BinHistogram(
+                    df_processed, combination, unique_years, request_data['product_name'],
+                    request_data['additional_apply'], claim_codes[0], claim_codes
+                )
+            except Exception as e:
+                print(f"⚠️ Could not build histogram of {combination}: {e}")
+        elif pivots:
+            preaggregate.pivots[combination] = pivots
+
+    def _process_cube_analysis(self, df_processed, request_data, analysis_func, var_combinations, code_runs, sinks,
+                               var_code_start=1):
+        """
+        2WA / 3WA / 4WA qua GLMCube: dữ liệu chỉ được quét một lần để dựng cube (cell chứa cột của mọi additional code),
+        mỗi tổ hợp biến được suy ra bằng cách gộp cell (số đếm chính xác, tổng float trong rtol 1e-9 so với hàm gốc).
+        (tổ hợp, năm, code) nào cube không suy ra được thì gọi lại hàm gốc.
+        """
+        unique_years = self._resolve_cal_years(request_data['var_cal_year'])
+        product_name = request_data['product_name']
+        additional_apply = request_data['additional_apply'] if request_data['additional_apply'] else False
+        dims = [col for combination in var_combinations for col in combination]
+        try:
+            cube = GLMCube(
+                df_processed, dims, unique_years, product_name, additional_apply, code_runs[0][0] or "",
+                claim_codes=[add_codes for add_codes, _ in code_runs]
+            )
+        except Exception:
+            # Thiếu cột, kiểu dữ liệu lạ...: để hàm gốc báo lỗi như cũ
+            cube = None
+        available = self._code_columns_available(df_processed, request_data, code_runs)
+        # Chỉ mục năm cho các (combination, năm, code) phải gọi lại hàm gốc, tạo khi cần lần đầu
+        year_index = None
+
+        for idx, combination in enumerate(var_combinations, start=var_code_start):
+            job_progress(idx - var_code_start, len(var_combinations))
+            var_code = str(idx).zfill(3)
+            try:
+                pivots = cube.pivots(combination) if cube is not None else {}
+            except Exception:
+                pivots = {}
+
+            for pol_year in unique_years:
+                for run_index, (add_codes, add_desc) in enumerate(code_runs):
+                    try:
+                        if int(pol_year) in pivots and available[run_index]:
+                            dftemp = finalize_multiway_table(
+                                select_code_pivot(pivots[int(pol_year)], combination, product_name, additional_apply, add_codes or ""),
+                                int(pol_year),
+                                list(combination),
+                                var_code,
+                                product_name,
+                                additional_apply,
+                                add_codes or "",
+                                add_desc or ""
+                            )
+                        else:
+                            year_index = year_index or self._year_index(df_processed, request_data)
+                            dftemp = analysis_func(
+                                pol_year, df_processed, combination, var_code, request_data, add_codes, add_desc,
+                                year_index=year_index
+                            )
+                    except Exception as e:
+                        raise HTTPException(
+                            status_code=409,
+                            detail=f"Error in combination '{' & '.join(combination)}' for year '{pol_year}': {str(e)}"
+                        )
+                    sinks[run_index].append(dftemp)
+
+    def _call_owa_func(self, pol_year, df_processed, combination, var_code, request_data, add_codes=None, add_desc=None,
+                       year_index=None):
         """Helper function để gọi OWA_func"""
         return OWA_func(
             int(pol_year),
@@ -1160,10 +1625,12 @@ class GLMAnalysis:
             request_data['product_name'],
             request_data['additional_apply'],
             add_codes,
-            add_desc
+            add_desc,
+            year_index
         )
 
-    def _call_twa_func(self, pol_year, df_processed, combination, var_code, request_data, add_codes=None, add_desc=None):
+    def _call_twa_func(self, pol_year, df_processed, combination, var_code, request_data, add_codes=None, add_desc=None,
+                       year_index=None):
         """Helper function để gọi TWA_func"""
         return TWA_func(
             int(pol_year),
@@ -1174,10 +1641,12 @@ class GLMAnalysis:
             request_data['product_name'],
             request_data['additional_apply'] if request_data['additional_apply'] else False,
             add_codes or "",
-            add_desc or ""
+            add_desc or "",
+            year_index
         )
 
-    def _call_threeway_func(self, pol_year, df_processed, combination, var_code, request_data, add_codes=None, add_desc=None):
+    def _call_threeway_func(self, pol_year, df_processed, combination, var_code, request_data, add_codes=None, add_desc=None,
+                            year_index=None):
         """Helper function để gọi threeway_func"""
         return threeway_func(
             int(pol_year),
@@ -1189,10 +1658,12 @@ class GLMAnalysis:
             request_data['product_name'],
             request_data['additional_apply'] if request_data['additional_apply'] else False,
             add_codes or "",
-            add_desc or ""
+            add_desc or "",
+            year_index
         )
 
-    def _call_fourway_func(self, pol_year, df_processed, combination, var_code, request_data, add_codes=None, add_desc=None):
+    def _call_fourway_func(self, pol_year, df_processed, combination, var_code, request_data, add_codes=None, add_desc=None,
+                           year_index=None):
         """Helper function để gọi fourway_func"""
         return fourway_func(
             int(pol_year),
@@ -1205,7 +1676,8 @@ class GLMAnalysis:
             request_data['product_name'],
             request_data['additional_apply'] if request_data['additional_apply'] else False,
             add_codes or "",
-            add_desc or ""
+            add_desc or "",
+            year_index
         )
 
     def _generate_combinations(self, var_cols, n_way):
@@ -1217,93 +1689,208 @@ class GLMAnalysis:
         else:
             return list(combinations(var_cols, n_way))
 
-    def _process_multiple_codes_analysis(self, df_processed, request_data, analysis_func, var_combinations, analysis_type):
-        """Helper function để xử lý analysis với multiple additional codes"""
-        table_detail = []
-        
+    @staticmethod
+    def _code_runs(request_data) -> list:
+        """[(add_codes, add_desc)] của request: mỗi additional code một bảng, cuối cùng là bảng tổng hợp (ALLBENE / AC00)"""
         if request_data['additional_apply'] and request_data['additional_codes']:
-            # Có additional codes
-            for add_codes, add_desc in zip(request_data['additional_codes'], request_data['additional_descriptions']):
-                df_final = self._process_analysis_generic(
-                    df_processed, request_data, analysis_func, var_combinations, add_codes, add_desc
-                )
-                
-                save_result = self._generate_table_name_and_save(
-                    df_final,
-                    request_data['parquet_url'],
-                    request_data['user_name'],
-                    request_data['name_func'],
-                    request_data['product_name'],
-                    analysis_type,
-                    request_data['additional_apply'],
-                    add_codes
-                )
-                table_detail.append(save_result['table_detail_name'])
+            # Có additional codes: bảng của mọi code được tính cùng lúc, thêm bảng tổng hợp cho ALLBENE
+            code_runs = list(zip(request_data['additional_codes'], request_data['additional_descriptions']))
+            code_runs.append((None, None))
+        else:
+            # Không có additional codes
+            code_runs = [(None, None)]
+        return code_runs
 
-            # Thêm bảng tổng hợp cho ALLBENE
-            df_final = self._process_analysis_generic(
-                df_processed, request_data, analysis_func, var_combinations, None, None
-            )
+    def _analysis_settings(self, request_data, var_combinations) -> Optional[dict]:
+        """
+        Thiết lập ảnh hưởng tới bảng kết quả, chuẩn hoá (bin 'Infinity' / inf, tuple / list) để so sánh ổn định.
+        None nếu không chuẩn hoá được (thiết lập lạ: phân tích vẫn chạy và báo lỗi như cũ nếu có).
+        """
+        try:
+            return {
+                'product_name': request_data['product_name'],
+                'user_name': request_data['user_name'],
+                'name_func': request_data['name_func'],
+                'additional_apply': request_data['additional_apply'],
+                'var_single_cols': list(request_data['var_single_cols']),
+                'var_info': list(request_data['var_info']),
+                'var_category_settings': [list(parse_bin_setting(setting)) for setting in request_data['var_category_settings']],
+                'var_combinations': [
+                    combination if isinstance(combination, str) else list(combination) for combination in var_combinations
+                ],
+                'cal_years': self._resolve_cal_years(request_data['var_cal_year']),
+            }
+        except Exception:
+            return None
+
+    def _cached_results(self, request_data, var_combinations, analysis_type) -> tuple:
+        """
+        (cache keys, entries) theo từng code của _code_runs (xem GLMResultCache): entry None nếu chưa có bảng.
+        Chỉ dùng cache khi file nguồn nằm trên storage (có ETag làm phiên bản dữ liệu).
+        """
+        code_runs = self._code_runs(request_data)
+        no_cache = ([None] * len(code_runs), [None] * len(code_runs))
+        if not glm_result_cache.enabled or not is_storage_url(request_data['parquet_url']):
+            return no_cache
+        settings = self._analysis_settings(request_data, var_combinations)
+        if settings is None:
+            return no_cache
+        try:
+            source = self._data_source(request_data['parquet_url'])
+        except Exception:
+            # Không nhận diện được file nguồn: tính như bình thường (và báo lỗi như cũ nếu có)
+            return no_cache
+        keys = [
+            glm_result_cache.make_key(source, settings, analysis_type, add_codes, add_desc)
+            for add_codes, add_desc in code_runs
+        ]
+        return keys, [glm_result_cache.lookup(key) for key in keys]
+
+    @staticmethod
+    def _cached_response(entries: list) -> tuple:
+        """(table_detail, s3_key, sub_folder) như _process_multiple_codes_analysis, từ các entry của cache"""
+        return [entry['table_detail_name'] for entry in entries], entries[-1]['s3_key'], entries[-1]['sub_folder']
+
+    def _process_multiple_codes_analysis(self, df_processed, request_data, analysis_func, var_combinations, analysis_type,
+                                         preaggregate=None, cached=None):
+        """
+        Helper function để xử lý analysis với multiple additional codes.
+        Bảng của mỗi code được stream lên storage trong lúc phân tích (ParquetResultSink), không gom cả bảng trong RAM.
+        :param preaggregate: OWAPreaggregate của 1WA (xem _owa_preaggregate)
+        :param cached: (cache keys, entries) của _cached_results: code đã có bảng thì không tính lại,
+            bảng vừa tính được ghi vào cache
+        """
+        code_runs = self._code_runs(request_data)
+        cache_keys, entries = cached or ([None] * len(code_runs), [None] * len(code_runs))
+        settings = self._analysis_settings(request_data, var_combinations)
+        settings_digest = make_cache_key(settings)[:10] if settings is not None else None
 
-            save_result = self._generate_table_name_and_save(
-                df_final,
+        save_results = [
+            self._generate_table_name(
                 request_data['parquet_url'],
                 request_data['user_name'],
                 request_data['name_func'],
                 request_data['product_name'],
                 analysis_type,
-                False,
-                ""
-            )
-            table_detail.append(save_result['table_detail_name'])
-        else:
-            # Không có additional codes
-            df_final = self._process_analysis_generic(
-                df_processed, request_data, analysis_func, var_combinations
+                add_codes is not None,
+                add_codes or "",
+                settings_digest
             )
-            
-            save_result = self._generate_table_name_and_save(
-                df_final,
-                request_data['parquet_url'],
-                request_data['user_name'],
-                request_data['name_func'],
-                request_data['product_name'],
-                analysis_type,
-                False,
-                ""
+            for add_codes, _ in code_runs
+        ]
+        # 1WA có preaggregate vẫn tính mọi code để pivot / histogram giữ cột của tất cả các code
+        pending = [i for i, entry in enumerate(entries) if entry is None or preaggregate is not None]
+
+        sinks = []
+        try:
+            lineage = [source_lineage(request_data['parquet_url'])]
+            for i in pending:
+                sinks.append(ParquetResultSink(save_results[i]['s3_key'], profile="analysis_result", lineage=lineage))
+            # Một lần aggregate cho mọi code (kể cả ALLBENE), từng bảng con được append vào file của code đó
+            self._process_analysis_codes(
+                df_processed, request_data, analysis_func, var_combinations, [code_runs[i] for i in pending], sinks=sinks,
+                preaggregate=preaggregate
             )
-            table_detail.append(save_result['table_detail_name'])
+        except Exception as e:
+            # Huỷ các file đang ghi dở để không để lại kết quả thiếu trên storage
+            for sink in sinks:
+                sink.abort()
+            if isinstance(e, HTTPException):
+                raise
+            raise HTTPException(status_code=500, detail=f"Error generating table name or saving: {str(e)}")
+
+        # Hoàn tất các file (phần cuối + footer) song song
+        writer = ParquetArtifactWriter()
+        for i, sink in zip(pending, sinks):
+            writer.submit_sink(save_results[i]['table_detail_name'], sink)
+        try:
+            ParquetArtifactWriter.raise_for_errors(writer.results())
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error generating table name or saving: {str(e)}")
+        stored = [i for i in pending if cache_keys[i] is not None]
+        for i in stored:
+            glm_result_cache.store(cache_keys[i], save_results[i])
+        if stored:
+            try:
+                glm_result_cache.prune(self._data_source(request_data['parquet_url']))
+            except Exception as e:
+                print(f"⚠️ Could not prune GLM result cache: {e}")
 
-        return table_detail, save_result['s3_key'], save_result['sub_folder']
+        table_detail = [save_result['table_detail_name'] for save_result in save_results]
+        return table_detail, save_results[-1]['s3_key'], save_results[-1]['sub_folder']
 
     # Main service methods
+    async def invalidate_result_cache(self, table_name: str) -> dict:
+        """
+        Xoá các bảng kết quả đã cache (mọi loại phân tích, mọi thiết lập) của một file dữ liệu.
+        table_name: URL (signed / s3://) của file trong bucket hoặc S3 key (report-software/glm/...)
+        """
+        if is_storage_url(table_name):
+            parquet_key = extract_parquet_key(table_name)
+        elif not urlparse(table_name).scheme and table_name.strip("/"):
+            parquet_key = table_name.strip().lstrip("/")
+        else:
+            raise HTTPException(status_code=400, detail="Result cache only applies to files on storage")
+        invalidated = await run_io(glm_result_cache.invalidate_source, parquet_key, timeout=STORAGE_WRITE_TIMEOUT,
+                                   operation="invalidate GLM result cache")
+        return {
+            "status": True,
+            "message": f"Invalidated {invalidated} cached result tables",
+            "data": {"s3_key": parquet_key, "invalidated": invalidated},
+        }
+
+    async def submit_job(self, analysis_type, request_body):
+        """
+        Chạy GLM 1WA / 2WA / 3WA / 4WA dưới dạng job (modules.jobs): trả về bản ghi job (job_id) ngay,
+        trạng thái / tiến độ / kết quả lấy qua /jobs/{job_id}
+        """
+        analysis_funcs = {"1WA": self._glm_1wa, "2WA": self._glm_2wa, "3WA": self._glm_3wa, "4WA": self._glm_4wa}
+        kind = f"glm_{analysis_type.lower()}"
+        # submit ghi bản ghi job lên storage → chạy trên IO executor (giới hạn + timeout như các thao tác storage khác)
+        return await run_io(
+            job_manager.submit, kind, analysis_funcs[analysis_type], request_body,
+            dedupe_key=request_key(kind, request_body), timeout=STORAGE_WRITE_TIMEOUT, operation="submit job"
+        )
+
     async def glm_1wa(self, request_body):
         """GLM 1-Way Analysis"""
+        # Đọc / phân tích / upload đều blocking → chạy trên CPU executor để không chặn event loop
+        return await run_cpu(self._glm_1wa, request_body)
+
+    def _glm_1wa(self, request_body):
         start_time = datetime.now()
 
         # Đoạn 1: Extract và validate request
         request_data = self._extract_and_validate_request(request_body)
 
-        # Đoạn 2: Đọc file parquet
-        df = self._read_parquet_data(
-            request_data['parquet_url'],
-            request_data['var_info'],
-            request_data['var_bf_category_cols'],
-            request_data['var_single_cols'],
-            request_data['additional_apply'],
-            request_data['additional_codes']
-        )
-
-        # Đoạn 3: Xử lý category columns
-        df_processed = self._process_category_columns(df, request_data['var_category_settings'], request_data['product_name'])
-
-        # Đoạn 4: Tạo combinations và perform analysis
         var_cols = list(request_data['var_category_cols']) + request_data['var_single_cols']
         var_combinations = self._generate_combinations(var_cols, 1)
-        
-        table_detail, s3_key, sub_folder = self._process_multiple_codes_analysis(
-            df_processed, request_data, self._call_owa_func, var_combinations, "1WA"
-        )
+
+        # Bảng kết quả đã tính trước đó trên cùng phiên bản dữ liệu và cùng thiết lập
+        cached = self._cached_results(request_data, var_combinations, "1WA")
+        # Pivot / histogram của các lần chạy 1WA trước trên cùng dữ liệu
+        preaggregate, preaggregate_key = (None, None) if all(cached[1]) else self._owa_preaggregate(request_data)
+        if all(cached[1]):
+            # Bảng của mọi code đều còn trên storage: trả về ngay, không đọc dữ liệu
+            table_detail, s3_key, sub_folder = self._cached_response(cached[1])
+        elif preaggregate is not None and preaggregate.covers(
+            var_combinations, self._bin_specs(request_data), self._resolve_cal_years(request_data['var_cal_year'])
+        ):
+            # Chỉ thiết lập bin thay đổi: suy bảng từ histogram, không đọc / quét lại dữ liệu
+            table_detail, s3_key, sub_folder = self._process_multiple_codes_analysis(
+                None, request_data, self._call_owa_func, var_combinations, "1WA", preaggregate=preaggregate,
+                cached=cached
+            )
+        else:
+            # Đoạn 2 + 3: Đọc file parquet và xử lý category columns (dùng lại từ cache nếu có)
+            with self._load_analysis_data(request_data, request_data['var_category_settings']) as df_processed:
+                # Đoạn 4: Perform analysis
+                table_detail, s3_key, sub_folder = self._process_multiple_codes_analysis(
+                    df_processed, request_data, self._call_owa_func, var_combinations, "1WA", preaggregate=preaggregate,
+                    cached=cached
+                )
+        if preaggregate is not None:
+            preaggregate_cache.put(preaggregate_key, preaggregate)
 
         # Return response
         return {
@@ -1320,31 +1907,30 @@ class GLMAnalysis:
 
     async def glm_2wa(self, request_body):
         """GLM 2-Way Analysis"""
+        # Đọc / phân tích / upload đều blocking → chạy trên CPU executor để không chặn event loop
+        return await run_cpu(self._glm_2wa, request_body)
+
+    def _glm_2wa(self, request_body):
         start_time = datetime.now()
 
         # Đoạn 1: Extract và validate request
         request_data = self._extract_and_validate_request(request_body)
 
-        # Đoạn 2: Đọc file parquet
-        df = self._read_parquet_data(
-            request_data['parquet_url'],
-            request_data['var_info'],
-            request_data['var_bf_category_cols'],
-            request_data['var_single_cols'],
-            request_data['additional_apply'],
-            request_data['additional_codes']
-        )
-
-        # Đoạn 3: Xử lý category columns
-        df_processed = self._process_category_columns(df, request_data['var_category_settings'], request_data['product_name'])
-
-        # Đoạn 4: Tạo combinations và perform analysis
         var_cols = list(request_data['var_category_cols']) + request_data['var_single_cols']
         var_combinations = self._generate_combinations(var_cols, 2)
-        
-        table_detail, s3_key, sub_folder = self._process_multiple_codes_analysis(
-            df_processed, request_data, self._call_twa_func, var_combinations, "2WA"
-        )
+
+        # Bảng kết quả đã tính trước đó trên cùng phiên bản dữ liệu và cùng thiết lập
+        cached = self._cached_results(request_data, var_combinations, "2WA")
+        if all(cached[1]):
+            # Bảng của mọi code đều còn trên storage: trả về ngay, không đọc dữ liệu
+            table_detail, s3_key, sub_folder = self._cached_response(cached[1])
+        else:
+            # Đoạn 2 + 3: Đọc file parquet và xử lý category columns (dùng lại từ cache nếu có)
+            with self._load_analysis_data(request_data, request_data['var_category_settings']) as df_processed:
+                # Đoạn 4: Perform analysis
+                table_detail, s3_key, sub_folder = self._process_multiple_codes_analysis(
+                    df_processed, request_data, self._call_twa_func, var_combinations, "2WA", cached=cached
+                )
 
         # Return response
         return {
@@ -1361,6 +1947,10 @@ class GLMAnalysis:
 
     async def glm_3wa(self, request_body):
         """GLM 3-Way Analysis"""
+        # Đọc / phân tích / upload đều blocking → chạy trên CPU executor để không chặn event loop
+        return await run_cpu(self._glm_3wa, request_body)
+
+    def _glm_3wa(self, request_body):
         start_time = datetime.now()
 
         # Đoạn 1: Extract và validate request
@@ -1383,28 +1973,24 @@ class GLMAnalysis:
         
         list_var_selected = [options[var].col for var in required_vars]
 
-        # Đoạn 2: Đọc file parquet
-        df = self._read_parquet_data(
-            request_data['parquet_url'],
-            request_data['var_info'],
-            request_data['var_bf_category_cols'],
-            request_data['var_single_cols'],
-            request_data['additional_apply'],
-            request_data['additional_codes']
-        )
-
-        # Đoạn 3: Xử lý category columns (chỉ cho selected columns)
-        df_processed = self._process_category_columns(df, 
-            [setting for setting in request_data['var_category_settings'] 
-            if list(setting.keys())[0] in list_var_selected], request_data['product_name']
-        )
-
-        # Đoạn 4: Perform analysis
+        # Đoạn 2 + 3: Đọc file parquet và xử lý category columns (chỉ cho selected columns, dùng lại từ cache nếu có)
+        selected_category_settings = [
+            setting for setting in request_data['var_category_settings']
+            if list(setting.keys())[0] in list_var_selected
+        ]
         var_combinations = [list_var_selected]  # Only one combination
-        
-        table_detail, s3_key, sub_folder = self._process_multiple_codes_analysis(
-            df_processed, request_data, self._call_threeway_func, var_combinations, "3WA"
-        )
+
+        # Bảng kết quả đã tính trước đó trên cùng phiên bản dữ liệu và cùng thiết lập
+        cached = self._cached_results(request_data, var_combinations, "3WA")
+        if all(cached[1]):
+            # Bảng của mọi code đều còn trên storage: trả về ngay, không đọc dữ liệu
+            table_detail, s3_key, sub_folder = self._cached_response(cached[1])
+        else:
+            with self._load_analysis_data(request_data, selected_category_settings) as df_processed:
+                # Đoạn 4: Perform analysis
+                table_detail, s3_key, sub_folder = self._process_multiple_codes_analysis(
+                    df_processed, request_data, self._call_threeway_func, var_combinations, "3WA", cached=cached
+                )
 
         # Return response
         return {
@@ -1421,6 +2007,10 @@ class GLMAnalysis:
 
     async def glm_4wa(self, request_body):
         """GLM 4-Way Analysis"""
+        # Đọc / phân tích / upload đều blocking → chạy trên CPU executor để không chặn event loop
+        return await run_cpu(self._glm_4wa, request_body)
+
+    def _glm_4wa(self, request_body):
         start_time = datetime.now()
 
         # Đoạn 1: Extract và validate request
@@ -1443,28 +2033,24 @@ class GLMAnalysis:
         
         list_var_selected = [options[var].col for var in required_vars]
 
-        # Đoạn 2: Đọc file parquet
-        df = self._read_parquet_data(
-            request_data['parquet_url'],
-            request_data['var_info'],
-            request_data['var_bf_category_cols'],
-            request_data['var_single_cols'],
-            request_data['additional_apply'],
-            request_data['additional_codes']
-        )
-
-        # Đoạn 3: Xử lý category columns (chỉ cho selected columns)
-        df_processed = self._process_category_columns(df, 
-            [setting for setting in request_data['var_category_settings'] 
-            if list(setting.keys())[0] in list_var_selected], request_data['product_name']
-        )
-
-        # Đoạn 4: Perform analysis
+        # Đoạn 2 + 3: Đọc file parquet và xử lý category columns (chỉ cho selected columns, dùng lại từ cache nếu có)
+        selected_category_settings = [
+            setting for setting in request_data['var_category_settings']
+            if list(setting.keys())[0] in list_var_selected
+        ]
         var_combinations = [list_var_selected]  # Only one combination
-        
-        table_detail, s3_key, sub_folder = self._process_multiple_codes_analysis(
-            df_processed, request_data, self._call_fourway_func, var_combinations, "4WA"
-        )
+
+        # Bảng kết quả đã tính trước đó trên cùng phiên bản dữ liệu và cùng thiết lập
+        cached = self._cached_results(request_data, var_combinations, "4WA")
+        if all(cached[1]):
+            # Bảng của mọi code đều còn trên storage: trả về ngay, không đọc dữ liệu
+            table_detail, s3_key, sub_folder = self._cached_response(cached[1])
+        else:
+            with self._load_analysis_data(request_data, selected_category_settings) as df_processed:
+                # Đoạn 4: Perform analysis
+                table_detail, s3_key, sub_folder = self._process_multiple_codes_analysis(
+                    df_processed, request_data, self._call_fourway_func, var_combinations, "4WA", cached=cached
+                )
 
         # Return response
         return {
@@ -1478,3 +2064,49 @@ class GLMAnalysis:
                 "table_detail_name": table_detail,
             }
         }
+
+class _FrameCollector:
+    """Sink trong RAM (cùng interface append với ParquetResultSink), ghép các bảng con một lần ở cuối"""
+
+    def __init__(self):
+        self.frames = []
+
+    def append(self, df: pd.DataFrame):
+        self.frames.append(df)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.concat(self.frames, axis=0) if self.frames else pd.DataFrame()
+
+def _analysis_batch_worker(path: str, start: int, var_combinations: list, request_data: dict, func_name: str, code_runs: list):
+    """
+    Chạy trong process của pool: phân tích một đoạn combination (bắt đầu ở vị trí `start`) trên dữ liệu
+    chia sẻ qua Arrow IPC. Bảng kết quả của từng code được ghi thành file Arrow IPC cạnh file dữ liệu
+    (GLM_SHARED_DATA_DIR) và trả về đường dẫn, không pickle DataFrame qua pipe của pool; bảng rỗng → None,
+    bảng không chuyển được sang Arrow thì trả về chính DataFrame.
+    HTTPException tạo bằng keyword không unpickle được ở process chính (làm hỏng cả pool)
+    nên được trả về dạng ("error", status, detail).
+    """
+    analysis = GLMAnalysis()
+    df_processed = load_shared_frame(path)
+    try:
+        frames = analysis._process_analysis_codes(
+            df_processed, request_data, getattr(analysis, func_name), var_combinations, code_runs,
+            var_code_start=start + 1, allow_parallel=False
+        )
+    except HTTPException as e:
+        return ("error", e.status_code, e.detail)
+
+    items = []
+    try:
+        for df in frames:
+            if df.empty:
+                items.append(None)
+                continue
+            try:
+                items.append(write_arrow_file(df, os.path.dirname(path))[0])
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                items.append(df)
+    except BaseException:
+        remove_files([item for item in items if isinstance(item, str)])
+        raise
+    return ("ok", items)
@@ -1,10 +1,7 @@
-from modules.db_parquet import cfg, upload_to_s3
+from modules.db_parquet import cfg, write_parquet_to_s3_async
 from config.google_sheets_config import google_sheets_config
 from fastapi import HTTPException
 import pandas as pd
-import pyarrow as pa
-import pyarrow.parquet as pq
-import io
 from datetime import datetime
 import gspread
 
@@ -49,18 +46,11 @@ class GoogleSheetsService:
             # Chuyển đổi sang DataFrame
             df = pd.DataFrame(data)
             
-            # Tạo file parquet trong memory
-            parquet_buffer = io.BytesIO()
-            table = pa.Table.from_pandas(df)
-            pq.write_table(table, parquet_buffer)
-            parquet_buffer.seek(0)
-            
-            # Upload lên S3
-            upload_result = await upload_to_s3(
-                file_obj=parquet_buffer,
-                key=s3_key,
-                content_type="application/octet-stream"
+            # Ghi parquet và stream thẳng lên S3
+            await write_parquet_to_s3_async(
+                df, s3_key, profile="small_report", lineage=[f"gsheet://{spreadsheet_id}/{worksheet_name}"]
             )
+            upload_result = f"{cfg['ENDPOINT'].rstrip('/')}/{cfg['BUCKET']}/{s3_key}"
             
             return {
                 "status": "success",
@@ -0,0 +1,279 @@
+import os
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+import multiprocessing
+from collections import deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Optional
+import numpy as np
+from fastapi import HTTPException
+
+# Số thread tối đa cho storage I/O (S3 / local / parquet) trong một process
+IO_EXECUTOR_MAX_WORKERS = int(os.getenv("IO_EXECUTOR_MAX_WORKERS", 16))
+# Timeout (giây) theo loại thao tác storage
+STORAGE_HEAD_TIMEOUT = float(os.getenv("STORAGE_HEAD_TIMEOUT", 30))
+STORAGE_READ_TIMEOUT = float(os.getenv("STORAGE_READ_TIMEOUT", 300))
+STORAGE_WRITE_TIMEOUT = float(os.getenv("STORAGE_WRITE_TIMEOUT", 900))
+
+# Số process tối đa cho phân tích GLM (CPU-bound); mặc định bằng số core
+PROCESS_EXECUTOR_MAX_WORKERS = int(os.getenv("PROCESS_EXECUTOR_MAX_WORKERS", os.cpu_count() or 1))
+# spawn: process con không kế thừa thread / lock của server (fork từ process nhiều thread dễ bị treo)
+PROCESS_EXECUTOR_START_METHOD = os.getenv("PROCESS_EXECUTOR_START_METHOD", "spawn")
+
+# Số thread cho phần tính toán (pandas) của các endpoint nặng; các bước này còn chờ đọc / ghi storage nên mặc định
+# nhiều hơn số core một chút
+CPU_EXECUTOR_MAX_WORKERS = int(os.getenv("CPU_EXECUTOR_MAX_WORKERS", max(os.cpu_count() or 1, 4)))
+# Số request chạy đồng thời mặc định của một endpoint nặng, và giới hạn riêng dạng "glm_1wa=2,mof_pnt_bctcq=1"
+ENDPOINT_DEFAULT_CONCURRENCY = int(os.getenv("ENDPOINT_DEFAULT_CONCURRENCY", 2))
+ENDPOINT_CONCURRENCY = os.getenv("ENDPOINT_CONCURRENCY", "")
+# Số request tối đa được xếp hàng chờ của một endpoint; vượt quá thì trả về 503 ngay
+ENDPOINT_MAX_QUEUE = int(os.getenv("ENDPOINT_MAX_QUEUE", 16))
+# Số request gần nhất giữ lại để tính percentile thời gian chờ / chạy
+ENDPOINT_METRICS_WINDOW = int(os.getenv("ENDPOINT_METRICS_WINDOW", 1000))
+
+_io_executor = None
+_io_executor_lock = threading.Lock()
+_cpu_executor = None
+_cpu_executor_lock = threading.Lock()
+_process_executor = None
+_process_executor_lock = threading.Lock()
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """Thread pool dùng chung (bounded) cho storage I/O được gọi từ async endpoint"""
+    global _io_executor
+    if _io_executor is None:
+        with _io_executor_lock:
+            if _io_executor is None:
+                _io_executor = ThreadPoolExecutor(max_workers=IO_EXECUTOR_MAX_WORKERS, thread_name_prefix="storage-io")
+    return _io_executor
+
+class OperationCancelled(Exception):
+    """Thao tác storage bị huỷ (quá timeout của run_io / upload bị huỷ): writer abort thay vì commit object"""
+
+# Cờ huỷ của thao tác storage đang chạy trong thread (xem run_io / run_cancellable); writer của storage đọc khi được tạo
+_io_cancel: contextvars.ContextVar = contextvars.ContextVar("io_cancel", default=None)
+
+def io_cancel_event() -> Optional[threading.Event]:
+    """Cờ huỷ của thao tác storage hiện tại (None nếu không chạy qua run_io / run_cancellable)"""
+    return _io_cancel.get()
+
+def raise_if_cancelled(event: Optional[threading.Event] = None, operation: str = "storage operation"):
+    """Raise OperationCancelled nếu `event` (cờ lấy lúc tạo writer) hoặc cờ huỷ của thao tác đang chạy đã bật"""
+    for flag in (event, _io_cancel.get()):
+        if flag is not None and flag.is_set():
+            raise OperationCancelled(f"'{operation}' was cancelled")
+
+def run_cancellable(event: threading.Event, func: Callable, *args, **kwargs):
+    """Chạy func với cờ huỷ `event`: writer storage tạo trong func abort khi cờ được bật"""
+    context = contextvars.copy_context()
+    context.run(_io_cancel.set, event)
+    return context.run(func, *args, **kwargs)
+
+async def run_io(func: Callable, *args, timeout: Optional[float] = None, operation: Optional[str] = None, **kwargs):
+    """
+    Chạy hàm blocking (boto3, đọc / ghi parquet) trên IO executor để không chặn event loop.
+
+    Quá `timeout` giây thì trả về 504 cho client và bật cờ huỷ của thao tác: thread không dừng ngay được,
+    nhưng writer của storage (S3 multipart / file local / memory) kiểm tra cờ trước mỗi part và trước khi commit,
+    abort multipart upload / xoá file tạm, nên lần ghi đã trả 504 không xuất hiện trên storage.
+    """
+    loop = asyncio.get_running_loop()
+    cancel = threading.Event()
+    future = loop.run_in_executor(get_io_executor(), functools.partial(run_cancellable, cancel, func, *args, **kwargs))
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        cancel.set()
+        operation = operation or getattr(func, "__name__", "storage operation")
+        raise HTTPException(status_code=504, detail=f"'{operation}' timed out after {timeout:g} seconds and was cancelled")
+
+def get_process_executor() -> ProcessPoolExecutor:
+    """Process pool dùng chung (bounded) cho tính toán CPU-bound, tạo khi dùng lần đầu và giữ lại giữa các request"""
+    global _process_executor
+    if _process_executor is None:
+        with _process_executor_lock:
+            if _process_executor is None:
+                _process_executor = ProcessPoolExecutor(
+                    max_workers=PROCESS_EXECUTOR_MAX_WORKERS,
+                    mp_context=multiprocessing.get_context(PROCESS_EXECUTOR_START_METHOD),
+                )
+    return _process_executor
+
+def reset_process_executor(executor: Optional[ProcessPoolExecutor] = None):
+    """
+    Bỏ process pool hiện tại (ví dụ sau BrokenProcessPool khi một worker bị kill vì hết bộ nhớ);
+    lần gọi get_process_executor() tiếp theo sẽ tạo pool mới.
+    """
+    global _process_executor
+    with _process_executor_lock:
+        if executor is not None and executor is not _process_executor:
+            return
+        if _process_executor is not None:
+            _process_executor.shutdown(wait=False, cancel_futures=True)
+        _process_executor = None
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    """Thread pool dùng chung (bounded) cho các bước tính toán nặng được gọi từ async endpoint"""
+    global _cpu_executor
+    if _cpu_executor is None:
+        with _cpu_executor_lock:
+            if _cpu_executor is None:
+                _cpu_executor = ThreadPoolExecutor(max_workers=CPU_EXECUTOR_MAX_WORKERS, thread_name_prefix="cpu-work")
+    return _cpu_executor
+
+# Thời gian chờ CPU executor của request đang giữ slot endpoint (xem endpoint_slot)
+_slot_timing: contextvars.ContextVar = contextvars.ContextVar("endpoint_slot_timing", default=None)
+
+async def run_cpu(func: Callable, *args, **kwargs):
+    """
+    Chạy bước tính toán blocking (parse file, chuyển kiểu, pivot, lập báo cáo) trên CPU executor
+    để event loop vẫn phục vụ các endpoint nhẹ (/ping, trạng thái job) trong lúc đó.
+    """
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+    started = []
+
+    def call():
+        started.append(time.perf_counter())
+        return func(*args, **kwargs)
+
+    try:
+        # copy_context: contextvar của request (job đang chạy...) vẫn thấy được trong thread
+        return await loop.run_in_executor(get_cpu_executor(), contextvars.copy_context().run, call)
+    finally:
+        timing = _slot_timing.get()
+        if timing is not None:
+            timing["executor_wait"] += (started[0] if started else time.perf_counter()) - submitted
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+class EndpointLimiter:
+    """
+    Giới hạn số request chạy đồng thời của một endpoint nặng, hàng đợi tối đa `max_queue` request (đầy → 503),
+    kèm thống kê thời gian chờ (slot + CPU executor) và thời gian chạy của các request gần nhất.
+    Không gắn với một event loop cụ thể (job chạy coroutine trong event loop riêng của thread job).
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int = ENDPOINT_MAX_QUEUE):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self._waiters = deque()
+        self._queue_wait = deque(maxlen=ENDPOINT_METRICS_WINDOW)
+        self._run_time = deque(maxlen=ENDPOINT_METRICS_WINDOW)
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        with self._lock:
+            if self.running < self.concurrency and not self._waiters:
+                self.running += 1
+                return
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503, detail=f"'{self.name}' is busy, please retry later", headers={"Retry-After": "10"}
+                )
+            item = (asyncio.get_running_loop(), asyncio.get_running_loop().create_future())
+            self._waiters.append(item)
+        try:
+            await item[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if item in self._waiters:
+                    self._waiters.remove(item)
+                    raise
+            # Slot đã được chuyển cho request này trước khi nó bị huỷ: trả lại cho request tiếp theo
+            self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                # Chuyển slot thẳng cho request chờ lâu nhất (running giữ nguyên)
+                loop, waiter = self._waiters.popleft()
+                loop.call_soon_threadsafe(_wake, waiter)
+            else:
+                self.running -= 1
+
+    def record(self, queue_wait: float, run_time: float):
+        with self._lock:
+            self.completed += 1
+            self._queue_wait.append(queue_wait)
+            self._run_time.append(run_time)
+
+    def stats(self) -> dict:
+        with self._lock:
+            queue_wait, run_time = list(self._queue_wait), list(self._run_time)
+            stats = {
+                "concurrency": self.concurrency,
+                "running": self.running,
+                "queued": len(self._waiters),
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+        for key, samples in (("queue_wait_seconds", queue_wait), ("run_seconds", run_time)):
+            stats[key] = {
+                "p50": float(np.percentile(samples, 50)),
+                "p95": float(np.percentile(samples, 95)),
+                "p99": float(np.percentile(samples, 99)),
+                "max": float(max(samples)),
+            } if samples else None
+        return stats
+
+def _parse_concurrency(setting: str) -> dict:
+    limits = {}
+    for item in setting.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            limits[name.strip()] = max(int(value), 1)
+    return limits
+
+_endpoint_concurrency = _parse_concurrency(ENDPOINT_CONCURRENCY)
+_endpoint_limiters = {}
+_endpoint_limiters_lock = threading.Lock()
+
+def get_endpoint_limiter(name: str) -> EndpointLimiter:
+    with _endpoint_limiters_lock:
+        if name not in _endpoint_limiters:
+            concurrency = _endpoint_concurrency.get(name, ENDPOINT_DEFAULT_CONCURRENCY)
+            _endpoint_limiters[name] = EndpointLimiter(name, concurrency)
+        return _endpoint_limiters[name]
+
+@asynccontextmanager
+async def endpoint_slot(name: str):
+    """
+    Giữ một slot của endpoint `name` trong lúc xử lý request (chờ nếu endpoint đang chạy đủ số request,
+    503 nếu hàng đợi đầy). Thời gian chờ slot + chờ CPU executor được tính là queue wait, phần còn lại là run time.
+    """
+    limiter = get_endpoint_limiter(name)
+    queued = time.perf_counter()
+    await limiter.acquire()
+    started = time.perf_counter()
+    timing = {"executor_wait": 0.0}
+    token = _slot_timing.set(timing)
+    try:
+        yield
+    finally:
+        _slot_timing.reset(token)
+        limiter.release()
+        finished = time.perf_counter()
+        limiter.record(started - queued + timing["executor_wait"], finished - started - timing["executor_wait"])
+
+def endpoint_stats() -> dict:
+    """Thống kê của các endpoint nặng và CPU executor (cho /metrics/executors)"""
+    with _endpoint_limiters_lock:
+        limiters = list(_endpoint_limiters.values())
+    return {
+        "cpu_executor_max_workers": CPU_EXECUTOR_MAX_WORKERS,
+        "endpoints": {limiter.name: limiter.stats() for limiter in limiters},
+    }
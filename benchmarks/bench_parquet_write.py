@@ -0,0 +1,71 @@
+"""
+So sánh các profile ghi parquet (modules.parquet_writer.PARQUET_WRITE_PROFILES) trên dữ liệu thật:
+dung lượng file, tốc độ ghi và tốc độ đọc.
+
+Chạy từ thư mục gốc repo: python benchmarks/bench_parquet_write.py <file.parquet hoặc S3 key> [...]
+"""
+import io
+import os
+import sys
+import time
+from typing import Optional
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from modules.parquet_writer import PARQUET_WRITE_PROFILES, write_parquet
+
+def benchmark_write_profiles(df: pd.DataFrame, profiles: Optional[list] = None, repeat: int = 3) -> pd.DataFrame:
+    """
+    So sánh các profile trên một DataFrame thật: dung lượng file, tốc độ ghi và tốc độ đọc (ghi/đọc trong bộ nhớ).
+    Thời gian lấy giá trị nhỏ nhất sau `repeat` lần chạy.
+    """
+    profiles = profiles or list(PARQUET_WRITE_PROFILES)
+    data_mb = df.memory_usage(deep=True).sum() / 1024 / 1024
+    rows = []
+    for profile in profiles:
+        write_times, read_times = [], []
+        for _ in range(repeat):
+            buffer = io.BytesIO()
+            start = time.perf_counter()
+            try:
+                write_parquet(df, buffer, profile=profile)
+            except pa.ArrowInvalid:
+                # Ví dụ coerce_timestamps='ms' làm mất dữ liệu ns → ghi như các nơi gọi đang fallback
+                buffer = io.BytesIO()
+                write_parquet(df, buffer, profile=profile, coerce_timestamps=None)
+            write_times.append(time.perf_counter() - start)
+
+            buffer.seek(0)
+            start = time.perf_counter()
+            pq.read_table(buffer).to_pandas()
+            read_times.append(time.perf_counter() - start)
+
+        file_mb = buffer.getbuffer().nbytes / 1024 / 1024
+        rows.append({
+            "profile": profile,
+            "rows": len(df),
+            "file_mb": round(file_mb, 3),
+            "ratio": round(data_mb / file_mb, 2) if file_mb else None,
+            "write_s": round(min(write_times), 4),
+            "write_mb_s": round(data_mb / min(write_times), 1),
+            "read_s": round(min(read_times), 4),
+            "read_mb_s": round(data_mb / min(read_times), 1),
+        })
+    return pd.DataFrame(rows)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python benchmarks/bench_parquet_write.py <parquet path or S3 key> [...]")
+        sys.exit(1)
+
+    for source in sys.argv[1:]:
+        if os.path.exists(source):
+            df_source = pd.read_parquet(source)
+        else:
+            from modules.db_parquet import read_parquet_from_s3
+            df_source = read_parquet_from_s3(source)
+        print(f"\n📊 {source}: {len(df_source)} rows, {len(df_source.columns)} columns")
+        print(benchmark_write_profiles(df_source).to_string(index=False))
@@ -0,0 +1,73 @@
+"""
+Benchmark calculate_pivot_tables: pandas.pivot_table và kernel NumPy (modules.GLM.glm_kernel) trên danh mục giả lập.
+
+Chạy từ thư mục gốc repo: python benchmarks/bench_pivot_kernel.py [số dòng ...]
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from modules.GLM.glm_kernel import aggregate_pivot_tables
+from modules.GLM.glm_varb_analysis import calculate_pivot_tables_pandas
+
+def synthetic_portfolio(n_rows: int, n_policies: int = None, seed: int = 0) -> pd.DataFrame:
+    """Danh mục CAR giả lập cho benchmark: ~3 dòng mỗi hợp đồng, 2 biến category và 2 biến thường"""
+    rng = np.random.default_rng(seed)
+    n_policies = n_policies or max(n_rows // 3, 1)
+    df = pd.DataFrame({
+        'CAL_YEAR': rng.integers(2016, 2021, n_rows).astype(np.uint16),
+        # Mã hợp đồng dạng chuỗi như dữ liệu import (các dòng cùng hợp đồng dùng chung một object)
+        'POLICY_ID': pd.Categorical.from_codes(
+            rng.integers(0, n_policies, n_rows), categories=[f"P{i:09d}" for i in range(n_policies)]
+        ).astype(object),
+        'VEHICLE_VALUE': rng.random(n_rows) * 2e9,
+        'EXPOSURE_YEAR': rng.random(n_rows),
+        'EXPOSURE_PREM': rng.random(n_rows) * 1e7,
+        'NUM_CLAIMS': rng.integers(0, 3, n_rows),
+        'CLAIM_PMT': rng.random(n_rows) * 1e8,
+    })
+    df['VEHICLE_VALUE_GROUP'] = pd.cut(df['VEHICLE_VALUE'], bins=[0, 5e8, 1e9, 1.5e9, 2e9],
+                                       labels=['01', '02', '03', '04'], include_lowest=True)
+    df['VEHICLE_AGE_GROUP'] = pd.Categorical.from_codes(rng.integers(0, 8, n_rows), categories=[f"{i:02d}" for i in range(8)])
+    df['BRAND'] = pd.Categorical.from_codes(rng.integers(0, 30, n_rows), categories=[f"BRAND_{i:02d}" for i in range(30)]).astype(object)
+    df['REGION'] = rng.integers(0, 64, n_rows)
+    return df
+
+def benchmark_pivot_kernel(row_counts=(1_000_000, 10_000_000, 50_000_000),
+                           byvar_sets=(['BRAND'], ['VEHICLE_VALUE_GROUP', 'BRAND'], ['VEHICLE_AGE_GROUP', 'BRAND', 'REGION']),
+                           repeat: int = 1) -> pd.DataFrame:
+    """So sánh thời gian calculate_pivot_tables bản pandas.pivot_table và kernel NumPy trên danh mục giả lập"""
+    columns = ('POLICY_ID', 'NUM_CLAIMS', 'CLAIM_PMT', 'VEHICLE_VALUE')
+    rows = []
+    for n_rows in row_counts:
+        df = synthetic_portfolio(n_rows)
+        for byvars in byvar_sets:
+            timings = {}
+            results = {}
+            for name, func in (("pivot_table", calculate_pivot_tables_pandas), ("kernel", aggregate_pivot_tables)):
+                best = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    results[name] = func(df, byvars, *columns)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[name] = best
+            pd.testing.assert_frame_equal(results["pivot_table"], results["kernel"], check_exact=False, rtol=1e-9)
+            rows.append({
+                "rows": n_rows,
+                "byvars": " & ".join(byvars),
+                "groups": len(results["kernel"]),
+                "pivot_table_s": round(timings["pivot_table"], 3),
+                "kernel_s": round(timings["kernel"], 3),
+                "speedup": round(timings["pivot_table"] / timings["kernel"], 1),
+            })
+        del df
+    return pd.DataFrame(rows)
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [1_000_000, 10_000_000, 50_000_000]
+    print(benchmark_pivot_kernel(counts).to_string(index=False))
@@ -15,6 +15,10 @@ load_dotenv()
 
 # Lấy base URL cho FastAPI từ biến môi trường, nếu không có thì sử dụng localhost mặc định
 FASTAPI_BASE = os.getenv("FASTAPI_BASE", "http://127.0.0.1:8000")
+# Thời gian tối đa (giây) tool chờ một job phân tích / báo cáo; quá thời gian thì trả về trạng thái job để hỏi lại sau
+MCP_JOB_WAIT_SECONDS = float(os.getenv("MCP_JOB_WAIT_SECONDS", 300))
+# Khoảng thời gian (giây) giữa hai lần hỏi trạng thái job
+MCP_JOB_POLL_SECONDS = float(os.getenv("MCP_JOB_POLL_SECONDS", 2))
 
 # Khởi tạo server mcp với tên "mcp-export-tools"
 server = Server(name="mcp-export-tools")
@@ -37,6 +41,20 @@ async def _get(path: str, params: dict | None = None):
         r.raise_for_status()  # Kiểm tra nếu có lỗi HTTP, raise exception
         return r.json()  # Trả về kết quả JSON
 
+# Hàm chạy tính toán dài dưới dạng job: submit, hỏi trạng thái định kỳ rồi lấy kết quả
+async def _run_job(path: str, payload: dict):
+    """Submit job tới endpoint `<path>jobs/`, chờ job xong (tối đa MCP_JOB_WAIT_SECONDS) và trả về kết quả"""
+    job = await _post_json(path + "jobs/", payload)  # Nhận job_id ngay, không giữ kết nối trong lúc tính toán
+    deadline = asyncio.get_running_loop().time() + MCP_JOB_WAIT_SECONDS  # Thời điểm ngừng chờ
+    while job["status"] in ("queued", "running"):
+        if asyncio.get_running_loop().time() >= deadline:
+            return job  # Job vẫn đang chạy: trả về trạng thái (job_id, progress) để gọi job_status / job_result sau
+        await asyncio.sleep(MCP_JOB_POLL_SECONDS)  # Chờ trước khi hỏi lại
+        job = await _get(f"/jobs/{job['job_id']}")  # Lấy trạng thái / tiến độ mới nhất
+    if job["status"] == "cancelled":
+        return job  # Job đã bị huỷ, không có kết quả
+    return await _get(f"/jobs/{job['job_id']}/result")  # Kết quả (job lỗi → HTTP lỗi như endpoint đồng bộ)
+
 # Định nghĩa các công cụ mà server sẽ cung cấp, công cụ này giúp chatbot tương tác với các API của FastAPI
 
 @server.tool("ping")
@@ -65,25 +83,25 @@ async def tool_glm_import_after_mapping(request_json: str) -> str:
 async def tool_glm_1wa(request_json: str) -> str:
     """GLM: Thực hiện phép toán 1WA"""
     payload = json.loads(request_json)
-    return json.dumps(await _post_json("/glm/glm-1wa/", payload))
+    return json.dumps(await _run_job("/glm/glm-1wa/", payload))
 
 @server.tool("glm_2wa")
 async def tool_glm_2wa(request_json: str) -> str:
     """GLM: Thực hiện phép toán 2WA"""
     payload = json.loads(request_json)
-    return json.dumps(await _post_json("/glm/glm-2wa/", payload))
+    return json.dumps(await _run_job("/glm/glm-2wa/", payload))
 
 @server.tool("glm_3wa")
 async def tool_glm_3wa(request_json: str) -> str:
     """GLM: Thực hiện phép toán 3WA"""
     payload = json.loads(request_json)
-    return json.dumps(await _post_json("/glm/glm-3wa/", payload))
+    return json.dumps(await _run_job("/glm/glm-3wa/", payload))
 
 @server.tool("glm_4wa")
 async def tool_glm_4wa(request_json: str) -> str:
     """GLM: Thực hiện phép toán 4WA"""
     payload = json.loads(request_json)
-    return json.dumps(await _post_json("/glm/glm-4wa/", payload))
+    return json.dumps(await _run_job("/glm/glm-4wa/", payload))
 
 @server.tool("mof_valid_data")
 async def tool_mof_valid_data(request_json: str) -> str:
@@ -101,13 +119,28 @@ async def tool_mof_import_after_mapping(request_json: str) -> str:
 async def tool_mof_pnt_11(request_json: str) -> str:
     """MOF: Tổng hợp dữ liệu PNT-11"""
     payload = json.loads(request_json)
-    return json.dumps(await _post_json("/mof-report/mof-pnt-11/", payload))
+    return json.dumps(await _run_job("/mof-report/mof-pnt-11/", payload))
 
 @server.tool("mof_bctcq")
 async def tool_mof_bctcq(request_json: str) -> str:
     """MOF: Lập báo cáo tài chính tổng hợp"""
     payload = json.loads(request_json)
-    return json.dumps(await _post_json("/mof-report/mof-pnt-bctcq/", payload))
+    return json.dumps(await _run_job("/mof-report/mof-pnt-bctcq/", payload))
+
+@server.tool("job_status")
+async def tool_job_status(job_id: str) -> str:
+    """Job: Xem trạng thái và tiến độ của job phân tích / báo cáo"""
+    return json.dumps(await _get(f"/jobs/{job_id}"))  # Gửi yêu cầu GET lấy trạng thái job
+
+@server.tool("job_result")
+async def tool_job_result(job_id: str) -> str:
+    """Job: Lấy kết quả của job đã chạy xong"""
+    return json.dumps(await _get(f"/jobs/{job_id}/result"))  # Gửi yêu cầu GET lấy kết quả job
+
+@server.tool("job_cancel")
+async def tool_job_cancel(job_id: str) -> str:
+    """Job: Huỷ job đang chờ hoặc đang chạy"""
+    return json.dumps(await _post_json(f"/jobs/{job_id}/cancel", {}))  # Gửi yêu cầu POST huỷ job
 
 # Phần khởi động server và lắng nghe yêu cầu từ người dùng
 if __name__ == "__main__":
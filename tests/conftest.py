@@ -0,0 +1,182 @@
+"""
+Cấu hình chung cho test: chạy trên storage in-memory, tắt process pool và các cache trong process
+để mỗi test tính lại từ đầu (test của từng cache / pool tự bật lại bằng monkeypatch).
+
+Module trong app import theo gốc là thư mục app (from modules... / from services...). Package `config`
+(cấu hình triển khai) không nằm trong repo và utils/json_encoder.py trong repo rỗng: khi thiếu, conftest đăng ký
+bản thay thế tối thiểu trong sys.modules để mọi test luôn chạy được.
+"""
+import contextlib
+import importlib.util
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, os.path.abspath(APP_DIR))
+
+def _install_config_fakes():
+    """config.constants / config.log_config / config.google_sheets_config cho môi trường không có cấu hình triển khai"""
+    if importlib.util.find_spec("config") is not None:
+        return
+    config = types.ModuleType("config")
+    config.__path__ = []
+    constants = types.ModuleType("config.constants")
+    constants.S3 = {
+        "REGION": "us-east-1", "ENDPOINT": "http://localhost:9000",
+        "ACCESS_KEY": "test", "SECRET_KEY": "test", "BUCKET": "test-bucket",
+    }
+    log_config = types.ModuleType("config.log_config")
+    log_config.logger = logging.getLogger("tests")
+    google_sheets_config = types.ModuleType("config.google_sheets_config")
+    google_sheets_config.google_sheets_config = types.SimpleNamespace(get_client=lambda: None)
+    for module in (config, constants, log_config, google_sheets_config):
+        sys.modules[module.__name__] = module
+    config.constants, config.log_config, config.google_sheets_config = constants, log_config, google_sheets_config
+
+class _NpEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, np.floating):
+            return float(obj)
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        return super().default(obj)
+
+def _install_json_encoder_fake():
+    import utils.json_encoder
+    if not hasattr(utils.json_encoder, "NpEncoder"):
+        utils.json_encoder.NpEncoder = _NpEncoder
+
+_install_config_fakes()
+_install_json_encoder_fake()
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("GLM_PARALLEL_ENABLED", "false")
+os.environ.setdefault("ARROW_TABLE_CACHE_ENABLED", "false")
+os.environ.setdefault("GLM_RESULT_CACHE_ENABLED", "false")
+os.environ.setdefault("PARQUET_CACHE_ENABLED", "false")
+
+def make_portfolio(n_rows: int, seed: int = 0, year_dtype=int, nan_groups: bool = True) -> pd.DataFrame:
+    """
+    Danh mục CAR giả lập: mã hợp đồng trùng (~3 dòng / hợp đồng), biến phân tích có NaN / None,
+    category có mức không dùng tới, cột claim của additional code AC01 / AC02.
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'CAL_YEAR': rng.integers(2018, 2021, n_rows),
+        'POLICY_ID': rng.integers(0, max(1, n_rows // 3), n_rows).astype(str),
+        'VEHICLE_VALUE': rng.random(n_rows) * 2e9,
+        'EXPOSURE_YEAR': rng.random(n_rows),
+        'EXPOSURE_PREM': rng.random(n_rows) * 1e7,
+        'NUM_CLAIMS': rng.integers(0, 3, n_rows),
+        'CLAIM_PMT': rng.random(n_rows) * 1e8,
+        'NUM_CLAIMS_AC01': rng.integers(0, 2, n_rows),
+        'CLAIM_PMT_AC01': rng.random(n_rows) * 1e7,
+        'NUM_CLAIMS_AC02': rng.integers(0, 2, n_rows),
+        'CLAIM_PMT_AC02': rng.random(n_rows) * 1e7,
+        'BRAND': rng.choice(['A', 'B', 'C', None], n_rows),
+        'REGION': rng.integers(0, 5, n_rows),
+        'VEHICLE_AGE': rng.integers(0, 3, n_rows).astype(float),
+    })
+    df['CAL_YEAR'] = df['CAL_YEAR'].astype(year_dtype)
+    # Nhãn '05' không có dòng nào (category không dùng tới)
+    df['VEHICLE_VALUE_GROUP'] = pd.cut(df['VEHICLE_VALUE'], bins=[0, 5e8, 1e9, 1.5e9, 2e9, 3e9],
+                                       labels=['01', '02', '03', '04', '05'], include_lowest=True)
+    if nan_groups:
+        nan_rows = df.sample(frac=0.05, random_state=seed).index
+        df.loc[nan_rows, 'VEHICLE_VALUE_GROUP'] = np.nan
+        df.loc[nan_rows[:len(nan_rows) // 2], 'VEHICLE_AGE'] = np.nan
+    return df
+
+# Biến phân tích và hàm của GLMAnalysis cho từng loại bảng (1WA..4WA)
+ANALYSIS_VARIABLES = ['VEHICLE_VALUE_GROUP', 'BRAND', 'REGION', 'VEHICLE_AGE']
+ANALYSIS_FUNCS = {1: '_call_owa_func', 2: '_call_twa_func', 3: '_call_threeway_func', 4: '_call_fourway_func'}
+
+def analysis_request(var_cal_year: list, codes: list = None, **extra) -> dict:
+    """request_data của GLMAnalysis cho danh mục make_portfolio (additional code AC01 / AC02 nếu có codes)"""
+    return {
+        'product_name': 'CAR', 'var_cal_year': var_cal_year, 'additional_apply': bool(codes),
+        'additional_codes': codes, 'additional_descriptions': [f"desc {code}" for code in codes] if codes else None,
+        'parquet_url': 's3://test-bucket/report-software/glm/u/x_20240101000000.parquet', 'user_name': 'u', 'name_func': 'f',
+        **extra,
+    }
+
+def analysis_combinations(nway: int, variables: list = ANALYSIS_VARIABLES) -> list:
+    return list(variables) if nway == 1 else list(itertools.combinations(variables, nway))
+
+@contextlib.contextmanager
+def baseline_loop():
+    """Đường gốc: vòng lặp *_func từng (combination, năm) trên pandas.pivot_table (tắt grouping sets / cube / kernel)"""
+    from modules.GLM import glm_varb_analysis
+    from services import glm_service
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(glm_service, "GLM_GROUPING_SETS_ENABLED", False)
+        patch.setattr(glm_service, "GLM_CUBE_ENABLED", False)
+        patch.setattr(glm_varb_analysis, "GLM_PIVOT_KERNEL_ENABLED", False)
+        yield
+
+def round_trip(df: pd.DataFrame) -> pd.DataFrame:
+    """Đường ghi gốc: cả bảng kết quả ghi một lần (profile analysis_result) rồi đọc lại"""
+    from modules.parquet_writer import write_parquet
+    buffer = io.BytesIO()
+    write_parquet(df, buffer, profile="analysis_result")
+    buffer.seek(0)
+    return pq.read_table(buffer).to_pandas()
+
+def read_result(sub_folder: str, table_detail_name: str) -> pd.DataFrame:
+    """Bảng kết quả đã ghi lên storage bởi _process_multiple_codes_analysis"""
+    from modules.storage import get_storage
+    payload = get_storage().get(f"{sub_folder}/{table_detail_name}.parquet")
+    return pq.read_table(io.BytesIO(payload)).to_pandas()
+
+def assert_same_result(expected: pd.DataFrame, result: pd.DataFrame):
+    """Số đếm (COUNT*, NUM_CLAIMS*) khớp tuyệt đối, tổng float trong rtol 1e-9 (thứ tự cộng khác nhau)"""
+    expected, result = expected.reset_index(drop=True), result.reset_index(drop=True)
+    pd.testing.assert_frame_equal(expected, result, check_exact=False, rtol=1e-9)
+    for column in result.columns:
+        if column.startswith(('COUNT', 'NUM_CLAIMS')):
+            pd.testing.assert_series_equal(expected[column], result[column], check_exact=True)
+
+def upload_source(df: pd.DataFrame, name: str = "source") -> str:
+    """Ghi file nguồn của phân tích lên storage (memory), trả về URL s3:// dùng làm tableName"""
+    from modules.storage import get_storage
+    key = f"report-software/glm/u/{name}_20240101000000.parquet"
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    get_storage().put(key, buffer.getvalue())
+    return f"s3://test-bucket/{key}"
+
+def glm_request(table_name: str, var_cal_year: list = (2018, 2020), codes: list = None):
+    """GLMRequest cho danh mục make_portfolio: VEHICLE_VALUE_GROUP phân nhóm theo request, BRAND / REGION giữ nguyên"""
+    from schemas.glm_schema import GLMRequest
+    return GLMRequest(json_settings={
+        "tableName": table_name, "userName": "u", "nameProduct": "CAR", "nameFunc": "f", "validStatus": "Validated",
+        "setting_cols": {
+            "var_single_settings": ["BRAND", "REGION"],
+            "var_cate_settings": [{"VEHICLE_VALUE_GROUP": {"bin": [0, 500000000, 1000000000, "Infinity"], "unit": "m"}}],
+            "calYear": list(var_cal_year),
+            "var_info_settings": ["CAL_YEAR", "POLICY_ID", "EXPOSURE_YEAR", "EXPOSURE_PREM", "NUM_CLAIMS", "CLAIM_PMT"],
+            "var_additional_settings": {code: f"desc {code}" for code in codes} if codes else None,
+        },
+    })
+
+def read_response(response: dict) -> list:
+    """Các bảng kết quả (theo code) của response GLM 1WA..4WA"""
+    data = response["data"]
+    return [read_result(data["sub_folder"], name) for name in data["table_detail_name"]]
+
+@pytest.fixture
+def analysis():
+    from services.glm_service import GLMAnalysis
+    return GLMAnalysis()
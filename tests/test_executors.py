@@ -0,0 +1,242 @@
+"""
+EndpointLimiter: giới hạn số request đồng thời, hàng đợi đầy → 503, request chờ bị huỷ không làm mất slot.
+run_io: thao tác ghi quá timeout bị huỷ, object không xuất hiện trên storage.
+"""
+import asyncio
+import threading
+import time
+import uuid
+
+import pandas as pd
+import pytest
+from fastapi import HTTPException
+
+from utils.executors import EndpointLimiter, OperationCancelled, run_cancellable, run_io
+
+def test_concurrency_limit_respected():
+    limiter = EndpointLimiter("test", concurrency=2, max_queue=10)
+    state = {"running": 0, "peak": 0}
+
+    async def request():
+        await limiter.acquire()
+        try:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+            await asyncio.sleep(0.01)
+            state["running"] -= 1
+        finally:
+            limiter.release()
+
+    async def main():
+        await asyncio.gather(*(request() for _ in range(8)))
+
+    asyncio.run(main())
+    assert state["peak"] == 2
+    assert limiter.running == 0 and not limiter._waiters
+
+def test_waiters_served_in_arrival_order():
+    limiter = EndpointLimiter("test", concurrency=1, max_queue=10)
+    order = []
+
+    async def request(i):
+        await limiter.acquire()
+        order.append(i)
+        await asyncio.sleep(0)
+        limiter.release()
+
+    async def main():
+        await limiter.acquire()
+        tasks = []
+        for i in range(4):
+            tasks.append(asyncio.create_task(request(i)))
+            await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == [0, 1, 2, 3]
+
+def test_full_queue_rejected_with_retry_after():
+    limiter = EndpointLimiter("busy", concurrency=1, max_queue=1)
+
+    async def main():
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as error:
+            await limiter.acquire()
+        limiter.release()
+        await waiter
+        limiter.release()
+        return error.value
+
+    error = asyncio.run(main())
+    assert error.status_code == 503
+    assert int(error.headers["Retry-After"]) > 0
+    assert limiter.rejected == 1
+    assert limiter.running == 0
+
+def test_cancelled_waiter_leaves_queue():
+    limiter = EndpointLimiter("test", concurrency=1, max_queue=1)
+
+    async def main():
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        # Chỗ trong hàng đợi được trả lại
+        assert not limiter._waiters
+        nxt = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release()
+        await nxt
+        limiter.release()
+
+    asyncio.run(main())
+    assert limiter.running == 0
+
+def test_waiter_cancelled_after_handoff_releases_slot():
+    """Slot đã chuyển cho request chờ nhưng request đó bị huỷ trước khi chạy: slot chuyển tiếp, không bị giữ mãi"""
+    limiter = EndpointLimiter("test", concurrency=1, max_queue=10)
+
+    async def main():
+        await limiter.acquire()
+        first = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        second = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        # Chuyển slot cho `first` rồi huỷ nó trước khi nó kịp chạy
+        limiter.release()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await asyncio.wait_for(second, 1)
+        assert limiter.running == 1
+        limiter.release()
+
+    asyncio.run(main())
+    assert limiter.running == 0 and not limiter._waiters
+
+def test_waiter_cancelled_after_handoff_frees_slot_when_queue_empty():
+    limiter = EndpointLimiter("test", concurrency=1, max_queue=10)
+
+    async def main():
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.running == 0
+        # Request mới lấy slot ngay, không phải chờ
+        await asyncio.wait_for(limiter.acquire(), 1)
+        limiter.release()
+
+    asyncio.run(main())
+
+def slow_write(key: str, delay: float, outcome: dict):
+    """Ghi object qua writer của storage, dừng `delay` giây trước khi commit (như upload chậm)"""
+    from modules.storage import get_storage
+    try:
+        with get_storage().open_writer(key) as writer:
+            writer.write(b"payload")
+            time.sleep(delay)
+        outcome["status"] = "committed"
+    except OperationCancelled:
+        outcome["status"] = "cancelled"
+    finally:
+        outcome["done"].set()
+
+def test_timed_out_write_is_cancelled_not_committed():
+    from modules.storage import get_storage
+    key = f"test-executors/{uuid.uuid4().hex}.bin"
+    outcome = {"done": threading.Event()}
+
+    async def main():
+        return await run_io(slow_write, key, 0.3, outcome, timeout=0.05, operation="slow write")
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main())
+    assert error.value.status_code == 504
+    assert outcome["done"].wait(5)
+    assert outcome["status"] == "cancelled"
+    with pytest.raises(FileNotFoundError):
+        get_storage().head(key)
+
+def test_write_within_timeout_commits():
+    from modules.storage import get_storage
+    key = f"test-executors/{uuid.uuid4().hex}.bin"
+    outcome = {"done": threading.Event()}
+    asyncio.run(run_io(slow_write, key, 0, outcome, timeout=5))
+    assert outcome["status"] == "committed"
+    assert get_storage().get(key) == b"payload"
+
+def test_put_after_cancel_raises():
+    from modules.storage import get_storage
+    key = f"test-executors/{uuid.uuid4().hex}.bin"
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(OperationCancelled):
+        run_cancellable(cancel, get_storage().put, key, b"payload")
+    with pytest.raises(FileNotFoundError):
+        get_storage().head(key)
+
+def test_cancelled_local_write_leaves_no_file(tmp_path):
+    from modules.storage import LocalStorage
+    storage = LocalStorage(root=str(tmp_path))
+    cancel = threading.Event()
+
+    def write():
+        with storage.open_writer("a/b.bin") as writer:
+            writer.write(b"payload")
+            cancel.set()
+
+    with pytest.raises(OperationCancelled):
+        run_cancellable(cancel, write)
+    assert storage.list() == []
+    assert not any(path.suffix == ".tmp" for path in tmp_path.rglob("*"))
+
+def test_cancelled_multipart_upload_is_aborted(monkeypatch):
+    boto3 = pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+    from modules import storage
+
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="test-bucket")
+        monkeypatch.setattr(storage, "get_s3_client", lambda: client)
+        cancel = threading.Event()
+
+        def upload():
+            with storage.S3MultipartWriter("big.bin", bucket="test-bucket", part_size=storage.MIN_PART_SIZE) as writer:
+                writer.write(b"x" * (storage.MIN_PART_SIZE + 1024))
+                assert writer._upload_id is not None
+                cancel.set()
+                writer.write(b"x" * storage.MIN_PART_SIZE)
+
+        with pytest.raises(OperationCancelled):
+            run_cancellable(cancel, upload)
+        assert client.list_multipart_uploads(Bucket="test-bucket").get("Uploads", []) == []
+        assert client.list_objects_v2(Bucket="test-bucket").get("KeyCount") == 0
+
+def test_artifact_writer_cancel_aborts_pending_uploads():
+    from concurrent.futures import ThreadPoolExecutor
+    from modules.db_parquet import ParquetArtifactWriter
+    from modules.storage import get_storage
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+    executor.submit(release.wait)
+    writer = ParquetArtifactWriter(executor=executor)
+    key = f"test-executors/{uuid.uuid4().hex}.parquet"
+    writer.submit("pending", pd.DataFrame({"a": [1, 2, 3]}), key)
+    writer.cancel()
+    release.set()
+    [result] = writer.results()
+    executor.shutdown()
+    assert not result["status"] and "cancelled" in result["error"]
+    with pytest.raises(FileNotFoundError):
+        get_storage().head(key)
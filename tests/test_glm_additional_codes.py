@@ -0,0 +1,41 @@
+"""
+Một lần group cho mọi additional code (AC01, AC02...) phải cho từng bảng giống như chạy riêng từng code
+qua vòng lặp gốc.
+"""
+import pytest
+from fastapi import HTTPException
+
+from conftest import (
+    ANALYSIS_FUNCS, analysis_combinations, analysis_request, assert_same_result, baseline_loop, make_portfolio
+)
+
+@pytest.mark.parametrize("nway", [1, 2, 3])
+@pytest.mark.parametrize("var_cal_year", [[2018, 2020], [0, 0]], ids=["range", "year0"])
+def test_single_pass_matches_each_code_alone(analysis, nway, var_cal_year):
+    df = make_portfolio(500, nway)
+    request_data = analysis_request(var_cal_year, ['AC01', 'AC02'])
+    func = getattr(analysis, ANALYSIS_FUNCS[nway])
+    combos, code_runs = analysis_combinations(nway), analysis._code_runs(request_data)
+    # Mỗi additional code và một lần cho cột claim gốc
+    assert len(code_runs) == 3
+
+    result = analysis._process_analysis_codes(df.copy(), request_data, func, combos, code_runs, allow_parallel=False)
+    for code_run, result_frame in zip(code_runs, result):
+        with baseline_loop():
+            expected, = analysis._process_analysis_codes(df.copy(), request_data, func, combos, [code_run],
+                                                         allow_parallel=False)
+        assert_same_result(expected, result_frame)
+
+@pytest.mark.parametrize("nway", [1, 2])
+def test_missing_code_columns_raise_like_loop(analysis, nway):
+    """Code không có cột NUM_CLAIMS_ / CLAIM_PMT_ trong dữ liệu: lỗi như khi chạy vòng lặp gốc"""
+    df = make_portfolio(200, 3)
+    request_data = analysis_request([2018, 2020], ['AC01', 'AC09'])
+    func = getattr(analysis, ANALYSIS_FUNCS[nway])
+    combos, code_runs = analysis_combinations(nway), analysis._code_runs(request_data)
+
+    with pytest.raises(HTTPException) as result:
+        analysis._process_analysis_codes(df.copy(), request_data, func, combos, code_runs, allow_parallel=False)
+    with baseline_loop(), pytest.raises(HTTPException) as expected:
+        analysis._process_analysis_codes(df.copy(), request_data, func, combos, code_runs, allow_parallel=False)
+    assert (result.value.status_code, result.value.detail) == (expected.value.status_code, expected.value.detail)
@@ -0,0 +1,75 @@
+"""BinSpec (engine phân nhóm) phải cho cùng category với pd.cut của categorize_car / categorize_health"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.GLM.glm_binning import BinSpec, compile_bin_spec, NAN_LABEL
+from modules.GLM.glm_varb_analysis import categorize_car, categorize_health
+
+CASES = [
+    ("CAR", "VEHICLE_VALUE_GROUP", categorize_car, 4e9),
+    ("CAR", "VEHICLE_AGE_GROUP", categorize_car, 25),
+    ("CAR", "VEHICLE_SEATS_GROUP", categorize_car, 50),
+    ("HEALTH", "SUM_ASSURED_GROUP", categorize_health, 4e9),
+    ("HEALTH", "CERT_AGE_GROUP", categorize_health, 90),
+]
+
+def random_bins(rng, scale: float) -> list:
+    amount = scale > 1e6
+    # Nhãn theo năm / chỗ ngồi ("From a to b-1") cần cạnh cuối là Infinity và các cạnh cách nhau ít nhất 2,
+    # nếu không generate_single_unit_labels cho số cạnh lệch số nhãn / cạnh trùng (xem test_single_unit_bins_fall_back)
+    step = 1e8 if amount else 2
+    bins = sorted(set((rng.integers(0, int(scale / step), int(rng.integers(2, 7))) * step).tolist()))
+    if not amount or rng.random() < 0.5:
+        bins.append(float('inf'))
+    return bins
+
+def random_values(rng, bins: list, scale: float) -> pd.Series:
+    finite = [edge for edge in bins if np.isfinite(edge)]
+    # Giá trị đúng bằng cạnh bin, ngoài khoảng (-1), NaN và chuỗi không phải số
+    values = pd.Series(np.r_[rng.random(200) * scale, finite, [np.nan, -1.0]])
+    if rng.random() < 0.3:
+        values = values.astype(object)
+        values.iloc[0] = 'abc'
+    return values
+
+@pytest.mark.parametrize("product,var_name,categorize,scale", CASES, ids=[case[1] for case in CASES])
+@pytest.mark.parametrize("seed", range(30))
+def test_bin_spec_matches_pd_cut(product, var_name, categorize, scale, seed):
+    rng = np.random.default_rng(seed)
+    bins = random_bins(rng, scale)
+    if len(bins) < 2:
+        pytest.skip("needs at least two edges")
+    values = random_values(rng, bins, scale)
+    spec = compile_bin_spec(product, var_name, tuple(float(edge) for edge in bins), 'years')
+    if spec is None:
+        pytest.skip("engine falls back to categorize_* for these bins")
+
+    expected = categorize(pd.DataFrame({var_name: values.copy()}), var_name, list(bins), 'years')[var_name]
+    result = pd.Series(spec.assign(values), name=var_name)
+    pd.testing.assert_series_equal(expected.reset_index(drop=True), result)
+
+@pytest.mark.parametrize("n_edges", [3, 32, 33, 200])
+def test_bin_codes_compare_and_searchsorted_paths(n_edges):
+    """≤ 32 cạnh: so sánh với từng cạnh; nhiều hơn: np.searchsorted. Cả hai phải khớp pd.cut(include_lowest=True)"""
+    rng = np.random.default_rng(n_edges)
+    edges = np.unique(rng.integers(0, 10_000, n_edges * 2).astype(np.float64))[:n_edges]
+    labels = [f"L{i:03d}" for i in range(len(edges) - 1)]
+    spec = BinSpec("CAR", "X_GROUP", tuple(edges), "u", edges, labels)
+    values = pd.Series(np.r_[rng.random(5000) * 11_000 - 500, edges, [np.nan]])
+
+    expected = pd.cut(values, bins=edges, labels=labels, include_lowest=True)
+    if expected.isna().any():
+        expected = expected.cat.add_categories(NAN_LABEL).fillna(NAN_LABEL)
+    pd.testing.assert_series_equal(expected, pd.Series(spec.assign(values)), check_names=False)
+
+def test_unused_categories_kept():
+    spec = compile_bin_spec("CAR", "VEHICLE_AGE_GROUP", (0.0, 3.0, 5.0, 10.0, float('inf')), 'years')
+    result = spec.assign(pd.Series([1.0, 2.0]))
+    assert list(result.categories) == spec.labels
+    assert NAN_LABEL not in result.categories
+
+@pytest.mark.parametrize("bins", [(0.0, 5.0, 10.0), (4.0, 5.0, 10.0, float('inf'))], ids=["no_inf", "adjacent"])
+def test_single_unit_bins_fall_back(bins):
+    """Bin năm mà số nhãn lệch số cạnh / cạnh trùng sau khi trừ 1: engine trả về None, caller dùng categorize_car như cũ"""
+    assert compile_bin_spec("CAR", "VEHICLE_AGE_GROUP", bins, 'years') is None
@@ -0,0 +1,40 @@
+"""2WA / 3WA / 4WA suy từ GLMCube phải cho cùng bảng với vòng lặp *_func từng (tổ hợp, năm) trên pandas.pivot_table"""
+import pytest
+
+from conftest import (
+    ANALYSIS_FUNCS, analysis_combinations, analysis_request, assert_same_result, baseline_loop, make_portfolio
+)
+
+@pytest.mark.parametrize("nway", [2, 3, 4])
+@pytest.mark.parametrize("var_cal_year", [[2018, 2020], [2019, 2019], [0, 0]], ids=["range", "single", "year0"])
+@pytest.mark.parametrize("codes", [None, ['AC01', 'AC02']], ids=["base", "ac_codes"])
+@pytest.mark.parametrize("seed", range(4))
+def test_cube_matches_loop(analysis, nway, var_cal_year, codes, seed):
+    # CAL_YEAR dạng chuỗi ở seed lẻ
+    df = make_portfolio([5, 60, 600, 40][seed], seed, str if seed % 2 else int)
+    request_data = analysis_request(var_cal_year, codes)
+    func = getattr(analysis, ANALYSIS_FUNCS[nway])
+    combos, code_runs = analysis_combinations(nway), analysis._code_runs(request_data)
+
+    result = analysis._process_analysis_codes(df.copy(), request_data, func, combos, code_runs, allow_parallel=False)
+    with baseline_loop():
+        expected = analysis._process_analysis_codes(df.copy(), request_data, func, combos, code_runs, allow_parallel=False)
+
+    assert len(result) == len(expected) == len(code_runs)
+    for expected_frame, result_frame in zip(expected, result):
+        assert_same_result(expected_frame, result_frame)
+
+def test_cube_group_limit_falls_back_to_loop(analysis, monkeypatch):
+    """Tổ hợp vượt GLM_CUBE_MAX_GROUPS: hàm gốc tính bảng đó, kết quả không đổi"""
+    from modules.GLM import glm_cube
+    monkeypatch.setattr(glm_cube, "GLM_CUBE_MAX_GROUPS", 10)
+    df = make_portfolio(600, 5)
+    request_data = analysis_request([2018, 2020])
+    combos, code_runs = analysis_combinations(2), analysis._code_runs(request_data)
+
+    result = analysis._process_analysis_codes(df.copy(), request_data, analysis._call_twa_func, combos, code_runs,
+                                              allow_parallel=False)
+    with baseline_loop():
+        expected = analysis._process_analysis_codes(df.copy(), request_data, analysis._call_twa_func, combos, code_runs,
+                                                    allow_parallel=False)
+    assert_same_result(expected[0], result[0])
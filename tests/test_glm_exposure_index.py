@@ -0,0 +1,38 @@
+"""Chỉ mục năm / dòng exposure dùng chung (prepare_year_index) phải cho cùng bảng với lọc năm + drop_duplicates"""
+import pytest
+
+from conftest import ANALYSIS_FUNCS, analysis_combinations, analysis_request, assert_same_result, make_portfolio
+from modules.GLM.glm_varb_analysis import (
+    calculate_pivot_tables, calculate_pivot_tables_pandas, prepare_year_index, setup_analysis_params, year_slice
+)
+from services.glm_service import _FrameCollector
+
+@pytest.mark.parametrize("year", [0, 2018, 2019, 2020])
+@pytest.mark.parametrize("byvars", [['BRAND'], ['VEHICLE_VALUE_GROUP', 'REGION']], ids="-".join)
+@pytest.mark.parametrize("pivot", [calculate_pivot_tables, calculate_pivot_tables_pandas], ids=["kernel", "pandas"])
+def test_year_slice_matches_drop_duplicates(year, byvars, pivot):
+    df = make_portfolio(800, year)
+    COUNT_NAME, _, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED = setup_analysis_params('CAR', False, "")
+    year_index = prepare_year_index(df.copy(), 'CAR')
+
+    df_year, exposure_index = year_slice(year_index, year)
+    result = pivot(df_year, byvars, COUNT_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED, exposure_index)
+    df_plain = df if year == 0 else df[df['CAL_YEAR'] == year]
+    expected = calculate_pivot_tables_pandas(df_plain, byvars, COUNT_NAME, NUM_CLAIMS, CLAIM_PMT, SUM_ASSURED)
+    assert_same_result(expected, result)
+
+@pytest.mark.parametrize("nway", [1, 2])
+@pytest.mark.parametrize("var_cal_year", [[2018, 2020], [0, 0]], ids=["range", "year0"])
+def test_loop_with_year_index_matches_without(analysis, nway, var_cal_year):
+    """Vòng lặp *_func dùng chung year_index cho mọi combination cho cùng kết quả với mỗi lần gọi tự lọc năm"""
+    df = make_portfolio(600, 9, str)
+    request_data = analysis_request(var_cal_year)
+    func = getattr(analysis, ANALYSIS_FUNCS[nway])
+    combos = analysis_combinations(nway)
+
+    shared, plain = _FrameCollector(), _FrameCollector()
+    df_shared = df.copy()
+    analysis._process_analysis_loop(df_shared, request_data, func, combos, shared,
+                                    year_index=analysis._year_index(df_shared, request_data))
+    analysis._process_analysis_loop(df.copy(), request_data, func, combos, plain, year_index=None)
+    assert_same_result(plain.to_frame(), shared.to_frame())
@@ -0,0 +1,40 @@
+"""1WA qua grouping sets phải cho cùng bảng với vòng lặp OWA_func từng (biến, năm) trên pandas.pivot_table"""
+import pytest
+from fastapi import HTTPException
+
+from conftest import analysis_combinations, analysis_request, assert_same_result, baseline_loop, make_portfolio
+
+@pytest.mark.parametrize("var_cal_year", [[2018, 2020], [2019, 2019], [0, 0]], ids=["range", "single", "year0"])
+@pytest.mark.parametrize("codes", [None, ['AC01', 'AC02']], ids=["base", "ac_codes"])
+@pytest.mark.parametrize("year_dtype", [int, str], ids=["int_year", "str_year"])
+@pytest.mark.parametrize("seed", range(3))
+def test_owa_grouping_sets_match_loop(analysis, var_cal_year, codes, year_dtype, seed):
+    df = make_portfolio([5, 60, 600][seed], seed, year_dtype)
+    request_data = analysis_request(var_cal_year, codes)
+    combos, code_runs = analysis_combinations(1), analysis._code_runs(request_data)
+
+    result = analysis._process_analysis_codes(
+        df.copy(), request_data, analysis._call_owa_func, combos, code_runs, allow_parallel=False
+    )
+    with baseline_loop():
+        expected = analysis._process_analysis_codes(
+            df.copy(), request_data, analysis._call_owa_func, combos, code_runs, allow_parallel=False
+        )
+
+    assert len(result) == len(expected) == len(code_runs)
+    for expected_frame, result_frame in zip(expected, result):
+        assert_same_result(expected_frame, result_frame)
+
+def test_owa_year_without_rows_raises_like_loop(analysis):
+    """Năm không có dòng nào: grouping sets gọi lại OWA_func nên lỗi 409 giống hệt vòng lặp"""
+    df = make_portfolio(200, 4)
+    request_data = analysis_request([2017, 2019])
+    combos, code_runs = analysis_combinations(1), analysis._code_runs(request_data)
+
+    with pytest.raises(HTTPException) as result:
+        analysis._process_analysis_codes(df.copy(), request_data, analysis._call_owa_func, combos, code_runs,
+                                         allow_parallel=False)
+    with baseline_loop(), pytest.raises(HTTPException) as expected:
+        analysis._process_analysis_codes(df.copy(), request_data, analysis._call_owa_func, combos, code_runs,
+                                         allow_parallel=False)
+    assert (result.value.status_code, result.value.detail) == (expected.value.status_code, expected.value.detail)
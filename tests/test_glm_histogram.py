@@ -0,0 +1,61 @@
+"""
+Bảng 1WA của biến _GROUP suy từ histogram (OWAPreaggregate) khi chỉ đổi cạnh bin phải giống
+bảng tính lại từ dữ liệu đã phân nhóm theo bin mới.
+"""
+import numpy as np
+import pytest
+
+from conftest import analysis_request, assert_same_result, baseline_loop, make_portfolio, read_result, round_trip
+from modules.GLM.glm_histogram import OWAPreaggregate
+
+COMBINATIONS = ['VEHICLE_VALUE_GROUP', 'BRAND', 'REGION']
+
+def value_settings(bins: list) -> dict:
+    return {'var_category_settings': [{'VEHICLE_VALUE_GROUP': {'bin': bins, 'unit': 'm'}}],
+            'var_category_cols': ['VEHICLE_VALUE_GROUP']}
+
+@pytest.mark.parametrize("bins", [[0, 3e8, 1.2e9], [2e8, 7e8, 1.5e9, 'Infinity'], [0, 1e8, 4e8, 9e8, 1.9e9]])
+@pytest.mark.parametrize("codes", [None, ['AC01', 'AC02']], ids=["base", "ac_codes"])
+@pytest.mark.parametrize("with_nan", [False, True], ids=["no_nan", "nan_values"])
+def test_rebin_from_histogram_matches_fresh_run(analysis, bins, codes, with_nan):
+    source = make_portfolio(4000, len(bins), nan_groups=False).drop(columns=['VEHICLE_VALUE_GROUP'])
+    # Giá trị rời rạc theo bước 1e8 để mọi cạnh bin đều nằm giữa các bucket của histogram
+    source['VEHICLE_VALUE'] = (source['VEHICLE_VALUE'] // 1e8) * 1e8
+    if with_nan:
+        source.loc[source.sample(frac=0.05, random_state=1).index, 'VEHICLE_VALUE'] = np.nan
+    first = analysis_request([2018, 2020], codes, **value_settings([0, 5e8, 1e9, 'Infinity']))
+    second = analysis_request([2018, 2020], codes, **value_settings(bins))
+
+    preaggregate = OWAPreaggregate()
+    df_first = analysis._process_category_columns(source.copy(), first['var_category_settings'], 'CAR')
+    analysis._process_multiple_codes_analysis(df_first, first, analysis._call_owa_func, COMBINATIONS, "1WA",
+                                              preaggregate=preaggregate)
+    years = analysis._resolve_cal_years(second['var_cal_year'])
+    assert preaggregate.covers(COMBINATIONS, analysis._bin_specs(second), years)
+
+    # Request thứ hai không đọc lại dữ liệu: mọi bảng suy từ preaggregate
+    names, _, sub_folder = analysis._process_multiple_codes_analysis(
+        None, second, analysis._call_owa_func, COMBINATIONS, "1WA", preaggregate=preaggregate
+    )
+    df_second = analysis._process_category_columns(source.copy(), second['var_category_settings'], 'CAR')
+    with baseline_loop():
+        expected = analysis._process_analysis_codes(
+            df_second, second, analysis._call_owa_func, COMBINATIONS, analysis._code_runs(second), allow_parallel=False
+        )
+
+    for name, expected_frame in zip(names, expected):
+        assert_same_result(round_trip(expected_frame), read_result(sub_folder, name))
+
+def test_edges_inside_a_bucket_not_covered(analysis, monkeypatch):
+    """Nhiều giá trị hơn số bucket tối đa và cạnh bin mới rơi vào giữa một bucket: histogram không đủ, phải đọc lại dữ liệu"""
+    from modules.GLM import glm_histogram
+    monkeypatch.setattr(glm_histogram, "GLM_HISTOGRAM_MAX_BUCKETS", 50)
+    source = make_portfolio(2000, 1, nan_groups=False).drop(columns=['VEHICLE_VALUE_GROUP'])
+    first = analysis_request([2018, 2020], **value_settings([0, 5e8, 1e9, 'Infinity']))
+    preaggregate = OWAPreaggregate()
+    df_first = analysis._process_category_columns(source.copy(), first['var_category_settings'], 'CAR')
+    analysis._process_multiple_codes_analysis(df_first, first, analysis._call_owa_func, COMBINATIONS, "1WA",
+                                              preaggregate=preaggregate)
+
+    second = analysis_request([2018, 2020], **value_settings([0, 3.3e8, 1e9, 'Infinity']))
+    assert not preaggregate.covers(COMBINATIONS, analysis._bin_specs(second), [2018, 2019, 2020])
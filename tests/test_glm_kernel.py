@@ -0,0 +1,97 @@
+"""Kernel NumPy của calculate_pivot_tables phải cho cùng bảng với pandas.pivot_table"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.GLM.glm_kernel import aggregate_pivot_tables
+from modules.GLM.glm_varb_analysis import calculate_pivot_tables, calculate_pivot_tables_pandas
+
+BYVAR_LISTS = [['A'], ['B'], ['C'], ['A', 'B'], ['B', 'C'], ['C', 'A'], ['A', 'B', 'C']]
+
+def random_table(n_rows: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        # Mã hợp đồng trùng nhau: COUNT là số hợp đồng distinct, không phải số dòng
+        'ID': rng.integers(0, max(1, n_rows // 3), n_rows).astype(str),
+        'NUM_CLAIMS': rng.integers(0, 3, n_rows),
+        'CLAIM_PMT': rng.random(n_rows) * 1e6,
+        'EXPOSURE_YEAR': rng.random(n_rows),
+        'EXPOSURE_PREM': rng.random(n_rows) * 1e5,
+        'SA': rng.integers(0, 10 ** 6, n_rows),
+        'A': rng.choice(['x', 'y', 'z', None], n_rows),
+        # 'r' là category không có dòng nào
+        'B': pd.Categorical(rng.choice(['p', 'q', None], n_rows), categories=['q', 'p', 'r']),
+        'C': rng.integers(0, 4, n_rows).astype(float),
+    })
+    if seed % 3 == 0:
+        df.loc[df.sample(frac=0.2, random_state=seed).index, 'C'] = np.nan
+    if seed % 4 == 1:
+        df.loc[df.sample(frac=0.1, random_state=seed).index, 'ID'] = None
+    if seed % 5 == 2:
+        df.loc[df.sample(frac=0.1, random_state=seed).index, 'CLAIM_PMT'] = np.nan
+    return df
+
+def documented_fallback(df: pd.DataFrame, byvars: list) -> bool:
+    """Trường hợp của random_table mà docstring của aggregate_pivot_tables cho phép trả về None"""
+    return len(df) == 0 or not df[byvars].notna().all(axis=1).any()
+
+def assert_same_pivot(expected: pd.DataFrame, result: pd.DataFrame):
+    # Số đếm / tổng số nguyên phải khớp tuyệt đối, tổng float cộng theo thứ tự khác nên so với rtol
+    pd.testing.assert_frame_equal(expected, result, check_exact=False, rtol=1e-9)
+    for column in ('ID', 'NUM_CLAIMS', 'SA'):
+        np.testing.assert_array_equal(expected[column].to_numpy(), result[column].to_numpy())
+
+@pytest.mark.parametrize("seed", range(40))
+@pytest.mark.parametrize("byvars", BYVAR_LISTS, ids="-".join)
+def test_kernel_matches_pivot_table(seed, byvars):
+    df = random_table(int(np.random.default_rng(seed).integers(1, 300)), seed)
+    expected = calculate_pivot_tables_pandas(df, byvars, 'ID', 'NUM_CLAIMS', 'CLAIM_PMT', 'SA')
+    result = aggregate_pivot_tables(df, byvars, 'ID', 'NUM_CLAIMS', 'CLAIM_PMT', 'SA')
+    if result is None:
+        assert documented_fallback(df, byvars)
+    else:
+        assert_same_pivot(expected, result)
+    # calculate_pivot_tables (kernel hoặc fallback pivot_table) luôn cho cùng bảng
+    assert_same_pivot(expected, calculate_pivot_tables(df, byvars, 'ID', 'NUM_CLAIMS', 'CLAIM_PMT', 'SA'))
+
+def _all_nan_key(df):
+    df['A'] = None
+    return df
+
+def _nan_in_every_row(df):
+    df.loc[df.index[::2], 'A'] = None
+    df.loc[df.index[1::2], 'B'] = None
+    return df
+
+def _object_values(df):
+    df['SA'] = df['SA'].astype(object)
+    return df
+
+@pytest.mark.parametrize("prepare,byvars", [
+    (lambda df: df.iloc[:0], ['A']),
+    (_all_nan_key, ['A']),
+    (_nan_in_every_row, ['A', 'B']),
+    (_object_values, ['A']),
+    (lambda df: df, ['A', 'A']),
+    (lambda df: df, ['ID']),
+], ids=["empty", "all_nan_key", "nan_in_every_row", "object_values", "duplicate_byvar", "value_byvar"])
+def test_documented_fallbacks(prepare, byvars):
+    """Trường hợp docstring liệt kê: kernel trả về None, calculate_pivot_tables cho kết quả / lỗi như pivot_table"""
+    df = prepare(random_table(60, 11))
+    assert aggregate_pivot_tables(df, byvars, 'ID', 'NUM_CLAIMS', 'CLAIM_PMT', 'SA') is None
+    try:
+        expected = calculate_pivot_tables_pandas(df, byvars, 'ID', 'NUM_CLAIMS', 'CLAIM_PMT', 'SA')
+    except Exception as error:
+        with pytest.raises(type(error)):
+            calculate_pivot_tables(df, byvars, 'ID', 'NUM_CLAIMS', 'CLAIM_PMT', 'SA')
+        return
+    result = calculate_pivot_tables(df, byvars, 'ID', 'NUM_CLAIMS', 'CLAIM_PMT', 'SA')
+    pd.testing.assert_frame_equal(expected, result)
+
+def test_kernel_mixed_type_key():
+    """Biến kiểu hỗn hợp (số và chuỗi): factorize sắp xếp như pivot_table nên kernel vẫn xử lý"""
+    df = random_table(60, 11)
+    df['A'] = df['A'].astype(object)
+    df.loc[df.index[::5], 'A'] = 1
+    expected = calculate_pivot_tables_pandas(df, ['A'], 'ID', 'NUM_CLAIMS', 'CLAIM_PMT', 'SA')
+    assert_same_pivot(expected, aggregate_pivot_tables(df, ['A'], 'ID', 'NUM_CLAIMS', 'CLAIM_PMT', 'SA'))
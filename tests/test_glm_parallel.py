@@ -0,0 +1,99 @@
+"""Phân tích chia đoạn trên process pool cho cùng bảng (đúng thứ tự var_code) như chạy tuần tự, không để lại file Arrow"""
+import glob
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+
+import conftest
+from conftest import (
+    analysis_combinations, analysis_request, assert_same_result, make_portfolio, read_result,
+)
+from modules.GLM import glm_parallel
+
+@pytest.fixture(scope="module")
+def process_pool():
+    # Process spawn import lại conftest (đường dẫn app, cấu hình thay thế) trước khi nhận việc
+    executor = ProcessPoolExecutor(
+        max_workers=2, mp_context=multiprocessing.get_context("spawn"), initializer=conftest._install_json_encoder_fake
+    )
+    yield executor
+    executor.shutdown()
+
+@pytest.fixture
+def parallel(monkeypatch, process_pool):
+    monkeypatch.setattr(glm_parallel, "GLM_PARALLEL_ENABLED", True)
+    monkeypatch.setattr(glm_parallel, "GLM_PARALLEL_MIN_COMBINATIONS", 2)
+    monkeypatch.setattr(glm_parallel, "GLM_PARALLEL_MIN_ROWS", 1)
+    monkeypatch.setattr(glm_parallel, "GLM_PARALLEL_WORKERS", 2)
+    monkeypatch.setattr(glm_parallel, "PROCESS_EXECUTOR_MAX_WORKERS", 2)
+    monkeypatch.setattr(glm_parallel, "get_process_executor", lambda: process_pool)
+    from services import glm_service
+    batches = []
+
+    def counting(*args):
+        results = glm_parallel.run_batches(*args)
+        batches.append(results)
+        return results
+    monkeypatch.setattr(glm_service, "run_batches", counting)
+    return batches
+
+def shared_files() -> set:
+    return set(glob.glob(os.path.join(glm_parallel.GLM_SHARED_DATA_DIR, "glm-*.arrow")))
+
+@pytest.mark.parametrize("nway", [1, 2])
+@pytest.mark.parametrize("codes", [None, ["AC01", "AC02"]], ids=["base", "ac_codes"])
+def test_parallel_matches_serial(analysis, parallel, nway, codes):
+    df = make_portfolio(3000, seed=nway)
+    request_data = analysis_request([2018, 2020], codes)
+    combos, func = analysis_combinations(nway), getattr(analysis, conftest.ANALYSIS_FUNCS[nway])
+    before = shared_files()
+
+    names, _, sub_folder = analysis._process_multiple_codes_analysis(df.copy(), request_data, func, combos, f"{nway}WA")
+    result = [read_result(sub_folder, name) for name in names]
+    assert len(parallel) == 1 and parallel[0] is not None and len(parallel[0]) == 2
+    # Worker trả về đường dẫn file Arrow IPC, không phải DataFrame
+    assert all(isinstance(item, str) for status, items in parallel[0] for item in items if item is not None)
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(glm_parallel, "GLM_PARALLEL_ENABLED", False)
+        names, _, sub_folder = analysis._process_multiple_codes_analysis(df.copy(), request_data, func, combos, f"{nway}WA")
+        expected = [read_result(sub_folder, name) for name in names]
+    assert len(parallel) == 1
+
+    for expected_frame, result_frame in zip(expected, result):
+        assert list(result_frame["VAR_NAME_CODE"].str[:3].drop_duplicates()) == \
+            list(expected_frame["VAR_NAME_CODE"].str[:3].drop_duplicates())
+        assert_same_result(expected_frame, result_frame)
+    # File dữ liệu chia sẻ và file kết quả của worker đều đã được xoá
+    assert shared_files() == before
+
+def test_parallel_collected_frames_match_serial(analysis, parallel):
+    df = make_portfolio(2000, seed=5)
+    request_data = analysis_request([2019, 2019], ["AC01"])
+    combos, code_runs = analysis_combinations(2), analysis._code_runs(request_data)
+
+    result = analysis._process_analysis_codes(df.copy(), request_data, analysis._call_twa_func, combos, code_runs)
+    expected = analysis._process_analysis_codes(
+        df.copy(), request_data, analysis._call_twa_func, combos, code_runs, allow_parallel=False
+    )
+    assert parallel[0] is not None
+    for expected_frame, result_frame in zip(expected, result):
+        assert_same_result(expected_frame, result_frame)
+
+def test_parallel_error_matches_serial_and_cleans_up(analysis, parallel):
+    df = make_portfolio(500, seed=4)
+    request_data = analysis_request([2017, 2019])
+    combos, code_runs = analysis_combinations(1), analysis._code_runs(request_data)
+    before = shared_files()
+
+    with pytest.raises(HTTPException) as result:
+        analysis._process_analysis_codes(df.copy(), request_data, analysis._call_owa_func, combos, code_runs)
+    with pytest.raises(HTTPException) as expected:
+        analysis._process_analysis_codes(df.copy(), request_data, analysis._call_owa_func, combos, code_runs,
+                                         allow_parallel=False)
+    assert parallel[0] is not None
+    assert (result.value.status_code, result.value.detail) == (expected.value.status_code, expected.value.detail)
+    assert shared_files() == before
@@ -0,0 +1,112 @@
+"""GLMResultCache trên storage memory: chạy lại thì dùng bảng đã ghi; nguồn đổi / file kết quả bị ghi đè / invalidate thì tính lại"""
+import re
+import uuid
+
+import pandas as pd
+import pytest
+
+from conftest import glm_request, make_portfolio, read_response, upload_source
+from modules.GLM.glm_histogram import preaggregate_cache
+from modules.GLM.glm_result_cache import GLMResultCache
+from modules.db_parquet import extract_parquet_key
+from modules.storage import get_storage
+from services import glm_service
+
+@pytest.fixture
+def result_cache(monkeypatch):
+    cache = GLMResultCache(prefix=f"test-result-cache/{uuid.uuid4().hex}", enabled=True)
+    monkeypatch.setattr(glm_service, "glm_result_cache", cache)
+    # 1WA có histogram đã lưu sẽ tính lại từ histogram: tắt để chỉ cache kết quả quyết định có đọc dữ liệu hay không
+    monkeypatch.setattr(preaggregate_cache, "enabled", False)
+    return cache
+
+@pytest.fixture
+def reads(analysis, monkeypatch) -> list:
+    calls = []
+    read = analysis._read_parquet_data
+
+    def counting(*args, **kwargs):
+        calls.append(args[0])
+        return read(*args, **kwargs)
+    monkeypatch.setattr(analysis, "_read_parquet_data", counting)
+    return calls
+
+def source_frame(seed: int = 3) -> pd.DataFrame:
+    return make_portfolio(2000, seed=seed).drop(columns=["VEHICLE_VALUE_GROUP"])
+
+def assert_same_tables(expected: list, result: list):
+    assert len(expected) == len(result)
+    for e, r in zip(expected, result):
+        pd.testing.assert_frame_equal(e, r)
+
+@pytest.mark.parametrize("analysis_type", ["1WA", "2WA"])
+def test_repeat_run_hits(analysis, result_cache, reads, analysis_type):
+    request = glm_request(upload_source(source_frame(), name=f"hit{analysis_type}"), codes=["AC01"])
+    run = getattr(analysis, f"_glm_{analysis_type.lower()}")
+    first = run(request)
+    tables = read_response(first)
+    second = run(request)
+    assert len(reads) == 1
+    assert second["data"] == first["data"]
+    assert_same_tables(tables, read_response(second))
+
+def test_table_name_keeps_original_format(analysis, result_cache):
+    response = analysis._glm_1wa(glm_request(upload_source(source_frame(), name="naming"), codes=["AC01"]))
+    data = response["data"]
+    assert data["table_detail_name"] == ["u_f_CAR_AC01_1WA_20240101000000", "u_f_CAR_AC00_1WA_20240101000000"]
+    # Digest của thiết lập là thư mục con
+    assert re.fullmatch(r"report-software/glm/u/analysis_data/[0-9a-f]{10}", data["sub_folder"])
+    assert data["s3_key"] == f"{data['sub_folder']}/u_f_CAR_AC00_1WA_20240101000000.parquet"
+
+def test_different_settings_do_not_overwrite(analysis, result_cache, reads):
+    source = upload_source(source_frame(), name="settings")
+    first = analysis._glm_1wa(glm_request(source, var_cal_year=(2018, 2020)))
+    tables = read_response(first)
+    other = analysis._glm_1wa(glm_request(source, var_cal_year=(2019, 2019)))
+    assert other["data"]["sub_folder"] != first["data"]["sub_folder"]
+    assert other["data"]["table_detail_name"] == first["data"]["table_detail_name"]
+    # Bảng của lần chạy đầu vẫn nguyên và vẫn hit
+    assert_same_tables(tables, read_response(first))
+    analysis._glm_1wa(glm_request(source, var_cal_year=(2018, 2020)))
+    assert len(reads) == 2
+
+def test_changed_source_etag_misses(analysis, result_cache, reads):
+    source = upload_source(source_frame(seed=3), name="etag")
+    request = glm_request(source)
+    before = read_response(analysis._glm_2wa(request))
+    upload_source(source_frame(seed=4), name="etag")
+    after = read_response(analysis._glm_2wa(request))
+    assert len(reads) == 2
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(result_cache, "enabled", False)
+        fresh = read_response(analysis._glm_2wa(request))
+    assert_same_tables(fresh, after)
+    assert not before[0].equals(after[0])
+
+def test_rewritten_result_file_misses(analysis, result_cache, reads):
+    request = glm_request(upload_source(source_frame(), name="rewrite"), codes=["AC01"])
+    response = analysis._glm_1wa(request)
+    tables = read_response(response)
+    data = response["data"]
+    rewritten = f"{data['sub_folder']}/{data['table_detail_name'][0]}.parquet"
+    untouched = get_storage().head(data["s3_key"])["etag"]
+    get_storage().put(rewritten, b"not the result table")
+
+    again = analysis._glm_1wa(request)
+    # Chỉ code có file bị ghi đè được tính lại; file của code còn nguyên không bị ghi lại
+    assert len(reads) == 2
+    assert get_storage().head(data["s3_key"])["etag"] == untouched
+    assert_same_tables(tables, read_response(again))
+    analysis._glm_1wa(request)
+    assert len(reads) == 2
+
+def test_invalidate_source_removes_entries(analysis, result_cache, reads):
+    source = upload_source(source_frame(), name="invalidate")
+    request = glm_request(source, codes=["AC01"])
+    analysis._glm_1wa(request)
+    analysis._glm_2wa(request)
+    assert result_cache.invalidate_source(extract_parquet_key(source)) == 4
+    assert get_storage().list(result_cache.prefix + "/") == []
+    analysis._glm_1wa(request)
+    assert len(reads) == 3
+    assert result_cache.invalidate_source(extract_parquet_key(source)) == 2
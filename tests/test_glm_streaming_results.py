@@ -0,0 +1,62 @@
+"""
+Ghi kết quả streaming (ParquetResultSink / ParquetStreamWriter) phải đọc lại ra cùng bảng với đường gốc:
+pd.concat cả bảng kết quả rồi ghi một lần.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from conftest import (
+    ANALYSIS_FUNCS, analysis_combinations, analysis_request, assert_same_result, baseline_loop, make_portfolio,
+    read_result, round_trip,
+)
+from modules.parquet_writer import ParquetStreamWriter, write_parquet
+
+@pytest.mark.parametrize("nway", [1, 2, 4])
+@pytest.mark.parametrize("codes", [None, ['AC01', 'AC02']], ids=["base", "ac_codes"])
+def test_result_sink_matches_concat_then_write(analysis, nway, codes):
+    df = make_portfolio(3000, nway)
+    request_data = analysis_request([2018, 2020], codes)
+    func = getattr(analysis, ANALYSIS_FUNCS[nway])
+    combos, code_runs = analysis_combinations(nway), analysis._code_runs(request_data)
+
+    names, _, sub_folder = analysis._process_multiple_codes_analysis(df.copy(), request_data, func, combos, f"{nway}WA")
+    with baseline_loop():
+        expected = analysis._process_analysis_codes(df.copy(), request_data, func, combos, code_runs, allow_parallel=False)
+
+    assert len(names) == len(code_runs)
+    for name, expected_frame in zip(names, expected):
+        assert_same_result(round_trip(expected_frame), read_result(sub_folder, name))
+
+def read_back(buffer: io.BytesIO) -> pd.DataFrame:
+    buffer.seek(0)
+    return pq.read_table(buffer).to_pandas()
+
+def random_blocks(seed: int) -> list:
+    rng = np.random.default_rng(seed)
+    blocks = []
+    for _ in range(int(rng.integers(1, 12))):
+        n_rows = int(rng.integers(0, 700))
+        blocks.append(pd.DataFrame({
+            'VAR_CODE': rng.integers(1, 50, n_rows).astype(str),
+            'COUNT': rng.integers(0, 1000, n_rows),
+            'CLAIM_PMT': rng.random(n_rows) * 1e8,
+            'LABEL': rng.choice(['A', 'B', None], n_rows),
+        }))
+    return blocks
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("row_group_size", [1, 256, 100_000])
+def test_stream_writer_matches_concat_then_write(seed, row_group_size):
+    blocks = random_blocks(seed)
+    expected_buffer, stream_buffer = io.BytesIO(), io.BytesIO()
+    write_parquet(pd.concat(blocks, axis=0), expected_buffer, profile="analysis_result")
+    with ParquetStreamWriter(stream_buffer, profile="analysis_result", row_group_size=row_group_size) as writer:
+        for block in blocks:
+            writer.append(block)
+
+    assert writer.metadata.num_rows == sum(len(block) for block in blocks)
+    pd.testing.assert_frame_equal(read_back(expected_buffer), read_back(stream_buffer), check_exact=True)
@@ -0,0 +1,183 @@
+"""JobManager trên storage memory: submit → trạng thái → kết quả, huỷ, job mất worker, dùng lại job giống hệt"""
+import asyncio
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from modules import jobs
+from modules.jobs import JobManager, job_checkpoint, job_progress
+
+@pytest.fixture
+def manager():
+    return JobManager(max_workers=2, max_pending=5, prefix=f"test-jobs/{uuid.uuid4().hex}")
+
+def wait_finished(manager: JobManager, job_id: str, timeout: float = 5.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        record = manager.get(job_id)
+        if record["status"] in jobs.FINISHED_STATUSES:
+            return record
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish in {timeout}s")
+
+def blocking_job(started: threading.Event, release: threading.Event):
+    """Job chạy tới khi bị huỷ (qua checkpoint) hoặc được thả"""
+    def run():
+        started.set()
+        while not release.is_set():
+            job_checkpoint()
+            time.sleep(0.01)
+        return "released"
+    return run
+
+def test_submit_status_result(manager):
+    def compute(a, b, scale=1):
+        job_progress(1, 2, "half")
+        return {"total": (a + b) * scale}
+
+    record = manager.submit("sum", compute, 1, 2, scale=10)
+    assert record["owner"] == manager.owner
+    finished = wait_finished(manager, record["job_id"])
+    assert finished["status"] == jobs.SUCCEEDED and finished["progress"] == 1.0
+    assert manager.result(record["job_id"]) == {"total": 30}
+    # Bản ghi trên storage đọc được từ process khác (manager khác cùng prefix)
+    other = JobManager(prefix=manager.prefix)
+    assert other.get(record["job_id"])["result"] == {"total": 30}
+
+def test_coroutine_job_runs_in_own_event_loop(manager):
+    async def compute(value):
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    record = manager.submit("async", compute, 21)
+    assert wait_finished(manager, record["job_id"])["status"] == jobs.SUCCEEDED
+    assert manager.result(record["job_id"]) == 42
+
+def test_failed_job_reraises_http_error(manager):
+    def compute():
+        raise HTTPException(status_code=409, detail="bad settings")
+
+    record = manager.submit("fail", compute)
+    assert wait_finished(manager, record["job_id"])["status"] == jobs.FAILED
+    with pytest.raises(HTTPException) as error:
+        manager.result(record["job_id"])
+    assert (error.value.status_code, error.value.detail) == (409, "bad settings")
+
+def test_result_before_finish_is_409(manager):
+    started, release = threading.Event(), threading.Event()
+    record = manager.submit("block", blocking_job(started, release))
+    assert started.wait(5)
+    with pytest.raises(HTTPException) as error:
+        manager.result(record["job_id"])
+    assert error.value.status_code == 409
+    release.set()
+    assert wait_finished(manager, record["job_id"])["status"] == jobs.SUCCEEDED
+
+def test_cancel_running_job_stops_at_checkpoint(manager):
+    started, release = threading.Event(), threading.Event()
+    record = manager.submit("block", blocking_job(started, release))
+    assert started.wait(5)
+    manager.cancel(record["job_id"])
+    finished = wait_finished(manager, record["job_id"])
+    assert finished["status"] == jobs.CANCELLED
+    with pytest.raises(HTTPException) as error:
+        manager.result(record["job_id"])
+    assert error.value.status_code == 409
+    with pytest.raises(HTTPException) as error:
+        manager.cancel(record["job_id"])
+    assert error.value.status_code == 409
+    release.set()
+
+def test_cancel_queued_job_never_runs():
+    manager = JobManager(max_workers=1, max_pending=5, prefix=f"test-jobs/{uuid.uuid4().hex}")
+    started, release = threading.Event(), threading.Event()
+    running = manager.submit("block", blocking_job(started, release))
+    assert started.wait(5)
+    calls = []
+    queued = manager.submit("queued", lambda: calls.append(1))
+    assert manager.cancel(queued["job_id"])["status"] == jobs.CANCELLED
+    release.set()
+    wait_finished(manager, running["job_id"])
+    assert manager.get(queued["job_id"])["status"] == jobs.CANCELLED
+    assert calls == []
+
+def test_cancel_from_other_process_via_marker(manager, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_CANCEL_POLL_INTERVAL", 0)
+    started, release = threading.Event(), threading.Event()
+    record = manager.submit("block", blocking_job(started, release))
+    assert started.wait(5)
+    other = JobManager(prefix=manager.prefix)
+    other.cancel(record["job_id"])
+    assert wait_finished(manager, record["job_id"])["status"] == jobs.CANCELLED
+    # Marker huỷ được xoá khi job kết thúc
+    assert not manager.cancel_requested(record["job_id"])
+    release.set()
+
+def stale_record(manager: JobManager, heartbeat_age: float) -> dict:
+    heartbeat = (datetime.now(timezone.utc) - timedelta(seconds=heartbeat_age)).isoformat()
+    record = {
+        "job_id": uuid.uuid4().hex, "kind": "lost", "status": jobs.RUNNING, "progress": 0.5, "message": None,
+        "created_at": heartbeat, "owner": "other-host:1:deadbeef", "heartbeat_at": heartbeat,
+        "started_at": heartbeat, "finished_at": None, "error": None, "result": None,
+    }
+    manager.save(record)
+    return record
+
+def test_stale_owner_marked_failed_on_read(manager):
+    lost = stale_record(manager, heartbeat_age=jobs.JOB_STALE_SECONDS + 60)
+    alive = stale_record(manager, heartbeat_age=1)
+    record = manager.get(lost["job_id"])
+    assert record["status"] == jobs.FAILED and record["error"]["status_code"] == 500
+    # Trạng thái failed được ghi lại lên storage
+    assert JobManager(prefix=manager.prefix).get(lost["job_id"])["status"] == jobs.FAILED
+    assert manager.get(alive["job_id"])["status"] == jobs.RUNNING
+
+def test_cleanup_marks_stale_jobs_failed(manager, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 0.05)
+    lost = stale_record(manager, heartbeat_age=60)
+    time.sleep(0.1)
+    assert manager.cleanup() == {"failed": 1, "removed": 0}
+    assert manager.get(lost["job_id"])["status"] == jobs.FAILED
+
+def test_dedupe_key_reuses_active_job(manager):
+    started, release = threading.Event(), threading.Event()
+    first = manager.submit("block", blocking_job(started, release), dedupe_key="same")
+    assert started.wait(5)
+    again = manager.submit("block", blocking_job(threading.Event(), release), dedupe_key="same")
+    other = manager.submit("block", blocking_job(threading.Event(), release), dedupe_key="other")
+    assert again["job_id"] == first["job_id"]
+    assert other["job_id"] != first["job_id"]
+    release.set()
+    wait_finished(manager, first["job_id"])
+    wait_finished(manager, other["job_id"])
+    # Job đã kết thúc không được dùng lại
+    after = manager.submit("block", blocking_job(threading.Event(), release), dedupe_key="same")
+    assert after["job_id"] != first["job_id"]
+    wait_finished(manager, after["job_id"])
+
+def test_dedupe_key_not_reused_after_cancel(manager):
+    started, release = threading.Event(), threading.Event()
+    first = manager.submit("block", blocking_job(started, release), dedupe_key="same")
+    assert started.wait(5)
+    manager.cancel(first["job_id"])
+    again = manager.submit("block", blocking_job(threading.Event(), release), dedupe_key="same")
+    assert again["job_id"] != first["job_id"]
+    release.set()
+    wait_finished(manager, again["job_id"])
+
+def test_full_queue_is_503():
+    manager = JobManager(max_workers=1, max_pending=1, prefix=f"test-jobs/{uuid.uuid4().hex}")
+    started, release = threading.Event(), threading.Event()
+    running = manager.submit("block", blocking_job(started, release))
+    assert started.wait(5)
+    queued = manager.submit("queued", lambda: None)
+    with pytest.raises(HTTPException) as error:
+        manager.submit("queued", lambda: None)
+    assert error.value.status_code == 503 and error.value.headers["Retry-After"]
+    release.set()
+    wait_finished(manager, running["job_id"])
+    wait_finished(manager, queued["job_id"])
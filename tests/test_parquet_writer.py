@@ -0,0 +1,77 @@
+"""write_parquet: file phân vùng theo năm và các profile ghi phải đọc lại ra đúng dữ liệu đã ghi"""
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from modules.parquet_writer import PARQUET_WRITE_PROFILES, get_write_profile, write_parquet
+
+def read_back(buffer: io.BytesIO) -> pd.DataFrame:
+    buffer.seek(0)
+    return pq.read_table(buffer).to_pandas()
+
+@pytest.mark.parametrize("as_table", [False, True], ids=["dataframe", "arrow_table"])
+@pytest.mark.parametrize("row_group_size", [7, 1000])
+def test_partitioned_write_keeps_rows_and_one_year_per_row_group(as_table, row_group_size):
+    rng = np.random.default_rng(row_group_size)
+    df = pd.DataFrame({
+        'CAL_YEAR': rng.choice([2020, 2018, 2019, 0], 500),
+        'POLICY_ID': rng.integers(0, 200, 500).astype(str),
+        'CLAIM_PMT': rng.random(500),
+    })
+    data = pa.Table.from_pandas(df, preserve_index=False) if as_table else df
+    buffer = io.BytesIO()
+    metadata = write_parquet(data, buffer, row_group_size=row_group_size, partition_by='CAL_YEAR')
+
+    # Cùng tập dòng (giữ thứ tự trong mỗi năm), mỗi row group chỉ một năm và không quá row_group_size dòng
+    expected = df.sort_values('CAL_YEAR', kind='stable').reset_index(drop=True)
+    pd.testing.assert_frame_equal(expected, read_back(buffer), check_exact=True)
+    year_column = metadata.schema.to_arrow_schema().get_field_index('CAL_YEAR')
+    for index in range(metadata.num_row_groups):
+        row_group = metadata.row_group(index)
+        statistics = row_group.column(year_column).statistics
+        assert statistics.min == statistics.max
+        assert row_group.num_rows <= row_group_size
+
+def test_partitioned_write_does_not_reorder_input():
+    df = pd.DataFrame({'CAL_YEAR': [2020, 2018, 2020, 2019], 'VALUE': [1, 2, 3, 4]})
+    before = df.copy()
+    write_parquet(df, io.BytesIO(), partition_by='CAL_YEAR')
+    pd.testing.assert_frame_equal(before, df)
+
+@pytest.mark.parametrize("profile", list(PARQUET_WRITE_PROFILES))
+def test_profiles_round_trip(profile):
+    rng = np.random.default_rng(3)
+    df = pd.DataFrame({
+        'CAL_YEAR': rng.integers(2018, 2021, 3000),
+        'BRAND': rng.choice(['A', 'B', None], 3000),
+        'CLAIM_PMT': rng.random(3000) * 1e8,
+        'ISSUE_DATE': pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 10 ** 6, 3000), unit='s'),
+    })
+    buffer = io.BytesIO()
+    metadata = write_parquet(df, buffer, profile=profile)
+    options = get_write_profile(profile)
+    assert metadata.num_rows == len(df)
+    assert metadata.row_group(0).column(0).compression.lower() == options["compression"]
+    pd.testing.assert_frame_equal(df, read_back(buffer), check_dtype=False)
+
+def test_write_options_override_profile():
+    buffer = io.BytesIO()
+    metadata = write_parquet(pd.DataFrame({'A': range(10)}), buffer, profile="bulk_import", compression="gzip")
+    assert metadata.row_group(0).column(0).compression.lower() == "gzip"
+
+def test_unknown_profile_raises():
+    with pytest.raises(ValueError):
+        get_write_profile("no_such_profile")
+
+def test_bulk_import_rejects_sub_millisecond_timestamps_default_accepts():
+    """coerce_timestamps='ms' của bulk_import lỗi với timestamp lẻ micro giây; bản ghi lại không profile (fallback của import) ghi được"""
+    df = pd.DataFrame({'ISSUE_DATE': pd.to_datetime(['2024-01-01 00:00:00.000001'])})
+    with pytest.raises(pa.ArrowInvalid):
+        write_parquet(df, io.BytesIO(), profile="bulk_import")
+    buffer = io.BytesIO()
+    write_parquet(df, buffer)
+    pd.testing.assert_frame_equal(df, read_back(buffer), check_dtype=False)
@@ -0,0 +1,135 @@
+"""SingleFlight: gộp request giống nhau đang chạy, lỗi / huỷ dùng chung, giữ kết quả trong TTL; request_key chuẩn hoá URL"""
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from modules.single_flight import SingleFlight, request_key
+
+def counting(result="done", delay=0.05, error=None):
+    calls = []
+
+    async def compute(*args):
+        calls.append(args)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return result
+    return compute, calls
+
+def test_concurrent_identical_requests_coalesce():
+    flights = SingleFlight(ttl=0)
+    compute, calls = counting()
+
+    async def main():
+        return await asyncio.gather(*(flights.run("key", compute, i) for i in range(5)))
+
+    assert asyncio.run(main()) == ["done"] * 5
+    assert len(calls) == 1
+
+def test_different_keys_do_not_coalesce():
+    flights = SingleFlight(ttl=0)
+    compute, calls = counting()
+
+    async def main():
+        return await asyncio.gather(flights.run("a", compute), flights.run("b", compute))
+
+    asyncio.run(main())
+    assert len(calls) == 2
+
+def test_error_propagates_to_every_waiter_and_is_not_cached():
+    flights = SingleFlight(ttl=60)
+    compute, calls = counting(error=HTTPException(status_code=409, detail="bad settings"))
+
+    async def main():
+        return await asyncio.gather(*(flights.run("key", compute) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(isinstance(result, HTTPException) and result.status_code == 409 for result in results)
+    # Lỗi không được giữ lại: lần sau tính lại
+    with pytest.raises(HTTPException):
+        asyncio.run(flights.run("key", compute))
+    assert len(calls) == 2
+
+def test_result_kept_for_ttl_then_recomputed():
+    flights = SingleFlight(ttl=0.2)
+    compute, calls = counting(delay=0)
+
+    asyncio.run(flights.run("key", compute))
+    asyncio.run(flights.run("key", compute))
+    assert len(calls) == 1
+    time.sleep(0.25)
+    asyncio.run(flights.run("key", compute))
+    assert len(calls) == 2
+
+def test_leader_cancelled_fails_followers_with_503():
+    flights = SingleFlight(ttl=60)
+    compute, calls = counting(delay=10)
+
+    async def main():
+        leader = asyncio.create_task(flights.run("key", compute))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flights.run("key", compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        with pytest.raises(HTTPException) as error:
+            await follower
+        return error.value
+
+    error = asyncio.run(main())
+    assert error.status_code == 503
+    assert len(calls) == 1
+    # Không còn in-flight / kết quả giữ lại cho key: request sau tính lại
+    quick, quick_calls = counting(delay=0)
+    assert asyncio.run(flights.run("key", quick)) == "done"
+    assert len(quick_calls) == 1
+
+def test_cancelled_follower_does_not_cancel_leader():
+    flights = SingleFlight(ttl=0)
+    compute, calls = counting(delay=0.1)
+
+    async def main():
+        leader = asyncio.create_task(flights.run("key", compute))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flights.run("key", compute))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        return await leader
+
+    assert asyncio.run(main()) == "done"
+    assert len(calls) == 1
+
+def test_disabled_runs_every_request():
+    flights = SingleFlight(enabled=False)
+    compute, calls = counting(delay=0)
+
+    async def main():
+        return await asyncio.gather(flights.run("key", compute), flights.run("key", compute))
+
+    asyncio.run(main())
+    assert len(calls) == 2
+
+def glm_body(table_name: str) -> dict:
+    return {"json_settings": {"tableName": table_name, "userName": "u", "nameFunc": "f", "nameProduct": "CAR"}}
+
+def test_request_key_ignores_url_signature():
+    """Cùng file ký lại (chữ ký / hạn khác) và dạng s3:// cho cùng key; file khác / thiết lập khác cho key khác"""
+    signed = "http://localhost:9000/test-bucket/report-software/glm/u/x.parquet?X-Amz-Signature={}&X-Amz-Date={}"
+    keys = {
+        request_key("glm_1wa", glm_body(signed.format("abc", "20240101"))),
+        request_key("glm_1wa", glm_body(signed.format("def", "20240102"))),
+        request_key("glm_1wa", glm_body("s3://test-bucket/report-software/glm/u/x.parquet")),
+    }
+    assert len(keys) == 1
+    assert request_key("glm_1wa", glm_body("s3://test-bucket/report-software/glm/u/y.parquet")) not in keys
+    assert request_key("glm_2wa", glm_body(signed.format("abc", "20240101"))) not in keys
+
+def test_request_key_external_url_keeps_identifying_query():
+    first = request_key("glm_1wa", glm_body("https://files.example.com/export?id=1&Signature=a&Expires=1"))
+    resigned = request_key("glm_1wa", glm_body("https://files.example.com/export?id=1&Signature=b&Expires=2"))
+    other = request_key("glm_1wa", glm_body("https://files.example.com/export?id=2&Signature=a&Expires=1"))
+    assert first == resigned != other
@@ -0,0 +1,57 @@
+"""Chọn backend lưu trữ theo config (biến môi trường ghi đè) và các thao tác cơ bản của backend memory / local"""
+import pyarrow as pa
+import pytest
+
+from modules import storage
+
+@pytest.fixture
+def fresh_storage(monkeypatch):
+    monkeypatch.setattr(storage, "_storage", None)
+    monkeypatch.delenv("STORAGE_BACKEND", raising=False)
+    config = dict(storage.cfg)
+    monkeypatch.setattr(storage, "cfg", config)
+    return config
+
+def test_backend_from_config(fresh_storage):
+    fresh_storage["STORAGE_BACKEND"] = "Memory"
+    assert storage.configured_backend() == "memory"
+    assert isinstance(storage.get_storage(), storage.MemoryStorage)
+
+def test_env_overrides_config(fresh_storage, monkeypatch):
+    fresh_storage["STORAGE_BACKEND"] = "memory"
+    monkeypatch.setenv("STORAGE_BACKEND", "local")
+    assert storage.configured_backend() == "local"
+    assert isinstance(storage.get_storage(), storage.LocalStorage)
+
+def test_default_is_s3(fresh_storage):
+    fresh_storage.pop("STORAGE_BACKEND", None)
+    assert storage.configured_backend() == "s3"
+
+def test_unknown_backend_raises(fresh_storage):
+    fresh_storage["STORAGE_BACKEND"] = "ftp"
+    with pytest.raises(ValueError, match="ftp"):
+        storage.get_storage()
+
+@pytest.mark.parametrize("backend", ["memory", "local"])
+def test_backend_round_trip(backend, tmp_path):
+    store = storage.MemoryStorage() if backend == "memory" else storage.LocalStorage(root=str(tmp_path))
+    store.put("a/x.bin", b"0123456789")
+    with store.open_writer("a/y.bin") as writer:
+        writer.write(b"abc")
+    assert store.get("a/y.bin") == b"abc"
+    assert [item["key"] for item in store.list("a/")] == ["a/x.bin", "a/y.bin"]
+    with store.open_input_file("a/x.bin") as source:
+        source.seek(3)
+        assert source.read(4) == b"3456"
+    with pytest.raises(FileNotFoundError):
+        store.head("a/missing.bin")
+    # Lỗi trong context: object không xuất hiện
+    with pytest.raises(RuntimeError):
+        with store.open_writer("a/z.bin") as writer:
+            writer.write(b"partial")
+            raise RuntimeError("boom")
+    with pytest.raises(FileNotFoundError):
+        store.head("a/z.bin")
+    store.delete("a/x.bin")
+    assert [item["key"] for item in store.list("a/")] == ["a/y.bin"]
+    assert isinstance(store.open_input_file("a/y.bin"), pa.NativeFile)
@@ -0,0 +1,94 @@
+"""ArrowTableCache: chạy lại cùng phân tích dùng dữ liệu từ cache cho kết quả giống hệt; entry đang lease không bị evict"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import glm_request, make_portfolio, read_response, upload_source
+from modules.table_cache import ArrowTableCache
+from modules.GLM.glm_histogram import preaggregate_cache
+from services import glm_service
+
+@pytest.fixture
+def table_cache(monkeypatch):
+    cache = ArrowTableCache(max_bytes=512 * 1024 ** 2, enabled=True)
+    monkeypatch.setattr(glm_service, "arrow_table_cache", cache)
+    # 1WA chạy lại sẽ suy bảng từ histogram đã lưu mà không cần dữ liệu: tắt để lần chạy sau đi qua cache bảng
+    monkeypatch.setattr(preaggregate_cache, "enabled", False)
+    return cache
+
+def counted_reads(monkeypatch, analysis) -> list:
+    calls = []
+    read = analysis._read_parquet_data
+
+    def counting(*args, **kwargs):
+        calls.append(args[0])
+        return read(*args, **kwargs)
+    monkeypatch.setattr(analysis, "_read_parquet_data", counting)
+    return calls
+
+@pytest.mark.parametrize("analysis_type", ["1WA", "2WA"])
+@pytest.mark.parametrize("codes", [None, ["AC01", "AC02"]])
+def test_repeat_run_uses_cache_and_matches(analysis, table_cache, monkeypatch, analysis_type, codes):
+    source = upload_source(make_portfolio(3000, seed=7).drop(columns=["VEHICLE_VALUE_GROUP"]), name="cached")
+    request = glm_request(source, codes=codes)
+    run = getattr(analysis, f"_glm_{analysis_type.lower()}")
+    reads = counted_reads(monkeypatch, analysis)
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(table_cache, "enabled", False)
+        uncached = read_response(run(request))
+    first = read_response(run(request))
+    second = read_response(run(request))
+
+    # Lần chạy thứ hai lấy dữ liệu đã xử lý từ cache, không đọc lại file
+    assert len(reads) == 2
+    assert len(table_cache._entries) == 1
+    for expected, frames in ((uncached, first), (uncached, second)):
+        assert len(frames) == len(expected)
+        for e, r in zip(expected, frames):
+            pd.testing.assert_frame_equal(e, r)
+
+def test_leased_data_not_changed_by_caller(table_cache):
+    df = pd.DataFrame({"a": np.arange(5, dtype=float), "b": list("vwxyz")})
+    with table_cache.lease("k", lambda: df.copy()):
+        pass
+    with table_cache.lease("k", lambda: pytest.fail("loader called on a cache hit")) as leased:
+        leased["a"] = leased["a"] * 10
+        leased.drop(columns=["b"], inplace=True)
+    with table_cache.lease("k", lambda: pytest.fail("loader called on a cache hit")) as leased:
+        # Cột numeric dùng chung bộ nhớ với bảng trong cache nên là read-only: ghi tại chỗ bị từ chối
+        with pytest.raises(ValueError):
+            leased.loc[0, "a"] = -1.0
+    with table_cache.lease("k", lambda: pytest.fail("loader called on a cache hit")) as again:
+        pd.testing.assert_frame_equal(again, df)
+
+def frame(n_rows: int, seed: int) -> pd.DataFrame:
+    return pd.DataFrame({"x": np.random.default_rng(seed).random(n_rows)})
+
+def test_eviction_skips_leased_entries():
+    size = ArrowTableCache(enabled=True)
+    with size.lease("probe", lambda: frame(1000, 0)):
+        pass
+    # Budget vừa đủ cho một bảng
+    cache = ArrowTableCache(max_bytes=int(size.total_bytes * 1.5), enabled=True)
+
+    with cache.lease("a", lambda: frame(1000, 1)):
+        with cache.lease("b", lambda: frame(1000, 2)):
+            # Vượt budget nhưng cả hai đang được dùng: không evict
+            assert set(cache._entries) == {"a", "b"}
+        # "b" hết lease → bị evict thay cho "a" (cũ hơn nhưng còn lease)
+        assert set(cache._entries) == {"a"}
+        with cache.lease("c", lambda: frame(1000, 3)):
+            assert set(cache._entries) == {"a", "c"}
+        assert set(cache._entries) == {"a"}
+    # Khi không còn lease, entry ít dùng nhất bị evict như LRU bình thường
+    with cache.lease("d", lambda: frame(1000, 4)):
+        pass
+    assert set(cache._entries) == {"d"}
+    assert cache.total_bytes <= cache.max_bytes
+
+def test_table_larger_than_budget_not_cached():
+    cache = ArrowTableCache(max_bytes=100, enabled=True)
+    with cache.lease("big", lambda: frame(1000, 0)) as df:
+        assert len(df) == 1000
+    assert not cache._entries and cache.total_bytes == 0